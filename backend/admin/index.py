@@ -1,9 +1,607 @@
 import json
 import os
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
+from handler_core import (
+    CACHE_GENERATION_KEY, CHANNEL_CACHE_MAX_ENTRIES, CHANNEL_CACHE_TTL, CHANNEL_GENERATION_KEY, SESSION_TTL,
+    VIDEO_COLUMNS, ChannelCache, TimedCursor, error_response, get_conn, instrumented, make_cache_backend, put_conn,
+    respond, set_action, verify_session,
+)
+
+STATS_MAX_AGE = float(os.environ.get('STATS_MAX_AGE', '60'))
+
+FANOUT_BATCH_SIZE = int(os.environ.get('FANOUT_BATCH_SIZE', '1000'))
+FANOUT_MAX_ATTEMPTS = 5
+
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', '90'))
+# Сколько будущих месяцев notifications держать уже созданными секциями
+NOTIFICATION_PARTITIONS_AHEAD = 3
+COMPACTION_QUERIES = (
+    # Удаление по (id, created_at): ключ секции позволяет сразу попасть в нужную секцию
+    ('notifications', """
+        DELETE FROM notifications n
+        USING (
+            SELECT id, created_at FROM notifications
+            WHERE is_read AND created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+            ORDER BY created_at, id
+            LIMIT %s
+        ) expired
+        WHERE n.id = expired.id AND n.created_at = expired.created_at
+    """),
+    ('notification_jobs', """
+        DELETE FROM notification_jobs WHERE id IN (
+            SELECT id FROM notification_jobs
+            WHERE status IN ('done', 'failed') AND created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+            ORDER BY id
+            LIMIT %s
+        )
+    """),
+)
+
+SCORE_BATCH_SIZE = int(os.environ.get('SCORE_BATCH_SIZE', '5000'))
+# Изменения моложе этого возраста ждут следующего запуска: их транзакции могли ещё не закоммититься
+SCORE_SETTLE_SECONDS = int(os.environ.get('SCORE_SETTLE_SECONDS', '60'))
+# Тренд = log10(вовлечённость) + возраст / TRENDING_DECAY_SECONDS: каждые 12.5 часов свежести
+# стоят десятикратной вовлечённости, и порядок видео не меняется со временем сам по себе
+TRENDING_DECAY_SECONDS = 45000
+TRENDING_EPOCH = 1704067200
+LIKE_WEIGHT = 20
+DISLIKE_WEIGHT = 10
+
+MAX_BULK_IDS = 5000
+
+REPORT_STATUSES = ('pending', 'approved', 'rejected')
+VIDEO_STATUSES = ('published', 'blocked', 'review')
+USER_ROLES = ('user', 'moderator', 'admin')
+
+BULK_ID_KEYS = {
+    'resolve_report': ('report_id', 'report_ids'),
+    'update_video_status': ('video_id', 'video_ids'),
+    'verify_user': ('user_id', 'user_ids'),
+    'change_role': ('user_id', 'user_ids'),
+}
+# Допустимые ключи фильтра: int - id, кортеж - список значений.
+# status только сужает выборку, без других ключей или ids фильтр не принимается
+BULK_FILTERS: Dict[str, Dict[str, Any]] = {
+    'resolve_report': {'video_id': int, 'comment_id': int, 'status': REPORT_STATUSES},
+    'update_video_status': {'user_id': int, 'status': VIDEO_STATUSES},
+    'verify_user': {},
+    'change_role': {},
+}
+
+def is_id(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def requested_ids(body_data: Dict[str, Any], single_key: str, list_key: str) -> Optional[List[int]]:
+    '''
+    Собирает id из одиночного поля или списка, сохраняя порядок и убирая дубли
+    Raises: ValueError - если id не целые, список пуст или id больше MAX_BULK_IDS
+    '''
+    raw_ids = body_data.get(list_key)
+    if raw_ids is None:
+        single_id = body_data.get(single_key)
+        raw_ids = [single_id] if single_id is not None else None
+    if raw_ids is None:
+        return None
+    if not isinstance(raw_ids, list) or not all(is_id(raw_id) for raw_id in raw_ids):
+        raise ValueError('Invalid ids')
+    if not raw_ids:
+        raise ValueError('ids must not be empty')
+    ids = list(dict.fromkeys(raw_ids))
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError('Too many ids')
+    return ids
+
+def bulk_target(body_data: Dict[str, Any]) -> Tuple[Optional[List[int]], Dict[str, Any]]:
+    '''
+    Определяет, к каким записям применяется массовое действие
+    Returns: (список id или None, фильтр)
+    Raises: ValueError - если id или фильтр некорректны либо не ограничивают выборку
+    '''
+    allowed = BULK_FILTERS[body_data['action']]
+    filters = body_data.get('filter') or {}
+    if not isinstance(filters, dict):
+        raise ValueError('Invalid filter')
+    unknown = sorted(set(filters) - set(allowed))
+    if unknown:
+        raise ValueError(f"Unknown filter keys: {', '.join(unknown)}")
+    for key, value in filters.items():
+        if not (is_id(value) if allowed[key] is int else value in allowed[key]):
+            raise ValueError(f'Invalid filter {key}')
+    
+    ids = requested_ids(body_data, *BULK_ID_KEYS[body_data['action']])
+    if ids is None and not set(filters) - {'status'}:
+        raise ValueError('ids or filter required')
+    return ids, filters
+
+def bulk_result(ids: Optional[List[int]], updated_rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    updated = {row['id'] for row in updated_rows}
+    if ids is None:
+        results = [{'id': row_id, 'status': 'updated'} for row_id in sorted(updated)]
+    else:
+        results = [{'id': row_id, 'status': 'updated' if row_id in updated else 'not_found'} for row_id in ids]
+    return {'success': True, 'updated': len(updated), 'results': results}
+
+response_cache = make_cache_backend()
+channel_cache = ChannelCache(response_cache, CHANNEL_CACHE_MAX_ENTRIES, CHANNEL_CACHE_TTL)
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': '',
+    'isBase64Encoded': False
+}
+
+def stats(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    snapshot = None
+    if params.get('fresh') != '1':
+        cur.execute(
+            """
+            SELECT total_users, total_videos, total_comments, pending_reports, refreshed_at,
+                   EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - refreshed_at)::float AS stale_seconds
+            FROM dashboard_stats
+            WHERE id = 1
+            """
+        )
+        snapshot = cur.fetchone()
+    
+    if not snapshot or snapshot['stale_seconds'] > STATS_MAX_AGE:
+        cur.execute(
+            """
+            INSERT INTO dashboard_stats (id, total_users, total_videos, total_comments, pending_reports, refreshed_at)
+            SELECT 1,
+                   (SELECT COUNT(*) FROM users),
+                   (SELECT COUNT(*) FROM videos),
+                   (SELECT COUNT(*) FROM comments),
+                   (SELECT COUNT(*) FROM reports WHERE status = 'pending'),
+                   CURRENT_TIMESTAMP
+            ON CONFLICT (id) DO UPDATE SET
+                total_users = EXCLUDED.total_users,
+                total_videos = EXCLUDED.total_videos,
+                total_comments = EXCLUDED.total_comments,
+                pending_reports = EXCLUDED.pending_reports,
+                refreshed_at = EXCLUDED.refreshed_at
+            RETURNING total_users, total_videos, total_comments, pending_reports, refreshed_at,
+                      0::float AS stale_seconds
+            """
+        )
+        snapshot = cur.fetchone()
+        conn.commit()
+    
+    return respond(200, {
+        'stats': {
+            'total_users': snapshot['total_users'],
+            'total_videos': snapshot['total_videos'],
+            'total_comments': snapshot['total_comments'],
+            'pending_reports': snapshot['pending_reports']
+        },
+        'refreshed_at': snapshot['refreshed_at'],
+        'stale_seconds': round(snapshot['stale_seconds'], 3)
+    })
+
+def list_reports(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    cur.execute(
+        """
+        SELECT r.*, 
+               u.name as reporter_name,
+               v.title as video_title,
+               c.text as comment_text
+        FROM reports r
+        LEFT JOIN users u ON r.reporter_id = u.id
+        LEFT JOIN videos v ON r.video_id = v.id
+        LEFT JOIN comments c ON r.comment_id = c.id
+        WHERE r.status = 'pending'
+        ORDER BY r.created_at DESC
+        LIMIT 50
+        """
+    )
+    return respond(200, {'reports': [dict(row) for row in cur.fetchall()]})
+
+def list_users(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    cur.execute(
+        """
+        SELECT id, email, name, avatar_url, subscribers_count, role, is_verified, created_at
+        FROM users
+        ORDER BY created_at DESC
+        LIMIT 100
+        """
+    )
+    return respond(200, {'users': [dict(row) for row in cur.fetchall()]})
+
+def list_videos(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    cur.execute(
+        f"""
+        SELECT {VIDEO_COLUMNS}
+        FROM videos v
+        ORDER BY v.created_at DESC
+        LIMIT 100
+        """
+    )
+    videos = channel_cache.attach(cur, [dict(row) for row in cur.fetchall()], ('channel_name',))
+    return respond(200, {'videos': videos})
+
+def resolve_report(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    if body_data.get('status') not in REPORT_STATUSES:
+        return error_response(400, 'Invalid status')
+    try:
+        ids, filters = bulk_target(body_data)
+    except ValueError as e:
+        return error_response(400, str(e))
+    
+    cur.execute(
+        """
+        UPDATE reports SET status = %(status)s, reviewed_by = %(reviewer_id)s, updated_at = CURRENT_TIMESTAMP
+        WHERE (%(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[]))
+          AND (%(video_id)s::int IS NULL OR video_id = %(video_id)s::int)
+          AND (%(comment_id)s::int IS NULL OR comment_id = %(comment_id)s::int)
+          AND (%(current_status)s::varchar IS NULL OR status = %(current_status)s::varchar)
+        RETURNING id
+        """,
+        {
+            'status': body_data.get('status'),
+            'reviewer_id': body_data.get('reviewer_id'),
+            'ids': ids,
+            'video_id': filters.get('video_id'),
+            'comment_id': filters.get('comment_id'),
+            'current_status': filters.get('status', 'pending') if filters else None
+        }
+    )
+    result = bulk_result(ids, cur.fetchall())
+    conn.commit()
+    
+    return respond(200, result)
+
+def update_video_status(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    if body_data.get('status') not in VIDEO_STATUSES:
+        return error_response(400, 'Invalid status')
+    try:
+        ids, filters = bulk_target(body_data)
+    except ValueError as e:
+        return error_response(400, str(e))
+    
+    cur.execute(
+        """
+        WITH updated AS (
+            UPDATE videos SET status = %(status)s, is_moderated = true, updated_at = CURRENT_TIMESTAMP
+            WHERE (%(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[]))
+              AND (%(channel_id)s::int IS NULL OR user_id = %(channel_id)s::int)
+              AND (%(current_status)s::varchar IS NULL OR status = %(current_status)s::varchar)
+            RETURNING id
+        ), hidden AS (
+            UPDATE video_scores s SET is_published = %(status)s = 'published'
+            FROM updated WHERE s.video_id = updated.id
+        )
+        SELECT id FROM updated
+        """,
+        {
+            'status': body_data.get('status'),
+            'ids': ids,
+            'channel_id': filters.get('user_id'),
+            'current_status': filters.get('status')
+        }
+    )
+    result = bulk_result(ids, cur.fetchall())
+    conn.commit()
+    response_cache.incr(CACHE_GENERATION_KEY)
+    
+    return respond(200, result)
+
+def verify_user(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    if not isinstance(body_data.get('is_verified', True), bool):
+        return error_response(400, 'Invalid is_verified')
+    try:
+        ids, _ = bulk_target(body_data)
+    except ValueError as e:
+        return error_response(400, str(e))
+    
+    cur.execute(
+        "UPDATE users SET is_verified = %s WHERE id = ANY(%s::int[]) RETURNING id",
+        (body_data.get('is_verified', True), ids)
+    )
+    result = bulk_result(ids, cur.fetchall())
+    conn.commit()
+    # Галочка есть и в закэшированных ответах ленты
+    response_cache.incr(CHANNEL_GENERATION_KEY)
+    response_cache.incr(CACHE_GENERATION_KEY)
+    
+    return respond(200, result)
+
+def change_role(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    if body_data.get('role') not in USER_ROLES:
+        return error_response(400, 'Invalid role')
+    try:
+        ids, _ = bulk_target(body_data)
+    except ValueError as e:
+        return error_response(400, str(e))
+    
+    # Роль зашита в токены, поэтому уже выданные сессии этих пользователей отзываются
+    cur.execute(
+        """
+        WITH changed AS (
+            UPDATE users SET role = %(role)s WHERE id = ANY(%(ids)s::int[]) RETURNING id
+        ), revoked AS (
+            INSERT INTO revoked_sessions (user_id, issued_before, expires_at)
+            SELECT id, %(now)s, CURRENT_TIMESTAMP + make_interval(secs => %(ttl)s) FROM changed
+        )
+        SELECT id FROM changed
+        """,
+        {'role': body_data.get('role'), 'ids': ids, 'now': int(time.time()), 'ttl': SESSION_TTL}
+    )
+    result = bulk_result(ids, cur.fetchall())
+    conn.commit()
+    
+    return respond(200, result)
+
+def reconcile_counters(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Пересчитывает likes_count/dislikes_count по video_likes пачками по диапазонам id
+    '''
+    batch_size = min(int(body_data.get('batch_size', 5000)), 50000)
+    max_batches = int(body_data.get('max_batches', 100))
+    last_id = int(body_data.get('start_after', 0))
+    fixed = 0
+    
+    for _ in range(max_batches):
+        cur.execute(
+            "SELECT MAX(id) AS upper_id FROM (SELECT id FROM videos WHERE id > %s ORDER BY id LIMIT %s) batch",
+            (last_id, batch_size)
+        )
+        upper_id = cur.fetchone()['upper_id']
+        if upper_id is None:
+            last_id = None
+            break
+        
+        cur.execute(
+            """
+            UPDATE videos v SET likes_count = c.likes, dislikes_count = c.dislikes, updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT b.id,
+                       COUNT(l.id) FILTER (WHERE l.is_like) AS likes,
+                       COUNT(l.id) FILTER (WHERE NOT l.is_like) AS dislikes
+                FROM videos b
+                LEFT JOIN video_likes l ON l.video_id = b.id
+                WHERE b.id > %s AND b.id <= %s
+                GROUP BY b.id
+            ) c
+            WHERE v.id = c.id
+              AND (v.likes_count IS DISTINCT FROM c.likes OR v.dislikes_count IS DISTINCT FROM c.dislikes)
+            """,
+            (last_id, upper_id)
+        )
+        fixed += cur.rowcount
+        conn.commit()
+        last_id = upper_id
+    
+    return respond(200, {'fixed': fixed, 'next_start_after': last_id})
+
+def recompute_scores(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Пересчитывает video_scores для видео, изменённых после прошлого запуска
+    Идёт пачками по (updated_at, id) и сохраняет позицию в job_checkpoints после каждой пачки
+    '''
+    batch_size = min(int(body_data.get('batch_size', SCORE_BATCH_SIZE)), 50000)
+    max_batches = int(body_data.get('max_batches', 100))
+    summary = {'batches': 0, 'scored': 0, 'done': False}
+    
+    cur.execute("INSERT INTO job_checkpoints (name) VALUES ('video_scores') ON CONFLICT (name) DO NOTHING")
+    conn.commit()
+    
+    for _ in range(max_batches):
+        cur.execute(
+            "SELECT last_updated_at, last_id FROM job_checkpoints WHERE name = 'video_scores' FOR UPDATE SKIP LOCKED"
+        )
+        checkpoint = cur.fetchone()
+        if not checkpoint:
+            conn.rollback()
+            return error_response(409, 'Score recompute already running')
+        
+        cur.execute(
+            """
+            WITH changed AS (
+                SELECT id, category, status, views_count, likes_count, dislikes_count, created_at, updated_at,
+                       views_count + %(like_weight)s * likes_count - %(dislike_weight)s * dislikes_count AS engagement
+                FROM videos
+                WHERE (updated_at, id) > (%(last_updated_at)s, %(last_id)s)
+                  AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %(settle)s)
+                ORDER BY updated_at, id
+                LIMIT %(batch_size)s
+            ), upserted AS (
+                INSERT INTO video_scores (video_id, category, is_published, trending_score, popular_score, computed_at)
+                SELECT id, category, status = 'published',
+                       SIGN(engagement) * LOG(GREATEST(ABS(engagement), 1))
+                           + (EXTRACT(EPOCH FROM created_at) - %(epoch)s) / %(decay)s,
+                       views_count + %(like_weight)s * likes_count - %(dislike_weight)s * dislikes_count,
+                       CURRENT_TIMESTAMP
+                FROM changed
+                ON CONFLICT (video_id) DO UPDATE SET
+                    category = EXCLUDED.category,
+                    is_published = EXCLUDED.is_published,
+                    trending_score = EXCLUDED.trending_score,
+                    popular_score = EXCLUDED.popular_score,
+                    computed_at = EXCLUDED.computed_at
+            )
+            SELECT updated_at, id, COUNT(*) OVER () AS scored
+            FROM changed
+            ORDER BY updated_at DESC, id DESC
+            LIMIT 1
+            """,
+            {
+                'last_updated_at': checkpoint['last_updated_at'],
+                'last_id': checkpoint['last_id'],
+                'settle': SCORE_SETTLE_SECONDS,
+                'batch_size': batch_size,
+                'like_weight': LIKE_WEIGHT,
+                'dislike_weight': DISLIKE_WEIGHT,
+                'epoch': TRENDING_EPOCH,
+                'decay': TRENDING_DECAY_SECONDS
+            }
+        )
+        last = cur.fetchone()
+        if not last:
+            conn.commit()
+            summary['done'] = True
+            break
+        
+        cur.execute(
+            """
+            UPDATE job_checkpoints SET last_updated_at = %s, last_id = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE name = 'video_scores'
+            """,
+            (last['updated_at'], last['id'])
+        )
+        conn.commit()
+        summary['batches'] += 1
+        summary['scored'] += last['scored']
+        if last['scored'] < batch_size:
+            summary['done'] = True
+            break
+    
+    response_cache.incr(CACHE_GENERATION_KEY)
+    return respond(200, summary)
+
+def compact_notifications(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Удаляет пачками прочитанные уведомления и завершённые рассылки старше срока хранения
+    Непрочитанные уведомления не трогает, поэтому notification_counters остаются точными
+    Заодно создаёт месячные секции notifications на NOTIFICATION_PARTITIONS_AHEAD месяцев вперёд
+    '''
+    batch_size = min(int(body_data.get('batch_size', 5000)), 50000)
+    max_batches = int(body_data.get('max_batches', 100))
+    retention_days = int(body_data.get('retention_days', NOTIFICATION_RETENTION_DAYS))
+    
+    cur.execute("SELECT create_notification_partitions(%s) AS created", (NOTIFICATION_PARTITIONS_AHEAD,))
+    summary: Dict[str, Any] = {'batches': 0, 'done': True, 'partitions_created': cur.fetchone()['created']}
+    conn.commit()
+    
+    for table, query in COMPACTION_QUERIES:
+        summary[table] = 0
+        while True:
+            if summary['batches'] >= max_batches:
+                summary['done'] = False
+                return respond(200, summary)
+            cur.execute(query, (retention_days, batch_size))
+            deleted = cur.rowcount
+            conn.commit()
+            summary['batches'] += 1
+            summary[table] += deleted
+            if deleted < batch_size:
+                break
+    
+    return respond(200, summary)
+
+def fanout_notifications(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Воркер outbox: раскладывает уведомления о новых видео подписчикам пачками
+    '''
+    batch_size = min(int(body_data.get('batch_size', FANOUT_BATCH_SIZE)), 10000)
+    max_batches = int(body_data.get('max_batches', 50))
+    summary = {'batches': 0, 'delivered': 0, 'completed_jobs': 0, 'failed_jobs': 0}
+    
+    for _ in range(max_batches):
+        cur.execute(
+            """
+            SELECT id, channel_id, title, message, link, last_subscriber_id
+            FROM notification_jobs
+            WHERE status = 'pending' AND run_after <= CURRENT_TIMESTAMP
+            ORDER BY run_after, id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+            """
+        )
+        job = cur.fetchone()
+        if not job:
+            conn.commit()
+            break
+        
+        try:
+            cur.execute(
+                """
+                WITH batch AS (
+                    SELECT subscriber_id FROM subscriptions
+                    WHERE channel_id = %s AND subscriber_id > %s
+                    ORDER BY subscriber_id
+                    LIMIT %s
+                ), inserted AS (
+                    INSERT INTO notifications (user_id, type, title, message, link)
+                    SELECT subscriber_id, 'new_video', %s, %s, %s FROM batch
+                    RETURNING user_id
+                ), counted AS (
+                    INSERT INTO notification_counters (user_id, unread_count)
+                    SELECT user_id, 1 FROM inserted
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        unread_count = notification_counters.unread_count + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                )
+                SELECT COUNT(*) AS delivered, MAX(user_id) AS last_subscriber_id FROM inserted
+                """,
+                (job['channel_id'], job['last_subscriber_id'], batch_size, job['title'], job['message'], job['link'])
+            )
+            progress = cur.fetchone()
+            finished = progress['delivered'] < batch_size
+            cur.execute(
+                """
+                UPDATE notification_jobs SET
+                    last_subscriber_id = COALESCE(%s, last_subscriber_id),
+                    delivered_count = delivered_count + %s,
+                    status = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                """,
+                (progress['last_subscriber_id'], progress['delivered'], 'done' if finished else 'pending', job['id'])
+            )
+            conn.commit()
+            summary['delivered'] += progress['delivered']
+            summary['completed_jobs'] += int(finished)
+        except psycopg2.Error as e:
+            conn.rollback()
+            cur.execute(
+                """
+                UPDATE notification_jobs SET
+                    attempts = attempts + 1,
+                    last_error = %s,
+                    status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE 'pending' END,
+                    run_after = CURRENT_TIMESTAMP + INTERVAL '30 seconds' * POWER(2, attempts),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                RETURNING status
+                """,
+                (str(e), FANOUT_MAX_ATTEMPTS, job['id'])
+            )
+            summary['failed_jobs'] += int(cur.fetchone()['status'] == 'failed')
+            conn.commit()
+        summary['batches'] += 1
+    
+    return respond(200, summary)
+
+GET_ACTIONS = {
+    'stats': stats,
+    'reports': list_reports,
+    'users': list_users,
+    'videos': list_videos,
+}
+
+POST_ACTIONS = {
+    'resolve_report': resolve_report,
+    'update_video_status': update_video_status,
+    'verify_user': verify_user,
+    'change_role': change_role,
+    'reconcile_counters': reconcile_counters,
+    'recompute_scores': recompute_scores,
+    'fanout_notifications': fanout_notifications,
+    'compact_notifications': compact_notifications,
+}
+
+ADMIN_ONLY_ACTIONS = {'verify_user', 'change_role', 'reconcile_counters', 'recompute_scores',
+                      'fanout_notifications', 'compact_notifications'}
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Админ-панель и модерация контента
@@ -14,206 +612,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-User-Role',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return OPTIONS_RESPONSE
     
-    headers_dict = event.get('headers', {})
-    user_role = headers_dict.get('X-User-Role') or headers_dict.get('x-user-role')
+    session = verify_session(event)
+    if session is None:
+        return error_response(401, 'Unauthorized')
     
-    if user_role not in ['admin', 'moderator']:
-        return {
-            'statusCode': 403,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Access denied'}),
-            'isBase64Encoded': False
-        }
+    if session['role'] not in ['admin', 'moderator']:
+        return error_response(403, 'Access denied')
+    
+    if method == 'GET':
+        data = event.get('queryStringParameters') or {}
+        action = data.get('action', 'stats')
+        route = GET_ACTIONS.get(action)
+    elif method == 'POST':
+        data = json.loads(event.get('body') or '{}')
+        action = data.get('action')
+        route = POST_ACTIONS.get(action)
+    else:
+        route = None
+    
+    if route is None:
+        return error_response(400, 'Invalid request')
+    
+    set_action(route.__name__)
+    
+    if action in ADMIN_ONLY_ACTIONS and session['role'] != 'admin':
+        return error_response(403, 'Access denied')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    if method == 'POST':
+        data['reviewer_id'] = session['sub']
+    
+    conn = get_conn()
+    cur = conn.cursor(cursor_factory=TimedCursor)
     
     try:
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            action = params.get('action', 'stats')
-            
-            if action == 'stats':
-                cur.execute("SELECT COUNT(*) as total_users FROM users")
-                users_count = cur.fetchone()['total_users']
-                
-                cur.execute("SELECT COUNT(*) as total_videos FROM videos")
-                videos_count = cur.fetchone()['total_videos']
-                
-                cur.execute("SELECT COUNT(*) as total_comments FROM comments")
-                comments_count = cur.fetchone()['total_comments']
-                
-                cur.execute("SELECT COUNT(*) as pending_reports FROM reports WHERE status = 'pending'")
-                reports_count = cur.fetchone()['pending_reports']
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'stats': {
-                            'total_users': users_count,
-                            'total_videos': videos_count,
-                            'total_comments': comments_count,
-                            'pending_reports': reports_count
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'reports':
-                cur.execute(
-                    """
-                    SELECT r.*, 
-                           u.name as reporter_name,
-                           v.title as video_title,
-                           c.text as comment_text
-                    FROM reports r
-                    LEFT JOIN users u ON r.reporter_id = u.id
-                    LEFT JOIN videos v ON r.video_id = v.id
-                    LEFT JOIN comments c ON r.comment_id = c.id
-                    WHERE r.status = 'pending'
-                    ORDER BY r.created_at DESC
-                    LIMIT 50
-                    """
-                )
-                reports = [dict(row) for row in cur.fetchall()]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'reports': reports}, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'users':
-                cur.execute(
-                    """
-                    SELECT id, email, name, avatar_url, subscribers_count, role, is_verified, created_at
-                    FROM users
-                    ORDER BY created_at DESC
-                    LIMIT 100
-                    """
-                )
-                users = [dict(row) for row in cur.fetchall()]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'users': users}, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'videos':
-                cur.execute(
-                    """
-                    SELECT v.*, u.name as channel_name
-                    FROM videos v
-                    JOIN users u ON v.user_id = u.id
-                    ORDER BY v.created_at DESC
-                    LIMIT 100
-                    """
-                )
-                videos = [dict(row) for row in cur.fetchall()]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'videos': videos}, default=str),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            if action == 'resolve_report':
-                report_id = body_data.get('report_id')
-                status = body_data.get('status')
-                reviewer_id = body_data.get('reviewer_id')
-                
-                cur.execute(
-                    "UPDATE reports SET status = %s, reviewed_by = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (status, reviewer_id, report_id)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'update_video_status':
-                video_id = body_data.get('video_id')
-                status = body_data.get('status')
-                
-                cur.execute(
-                    "UPDATE videos SET status = %s, is_moderated = true WHERE id = %s",
-                    (status, video_id)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'verify_user' and user_role == 'admin':
-                user_id = body_data.get('user_id')
-                is_verified = body_data.get('is_verified', True)
-                
-                cur.execute(
-                    "UPDATE users SET is_verified = %s WHERE id = %s",
-                    (is_verified, user_id)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'change_role' and user_role == 'admin':
-                user_id = body_data.get('user_id')
-                new_role = body_data.get('role')
-                
-                cur.execute(
-                    "UPDATE users SET role = %s WHERE id = %s",
-                    (new_role, user_id)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-        
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid request'}),
-            'isBase64Encoded': False
-        }
+        return route(conn, cur, data)
     
     finally:
         cur.close()
-        conn.close()
+        put_conn(conn)
@@ -1,10 +1,196 @@
 import json
+import hmac
 import os
+import secrets
 import hashlib
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
+from handler_core import (
+    SESSION_SECRET, SESSION_TTL, TimedCursor, b64decode, b64encode, error_response, get_conn, instrumented,
+    log_event, put_conn, respond, set_action, sign_payload, verify_session,
+)
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': '',
+    'isBase64Encoded': False
+}
+
+def issue_token(user: Dict[str, Any]) -> str:
+    '''
+    Выдаёт подписанный HMAC-SHA256 токен сессии: base64(claims).base64(подпись)
+    Raises: RuntimeError - если SESSION_SECRET не задан (подпись пустым ключом подделывается)
+    '''
+    if not SESSION_SECRET:
+        raise RuntimeError('SESSION_SECRET is not set')
+    issued_at = int(time.time())
+    claims = {
+        'sub': user['id'],
+        'role': user['role'],
+        'iat': issued_at,
+        'exp': issued_at + SESSION_TTL,
+        'jti': secrets.token_urlsafe(12)
+    }
+    payload = b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{payload}.{b64encode(sign_payload(payload))}'
+
+# Стоимость scrypt: память на хеш — 128 * N * r байт, время растёт линейно по N
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', str(2 ** 14)))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+PASSWORD_SALT_BYTES = 16
+PASSWORD_KEY_BYTES = 32
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r * p + 2 ** 20, dklen=PASSWORD_KEY_BYTES
+    )
+
+def hash_password(password: str) -> str:
+    '''
+    Хеширует пароль scrypt с текущими параметрами стоимости
+    Returns: строка вида scrypt$N$r$p$соль$хеш (base64url)
+    '''
+    salt = secrets.token_bytes(PASSWORD_SALT_BYTES)
+    n, r, p = PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P
+    return f'scrypt${n}${r}${p}${b64encode(salt)}${b64encode(_scrypt(password, salt, n, r, p))}'
+
+def _verify_scrypt(password: str, params: List[str]) -> bool:
+    n, r, p, salt, expected = params
+    return hmac.compare_digest(_scrypt(password, b64decode(salt), int(n), int(r), int(p)), b64decode(expected))
+
+def _verify_sha256(password: str, params: List[str]) -> bool:
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), params[0])
+
+# Схема хеша -> проверка; хеши без префикса — старые hex SHA-256
+PASSWORD_VERIFIERS = {
+    'scrypt': _verify_scrypt,
+    'sha256': _verify_sha256,
+}
+
+def _parse_hash(stored: str) -> Tuple[str, List[str]]:
+    if '$' not in stored:
+        return 'sha256', [stored]
+    scheme, *params = stored.split('$')
+    return scheme, params
+
+def verify_password(password: str, stored: str) -> bool:
+    scheme, params = _parse_hash(stored)
+    verifier = PASSWORD_VERIFIERS.get(scheme)
+    try:
+        return verifier is not None and verifier(password, params)
+    except (TypeError, ValueError):
+        return False
+
+def needs_rehash(stored: str) -> bool:
+    '''
+    Хеш устарел: старая схема или параметры scrypt отличаются от текущих
+    '''
+    scheme, params = _parse_hash(stored)
+    current = [str(PASSWORD_SCRYPT_N), str(PASSWORD_SCRYPT_R), str(PASSWORD_SCRYPT_P)]
+    return scheme != 'scrypt' or params[:3] != current
+
+_dummy_hash: Optional[str] = None
+
+def _burn_verify(password: str) -> None:
+    '''
+    Проверка против фиктивного хеша: ответ на неизвестный email занимает столько же,
+    сколько на неверный пароль, и не выдаёт существование аккаунта
+    '''
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_urlsafe(16))
+    verify_password(password, _dummy_hash)
+
+USER_COLUMNS = "id, email, name, avatar_url, subscribers_count, role, is_verified"
+
+def register(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    email = body_data.get('email')
+    password = body_data.get('password')
+    name = body_data.get('name')
+    
+    if not email or not password or not name:
+        return error_response(400, 'Missing required fields')
+    if not all(isinstance(value, str) for value in (email, password, name)):
+        return error_response(400, 'email, password and name must be strings')
+    
+    password_hash = hash_password(password)
+    avatar_url = f'https://api.dicebear.com/7.x/avataaars/svg?seed={email}'
+    
+    cur.execute(
+        f"INSERT INTO users (email, password_hash, name, avatar_url) VALUES (%s, %s, %s, %s) RETURNING {USER_COLUMNS}",
+        (email, password_hash, name, avatar_url)
+    )
+    user = dict(cur.fetchone())
+    conn.commit()
+    
+    return respond(200, {'user': user, 'token': issue_token(user)})
+
+def login(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    email = body_data.get('email')
+    password = body_data.get('password')
+    
+    if not email or not password:
+        return error_response(400, 'Missing email or password')
+    if not isinstance(email, str) or not isinstance(password, str):
+        return error_response(400, 'email and password must be strings')
+    
+    cur.execute(f"SELECT {USER_COLUMNS}, password_hash FROM users WHERE email = %s", (email,))
+    row = cur.fetchone()
+    
+    if not row:
+        _burn_verify(password)
+        return error_response(401, 'Invalid credentials')
+    
+    user = dict(row)
+    stored = user.pop('password_hash')
+    if not verify_password(password, stored):
+        return error_response(401, 'Invalid credentials')
+    
+    if needs_rehash(stored):
+        # Прозрачный перевод на текущую схему; условие по старому хешу не даёт
+        # затереть пароль, сменённый параллельным запросом
+        cur.execute(
+            "UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND password_hash = %s",
+            (hash_password(password), user['id'], stored)
+        )
+        conn.commit()
+    
+    return respond(200, {'user': user, 'token': issue_token(user)})
+
+def logout(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Отзывает токен текущей сессии; остальные обработчики перестают его принимать
+    не позже чем через REVOCATION_CACHE_TTL секунд
+    '''
+    claims = body_data['session']
+    cur.execute(
+        "INSERT INTO revoked_sessions (jti, expires_at) VALUES (%s, to_timestamp(%s)::timestamp)",
+        (claims['jti'], claims['exp'])
+    )
+    cur.execute("DELETE FROM revoked_sessions WHERE expires_at < CURRENT_TIMESTAMP")
+    conn.commit()
+    
+    return respond(200, {'success': True})
+
+POST_ACTIONS = {
+    'register': register,
+    'login': login,
+    'logout': logout,
+}
+
+SESSION_ACTIONS = {'logout'}
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Аутентификация и регистрация пользователей
@@ -15,115 +201,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return OPTIONS_RESPONSE
     
     if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+        return error_response(405, 'Method not allowed')
+    
+    body_data = json.loads(event.get('body') or '{}')
+    route = POST_ACTIONS.get(body_data.get('action'))
+    
+    if route is None:
+        return error_response(400, 'Invalid action')
+    
+    set_action(route.__name__)
+    
+    # Без секрета остальные функции отвергают любые токены: не регистрируем и не выдаём сессий
+    if not SESSION_SECRET:
+        log_event('session_secret_missing', action=body_data.get('action'))
+        return error_response(500, 'Authentication is not configured')
     
-    body_data = json.loads(event.get('body', '{}'))
-    action = body_data.get('action')
+    if body_data.get('action') in SESSION_ACTIONS:
+        body_data['session'] = verify_session(event)
+        if body_data['session'] is None:
+            return error_response(401, 'Unauthorized')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    conn = get_conn()
+    cur = conn.cursor(cursor_factory=TimedCursor)
     
     try:
-        if action == 'register':
-            email = body_data.get('email')
-            password = body_data.get('password')
-            name = body_data.get('name')
-            
-            if not email or not password or not name:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing required fields'}),
-                    'isBase64Encoded': False
-                }
-            
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            avatar_url = f'https://api.dicebear.com/7.x/avataaars/svg?seed={email}'
-            
-            cur.execute(
-                "INSERT INTO users (email, password_hash, name, avatar_url) VALUES (%s, %s, %s, %s) RETURNING id, email, name, avatar_url, subscribers_count, role, is_verified",
-                (email, password_hash, name, avatar_url)
-            )
-            user = dict(cur.fetchone())
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'user': user}),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'login':
-            email = body_data.get('email')
-            password = body_data.get('password')
-            
-            if not email or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing email or password'}),
-                    'isBase64Encoded': False
-                }
-            
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            cur.execute(
-                "SELECT id, email, name, avatar_url, subscribers_count, role, is_verified FROM users WHERE email = %s AND password_hash = %s",
-                (email, password_hash)
-            )
-            user = cur.fetchone()
-            
-            if not user:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid credentials'}),
-                    'isBase64Encoded': False
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'user': dict(user)}),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid action'}),
-                'isBase64Encoded': False
-            }
+        return route(conn, cur, body_data)
     
     except psycopg2.IntegrityError:
         conn.rollback()
-        return {
-            'statusCode': 409,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'User already exists'}),
-            'isBase64Encoded': False
-        }
+        return error_response(409, 'User already exists')
     
     finally:
         cur.close()
-        conn.close()
+        put_conn(conn)
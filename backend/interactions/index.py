@@ -1,9 +1,585 @@
 import json
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from datetime import datetime
+from psycopg2.extras import execute_values
+from typing import Dict, Any, List, Tuple, Optional
 
+from handler_core import (
+    RateLimiter, TimedCursor, b64decode, b64encode, decode_cursor, encode_cursor, error_response, get_conn,
+    instrumented, page_size, put_conn, respond, set_action, verify_session,
+)
+
+# Лимиты на запись: действие -> (токенов в секунду, ёмкость ведра)
+RATE_LIMITS: Dict[Optional[str], Tuple[float, float]] = {
+    'like_video': (2, 30),
+    'unlike_video': (2, 30),
+    'comment': (0.2, 10),
+    'subscribe': (0.5, 20),
+    'report': (0.05, 5),
+    'batch': (1, 20),
+    'mark_read': (2, 30),
+}
+rate_limiter = RateLimiter(RATE_LIMITS, 'interactions')
+
+DEFAULT_REPLIES = 3
+MAX_REPLIES = 10
+
+MAX_BATCH_EVENTS = 500
+LIKE_EVENTS = {'like': True, 'dislike': False, 'unlike': None}
+
+MAX_MARK_READ_IDS = 500
+# Рассылки крупных каналов (delivery = 'on_read') не размножаются по подписчикам и подмешиваются во входящие при чтении
+# id у них из notification_jobs, а не из notifications - различаются по source
+INBOX_SOURCES = ('broadcast', 'direct')
+BROADCAST_ITEMS = """
+    SELECT j.id, 'new_video' AS type, j.title, j.message, j.link,
+           j.created_at <= COALESCE(c.read_through, '-infinity'::timestamp)
+           OR EXISTS (
+               SELECT 1 FROM notification_broadcast_reads r WHERE r.user_id = s.subscriber_id AND r.job_id = j.id
+           ) AS is_read,
+           j.created_at, 'broadcast' AS source
+    FROM subscriptions s
+    JOIN notification_jobs j ON j.channel_id = s.channel_id AND j.delivery = 'on_read' AND j.created_at >= s.created_at
+    LEFT JOIN notification_counters c ON c.user_id = s.subscriber_id
+    WHERE s.subscriber_id = %(user_id)s
+"""
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': '',
+    'isBase64Encoded': False
+}
+
+def like_video(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    video_id = body_data.get('video_id')
+    is_like = None if body_data.get('action') == 'unlike_video' else body_data.get('is_like', True)
+    if not isinstance(video_id, int) or isinstance(video_id, bool):
+        return error_response(400, 'video_id required')
+    if is_like is not None and not isinstance(is_like, bool):
+        return error_response(400, 'Invalid is_like')
+    
+    cur.execute(
+        """
+        WITH previous AS (
+            SELECT is_like FROM video_likes
+            WHERE video_id = %(video_id)s AND user_id = %(user_id)s
+        ), removed AS (
+            DELETE FROM video_likes
+            WHERE video_id = %(video_id)s AND user_id = %(user_id)s
+              AND (%(is_like)s IS NULL OR (%(toggle)s AND is_like = %(is_like)s))
+            RETURNING is_like
+        ), upserted AS (
+            INSERT INTO video_likes (video_id, user_id, is_like)
+            SELECT %(video_id)s, %(user_id)s, %(is_like)s
+            WHERE %(is_like)s IS NOT NULL AND NOT EXISTS (SELECT 1 FROM removed)
+              AND EXISTS (SELECT 1 FROM videos WHERE id = %(video_id)s)
+            ON CONFLICT (video_id, user_id) DO UPDATE SET is_like = EXCLUDED.is_like
+            RETURNING is_like
+        )
+        UPDATE videos SET
+            likes_count = GREATEST(likes_count
+                + (SELECT COUNT(*) FROM upserted WHERE is_like)
+                - (SELECT COUNT(*) FROM previous WHERE is_like), 0),
+            dislikes_count = GREATEST(dislikes_count
+                + (SELECT COUNT(*) FROM upserted WHERE NOT is_like)
+                - (SELECT COUNT(*) FROM previous WHERE NOT is_like), 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %(video_id)s
+        RETURNING likes_count, dislikes_count, (SELECT is_like FROM upserted) AS is_like
+        """,
+        {
+            'video_id': video_id,
+            'user_id': body_data['user_id'],
+            'is_like': is_like,
+            'toggle': bool(body_data.get('toggle'))
+        }
+    )
+    counters = cur.fetchone()
+    conn.commit()
+    
+    if not counters:
+        return error_response(404, 'Video not found')
+    
+    return respond(200, {'success': True, **counters})
+
+def comment(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Новый комментарий или ответ. Ветка в list_comments одноуровневая, поэтому ответ
+    на ответ прикрепляется к корневому комментарию ветки
+    '''
+    video_id = body_data.get('video_id')
+    parent_id = body_data.get('parent_comment_id')
+    if parent_id is not None:
+        if not isinstance(parent_id, int) or isinstance(parent_id, bool):
+            return error_response(400, 'Invalid parent_comment_id')
+        cur.execute(
+            "SELECT COALESCE(parent_comment_id, id) AS root_id FROM comments WHERE id = %s AND video_id = %s",
+            (parent_id, video_id)
+        )
+        parent = cur.fetchone()
+        if not parent:
+            return error_response(404, 'Parent comment not found')
+        parent_id = parent['root_id']
+    
+    cur.execute(
+        "INSERT INTO comments (video_id, user_id, text, parent_comment_id) VALUES (%s, %s, %s, %s) RETURNING id, text, parent_comment_id, created_at",
+        (video_id, body_data['user_id'], body_data.get('text'), parent_id)
+    )
+    new_comment = dict(cur.fetchone())
+    conn.commit()
+    
+    return respond(200, {'comment': new_comment})
+
+def subscribe(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    user_id = body_data['user_id']
+    channel_id = body_data.get('channel_id')
+    
+    cur.execute(
+        "SELECT * FROM subscriptions WHERE subscriber_id = %s AND channel_id = %s",
+        (user_id, channel_id)
+    )
+    if cur.fetchone():
+        return respond(200, {'subscribed': True})
+    
+    cur.execute(
+        "INSERT INTO subscriptions (subscriber_id, channel_id) VALUES (%s, %s)",
+        (user_id, channel_id)
+    )
+    
+    cur.execute(
+        "UPDATE users SET subscribers_count = subscribers_count + 1 WHERE id = %s",
+        (channel_id,)
+    )
+    conn.commit()
+    
+    return respond(200, {'subscribed': True})
+
+def report(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    cur.execute(
+        "INSERT INTO reports (reporter_id, video_id, comment_id, reason, description) VALUES (%s, %s, %s, %s, %s)",
+        (
+            body_data['user_id'], body_data.get('video_id'), body_data.get('comment_id'),
+            body_data.get('reason'), body_data.get('description', '')
+        )
+    )
+    conn.commit()
+    
+    return respond(200, {'success': True})
+
+def ingest_batch(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Пакетный приём лайков, просмотров и позиций просмотра одной транзакцией
+    Повторы внутри пакета схлопываются: для оценки и позиции видео побеждает последнее событие,
+    просмотр видео засчитывается один раз
+    Returns: статус каждого события в порядке запроса (applied, duplicate, not_found, invalid)
+    '''
+    events = body_data.get('events')
+    if not isinstance(events, list) or not events:
+        return error_response(400, 'events required')
+    if len(events) > MAX_BATCH_EVENTS:
+        return error_response(400, f'Too many events (max {MAX_BATCH_EVENTS})')
+    
+    user_id = body_data['user_id']
+    results: List[Dict[str, Any]] = []
+    accepted: Dict[Tuple[str, int], int] = {}
+    for index, event in enumerate(events):
+        kind = event.get('type') if isinstance(event, dict) else None
+        group = 'like' if kind in LIKE_EVENTS else kind
+        try:
+            video_id = int(event['video_id'])
+            if kind == 'watch' and int(event['position']) < 0:
+                raise ValueError(event['position'])
+        except (KeyError, TypeError, ValueError):
+            group = None
+        
+        if group not in ('like', 'view', 'watch'):
+            results.append({'index': index, 'status': 'invalid'})
+            continue
+        
+        results.append({'index': index, 'status': 'applied'})
+        key = (group, video_id)
+        if key in accepted:
+            if group == 'view':
+                results[index]['status'] = 'duplicate'
+                continue
+            results[accepted[key]]['status'] = 'duplicate'
+        accepted[key] = index
+    
+    cur.execute("SELECT id FROM videos WHERE id = ANY(%s)", ([video_id for _, video_id in accepted],))
+    existing = {row['id'] for row in cur.fetchall()}
+    
+    likes, views, positions = [], [], []
+    for (group, video_id), index in sorted(accepted.items(), key=lambda item: item[0][1]):
+        if video_id not in existing:
+            results[index]['status'] = 'not_found'
+        elif group == 'like':
+            likes.append((user_id, video_id, LIKE_EVENTS[events[index]['type']]))
+        elif group == 'view':
+            views.append((video_id, 1))
+        else:
+            positions.append((user_id, video_id, int(events[index]['position'])))
+    
+    if likes:
+        execute_values(
+            cur,
+            """
+            WITH incoming (user_id, video_id, is_like) AS (VALUES %s),
+            previous AS (
+                SELECT l.video_id, l.is_like FROM video_likes l
+                JOIN incoming i ON l.video_id = i.video_id AND l.user_id = i.user_id
+            ), removed AS (
+                DELETE FROM video_likes l USING incoming i
+                WHERE l.video_id = i.video_id AND l.user_id = i.user_id AND i.is_like IS NULL
+            ), upserted AS (
+                INSERT INTO video_likes (video_id, user_id, is_like)
+                SELECT video_id, user_id, is_like FROM incoming WHERE is_like IS NOT NULL
+                ON CONFLICT (video_id, user_id) DO UPDATE SET is_like = EXCLUDED.is_like
+                RETURNING video_id, is_like
+            ), deltas AS (
+                SELECT video_id, SUM(likes) AS likes, SUM(dislikes) AS dislikes
+                FROM (
+                    SELECT video_id, is_like::int AS likes, (NOT is_like)::int AS dislikes FROM upserted
+                    UNION ALL
+                    SELECT video_id, -is_like::int, -(NOT is_like)::int FROM previous
+                ) changes
+                GROUP BY video_id
+            )
+            UPDATE videos v SET
+                likes_count = GREATEST(v.likes_count + d.likes, 0),
+                dislikes_count = GREATEST(v.dislikes_count + d.dislikes, 0),
+                updated_at = CURRENT_TIMESTAMP
+            FROM deltas d
+            WHERE v.id = d.video_id AND (d.likes <> 0 OR d.dislikes <> 0)
+            """,
+            likes,
+            template='(%s::int, %s::int, %s::boolean)',
+            page_size=len(likes)
+        )
+    
+    if views:
+        execute_values(
+            cur,
+            """
+            UPDATE videos AS v SET views_count = v.views_count + d.views, updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS d(id, views)
+            WHERE v.id = d.id
+            """,
+            views,
+            page_size=len(views)
+        )
+    
+    if positions:
+        execute_values(
+            cur,
+            """
+            INSERT INTO watch_history (user_id, video_id, watch_position) VALUES %s
+            ON CONFLICT (user_id, video_id) DO UPDATE SET
+                watch_position = EXCLUDED.watch_position,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            positions,
+            page_size=len(positions)
+        )
+    conn.commit()
+    
+    applied = sum(1 for result in results if result['status'] == 'applied')
+    return respond(200, {'success': True, 'applied': applied, 'results': results})
+
+def count_unread(cur: Any, user_id: int) -> int:
+    '''
+    Непрочитанные = счётчик notification_counters + непрочитанные рассылки крупных каналов
+    '''
+    cur.execute(
+        f"""
+        SELECT COALESCE((SELECT unread_count FROM notification_counters WHERE user_id = %(user_id)s), 0)
+             + (SELECT COUNT(*) FROM ({BROADCAST_ITEMS}) broadcast WHERE NOT broadcast.is_read) AS unread_count
+        """,
+        {'user_id': user_id}
+    )
+    return cur.fetchone()['unread_count']
+
+def encode_inbox_cursor(created_at: datetime, source: str, row_id: int) -> str:
+    return b64encode(json.dumps([created_at.isoformat(), source, row_id]).encode())
+
+def decode_inbox_cursor(cursor: str) -> Tuple[datetime, str, int]:
+    '''
+    Разбирает курсор входящих (created_at, source, id): id прямых уведомлений и рассылок из разных таблиц
+    Raises: ValueError - если курсор повреждён
+    '''
+    try:
+        created_at, source, row_id = json.loads(b64decode(cursor))
+        if source not in INBOX_SOURCES:
+            raise ValueError(source)
+        return datetime.fromisoformat(created_at), source, int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def parse_ids(value: Any) -> Optional[List[int]]:
+    '''
+    Raises: ValueError - если это не список целых
+    '''
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        raise ValueError(value)
+    try:
+        return [int(row_id) for row_id in value] or None
+    except TypeError as e:
+        raise ValueError(value) from e
+
+def mark_notifications_read(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Отмечает прочитанными уведомления по спискам ids (прямые) и broadcast_ids (рассылки)
+    или все до курсора up_to включительно
+    Счётчик непрочитанных уменьшается в той же транзакции
+    '''
+    user_id = body_data['user_id']
+    query_params: Dict[str, Any] = {
+        'user_id': user_id, 'ids': None, 'broadcast_ids': None, 'created_at': None, 'id': None, 'source': None,
+    }
+    
+    if body_data.get('up_to'):
+        try:
+            query_params['created_at'], query_params['source'], query_params['id'] = decode_inbox_cursor(body_data['up_to'])
+        except ValueError:
+            return error_response(400, 'Invalid cursor')
+    else:
+        try:
+            query_params['ids'] = parse_ids(body_data.get('ids'))
+            query_params['broadcast_ids'] = parse_ids(body_data.get('broadcast_ids'))
+        except ValueError:
+            return error_response(400, 'ids and broadcast_ids must be lists of integers')
+        if not query_params['ids'] and not query_params['broadcast_ids']:
+            return error_response(400, 'ids, broadcast_ids or up_to required')
+        if len(query_params['ids'] or []) + len(query_params['broadcast_ids'] or []) > MAX_MARK_READ_IDS:
+            return error_response(400, f'Too many ids (max {MAX_MARK_READ_IDS})')
+    
+    # Внутри одного created_at прямые уведомления идут раньше рассылок (source DESC), как в list_notifications:
+    # курсор на рассылке покрывает прямые уведомления только строго старше него
+    # Рассылки до курсора закрывает отметка read_through, отдельные - строки notification_broadcast_reads
+    cur.execute(
+        f"""
+        WITH marked AS (
+            UPDATE notifications SET is_read = true
+            WHERE user_id = %(user_id)s AND NOT is_read
+              AND (%(ids)s::int[] IS NOT NULL OR %(created_at)s::timestamp IS NOT NULL)
+              AND (%(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[]))
+              AND (
+                  %(created_at)s::timestamp IS NULL
+                  OR (%(source)s = 'direct' AND (created_at, id) <= (%(created_at)s::timestamp, %(id)s::int))
+                  OR (%(source)s = 'broadcast' AND created_at < %(created_at)s::timestamp)
+              )
+            RETURNING id
+        ), broadcast_marked AS (
+            INSERT INTO notification_broadcast_reads (user_id, job_id)
+            SELECT %(user_id)s, broadcast.id FROM ({BROADCAST_ITEMS}) broadcast
+            WHERE broadcast.id = ANY(%(broadcast_ids)s::int[]) AND NOT broadcast.is_read
+            ON CONFLICT DO NOTHING
+            RETURNING job_id
+        )
+        INSERT INTO notification_counters (user_id, unread_count, read_through)
+        VALUES (%(user_id)s, 0, %(created_at)s::timestamp)
+        ON CONFLICT (user_id) DO UPDATE SET
+            unread_count = GREATEST(notification_counters.unread_count - (SELECT COUNT(*) FROM marked), 0),
+            read_through = GREATEST(notification_counters.read_through, EXCLUDED.read_through),
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING (SELECT COUNT(*) FROM marked) + (SELECT COUNT(*) FROM broadcast_marked) AS updated
+        """,
+        query_params
+    )
+    updated = cur.fetchone()['updated']
+    unread_count = count_unread(cur, user_id)
+    conn.commit()
+    
+    return respond(200, {'success': True, 'updated': updated, 'unread_count': unread_count})
+
+REPLY_AUTHOR_COLUMNS = """
+    rc.id, rc.user_id, rc.parent_comment_id, rc.text, rc.likes_count, rc.created_at,
+    ru.name AS author_name, ru.avatar_url AS author_avatar
+"""
+
+def list_comments(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Верхнеуровневые комментарии видео вместе с первыми ответами и их количеством
+    '''
+    video_id = params.get('video_id')
+    if not video_id:
+        return error_response(400, 'video_id required')
+    
+    limit = page_size(params)
+    try:
+        replies_limit = min(max(int(params.get('replies', DEFAULT_REPLIES)), 0), MAX_REPLIES)
+    except ValueError:
+        replies_limit = DEFAULT_REPLIES
+    
+    query = f"""
+        SELECT c.*, u.name as author_name, u.avatar_url as author_avatar,
+               (SELECT COUNT(*) FROM comments r WHERE r.parent_comment_id = c.id) AS reply_count,
+               (
+                   SELECT COALESCE(json_agg(row_to_json(reply) ORDER BY reply.created_at, reply.id), '[]'::json)
+                   FROM (
+                       SELECT {REPLY_AUTHOR_COLUMNS}
+                       FROM comments rc
+                       JOIN users ru ON rc.user_id = ru.id
+                       WHERE rc.parent_comment_id = c.id
+                       ORDER BY rc.created_at, rc.id
+                       LIMIT %s
+                   ) reply
+               ) AS replies
+        FROM comments c 
+        JOIN users u ON c.user_id = u.id 
+        WHERE c.video_id = %s AND c.parent_comment_id IS NULL 
+    """
+    query_params: List[Any] = [replies_limit, video_id]
+    
+    if params.get('cursor'):
+        try:
+            query += " AND (c.created_at, c.id) < (%s, %s)"
+            query_params.extend(decode_cursor(params['cursor']))
+        except ValueError:
+            return error_response(400, 'Invalid cursor')
+    
+    query += " ORDER BY c.created_at DESC, c.id DESC LIMIT %s"
+    query_params.append(limit + 1)
+    
+    cur.execute(query, query_params)
+    comments = [dict(row) for row in cur.fetchall()]
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_cursor(comments[-1]['created_at'], comments[-1]['id'])
+    
+    return respond(200, {'comments': comments, 'next_cursor': next_cursor})
+
+def list_replies(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Следующие страницы ответов на комментарий (от старых к новым)
+    '''
+    parent_id = params.get('parent_comment_id')
+    if not parent_id:
+        return error_response(400, 'parent_comment_id required')
+    
+    limit = page_size(params)
+    query = f"""
+        SELECT {REPLY_AUTHOR_COLUMNS}
+        FROM comments rc
+        JOIN users ru ON rc.user_id = ru.id
+        WHERE rc.parent_comment_id = %s
+    """
+    query_params: List[Any] = [parent_id]
+    
+    if params.get('cursor'):
+        try:
+            query += " AND (rc.created_at, rc.id) > (%s, %s)"
+            query_params.extend(decode_cursor(params['cursor']))
+        except ValueError:
+            return error_response(400, 'Invalid cursor')
+    
+    query += " ORDER BY rc.created_at, rc.id LIMIT %s"
+    query_params.append(limit + 1)
+    
+    cur.execute(query, query_params)
+    replies = [dict(row) for row in cur.fetchall()]
+    next_cursor = None
+    if len(replies) > limit:
+        replies = replies[:limit]
+        next_cursor = encode_cursor(replies[-1]['created_at'], replies[-1]['id'])
+    
+    return respond(200, {'replies': replies, 'next_cursor': next_cursor})
+
+def list_notifications(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Входящие уведомления пользователя, новые сверху
+    id прямых уведомлений и рассылок из разных таблиц: в mark_read их передают в ids и broadcast_ids по source
+    read_cursor указывает на самое новое уведомление страницы - его передают в mark_read как up_to
+    '''
+    try:
+        user_id = int(params['user_id'])
+    except (KeyError, TypeError, ValueError):
+        return error_response(400, 'user_id required')
+    
+    limit = page_size(params)
+    query_params: Dict[str, Any] = {'user_id': user_id, 'limit': limit + 1}
+    direct_filter = broadcast_filter = ''
+    if params.get('cursor'):
+        try:
+            query_params['created_at'], source, query_params['id'] = decode_inbox_cursor(params['cursor'])
+        except ValueError:
+            return error_response(400, 'Invalid cursor')
+        # Внутри одного created_at сначала прямые уведомления, затем рассылки
+        if source == 'direct':
+            direct_filter = " AND (n.created_at, n.id) < (%(created_at)s, %(id)s)"
+            broadcast_filter = " AND j.created_at <= %(created_at)s"
+        else:
+            direct_filter = " AND n.created_at < %(created_at)s"
+            broadcast_filter = " AND (j.created_at, j.id) < (%(created_at)s, %(id)s)"
+    
+    cur.execute(
+        f"""
+        SELECT * FROM (
+            (
+                SELECT n.id, n.type, n.title, n.message, n.link, n.is_read, n.created_at, 'direct' AS source
+                FROM notifications n
+                WHERE n.user_id = %(user_id)s {direct_filter}
+                ORDER BY n.created_at DESC, n.id DESC
+                LIMIT %(limit)s
+            )
+            UNION ALL
+            (
+                {BROADCAST_ITEMS} {broadcast_filter}
+                ORDER BY j.created_at DESC, j.id DESC
+                LIMIT %(limit)s
+            )
+        ) inbox
+        ORDER BY created_at DESC, source DESC, id DESC
+        LIMIT %(limit)s
+        """,
+        query_params
+    )
+    notifications = [dict(row) for row in cur.fetchall()]
+    next_cursor = None
+    if len(notifications) > limit:
+        notifications = notifications[:limit]
+        last = notifications[-1]
+        next_cursor = encode_inbox_cursor(last['created_at'], last['source'], last['id'])
+    first = notifications[0] if notifications else None
+    read_cursor = encode_inbox_cursor(first['created_at'], first['source'], first['id']) if first else None
+    
+    return respond(200, {'notifications': notifications, 'next_cursor': next_cursor, 'read_cursor': read_cursor})
+
+def unread_count(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        user_id = int(params['user_id'])
+    except (KeyError, TypeError, ValueError):
+        return error_response(400, 'user_id required')
+    
+    return respond(200, {'unread_count': count_unread(cur, user_id)})
+
+POST_ACTIONS = {
+    'like_video': like_video,
+    'unlike_video': like_video,
+    'comment': comment,
+    'subscribe': subscribe,
+    'report': report,
+    'batch': ingest_batch,
+    'mark_read': mark_notifications_read,
+}
+
+GET_ACTIONS = {
+    'comments': list_comments,
+    'replies': list_replies,
+    'notifications': list_notifications,
+    'unread_count': unread_count,
+}
+
+SESSION_GET_ACTIONS = {'notifications', 'unread_count'}
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Лайки, дизлайки, комментарии, подписки
@@ -14,186 +590,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return OPTIONS_RESPONSE
+    
+    if method == 'POST':
+        data = json.loads(event.get('body') or '{}')
+        route = POST_ACTIONS.get(data.get('action'))
+    elif method == 'GET':
+        data = dict(event.get('queryStringParameters') or {})
+        route = GET_ACTIONS.get(data.get('action', 'comments'))
+    else:
+        return error_response(405, 'Method not allowed')
+    
+    if route is None:
+        return error_response(400, 'Invalid action')
+    
+    set_action(route.__name__)
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    if method == 'POST' or data.get('action') in SESSION_GET_ACTIONS:
+        session = verify_session(event)
+        if session is None:
+            return error_response(401, 'Unauthorized')
+        data['user_id'] = session['sub']
+    
+    if method == 'POST':
+        limited = rate_limiter.check(event, data.get('action'), data['user_id'])
+        if limited is not None:
+            return limited
+    
+    conn = get_conn()
+    cur = conn.cursor(cursor_factory=TimedCursor)
     
     try:
-        if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            user_id = body_data.get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id required'}),
-                    'isBase64Encoded': False
-                }
-            
-            if action == 'like_video':
-                video_id = body_data.get('video_id')
-                is_like = body_data.get('is_like', True)
-                
-                cur.execute(
-                    "SELECT * FROM video_likes WHERE video_id = %s AND user_id = %s",
-                    (video_id, user_id)
-                )
-                existing = cur.fetchone()
-                
-                if existing:
-                    cur.execute(
-                        "UPDATE video_likes SET is_like = %s WHERE video_id = %s AND user_id = %s",
-                        (is_like, video_id, user_id)
-                    )
-                else:
-                    cur.execute(
-                        "INSERT INTO video_likes (video_id, user_id, is_like) VALUES (%s, %s, %s)",
-                        (video_id, user_id, is_like)
-                    )
-                
-                cur.execute(
-                    """
-                    UPDATE videos SET 
-                        likes_count = (SELECT COUNT(*) FROM video_likes WHERE video_id = %s AND is_like = true),
-                        dislikes_count = (SELECT COUNT(*) FROM video_likes WHERE video_id = %s AND is_like = false)
-                    WHERE id = %s
-                    """,
-                    (video_id, video_id, video_id)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'comment':
-                video_id = body_data.get('video_id')
-                text = body_data.get('text')
-                parent_id = body_data.get('parent_comment_id')
-                
-                cur.execute(
-                    "INSERT INTO comments (video_id, user_id, text, parent_comment_id) VALUES (%s, %s, %s, %s) RETURNING id, text, created_at",
-                    (video_id, user_id, text, parent_id)
-                )
-                comment = dict(cur.fetchone())
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'comment': comment}, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'subscribe':
-                channel_id = body_data.get('channel_id')
-                
-                cur.execute(
-                    "SELECT * FROM subscriptions WHERE subscriber_id = %s AND channel_id = %s",
-                    (user_id, channel_id)
-                )
-                existing = cur.fetchone()
-                
-                if existing:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'subscribed': True}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "INSERT INTO subscriptions (subscriber_id, channel_id) VALUES (%s, %s)",
-                    (user_id, channel_id)
-                )
-                
-                cur.execute(
-                    "UPDATE users SET subscribers_count = subscribers_count + 1 WHERE id = %s",
-                    (channel_id,)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'subscribed': True}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'report':
-                video_id = body_data.get('video_id')
-                comment_id = body_data.get('comment_id')
-                reason = body_data.get('reason')
-                description = body_data.get('description', '')
-                
-                cur.execute(
-                    "INSERT INTO reports (reporter_id, video_id, comment_id, reason, description) VALUES (%s, %s, %s, %s, %s)",
-                    (user_id, video_id, comment_id, reason, description)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid action'}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            video_id = params.get('video_id')
-            
-            if video_id:
-                cur.execute(
-                    """
-                    SELECT c.*, u.name as author_name, u.avatar_url as author_avatar 
-                    FROM comments c 
-                    JOIN users u ON c.user_id = u.id 
-                    WHERE c.video_id = %s AND c.parent_comment_id IS NULL 
-                    ORDER BY c.created_at DESC
-                    """,
-                    (video_id,)
-                )
-                comments = [dict(row) for row in cur.fetchall()]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'comments': comments}, default=str),
-                    'isBase64Encoded': False
-                }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+        return route(conn, cur, data)
     
     finally:
         cur.close()
-        conn.close()
+        put_conn(conn)
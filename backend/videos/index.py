@@ -1,188 +1,938 @@
+import atexit
+import io
+import re
 import json
 import os
+import signal
 import base64
+import threading
+import time
 import psycopg2
-import boto3
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from psycopg2.extras import Json, execute_values
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
-s3 = boto3.client('s3',
-    endpoint_url='https://bucket.poehali.dev',
-    aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-    aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+from handler_core import (
+    CACHE_GENERATION_KEY, CHANNEL_CACHE_MAX_ENTRIES, CHANNEL_CACHE_TTL, JSON_HEADERS, RESPONSE_CACHE_TTL,
+    VIDEO_COLUMNS, ChannelCache, RateLimiter, TimedCursor, decode_cursor, dumps, encode_cursor, error_response,
+    get_conn, instrumented, log_event, make_cache_backend, page_size, put_conn, reset_pool_after_fork, respond,
+    respond_body, set_action, track, verify_session,
 )
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+class TimedClient:
     '''
-    Работа с видео: загрузка, получение, удаление
-    Args: event - запрос с httpMethod, body, queryStringParameters
-          context - контекст выполнения
-    Returns: HTTP ответ с данными видео
+    Обёртка клиента boto3: клиент создаётся при первом обращении, время каждого вызова
+    идёт в метрики запроса как s3
     '''
-    method: str = event.get('httpMethod', 'GET')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
+    def __init__(self, factory: Any):
+        self._factory = factory
+        self._client: Any = None
+        self._lock = threading.Lock()
+    
+    def __getattr__(self, name: str) -> Any:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                track('s3', started)
+        return timed
+
+def make_s3_client() -> Any:
+    '''
+    Импорт boto3 и сборка клиента стоят сотни мс холодного старта; GET-трафик ленты
+    до них не доходит
+    '''
+    import boto3
+    return boto3.client('s3',
+        endpoint_url=os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev'),
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+    )
+
+s3 = TimedClient(make_s3_client)
+
+CACHE_HIT_HEADERS = {**JSON_HEADERS, 'X-Cache': 'HIT'}
+CACHE_MISS_HEADERS = {**JSON_HEADERS, 'X-Cache': 'MISS'}
+
+response_cache = make_cache_backend()
+channel_cache = ChannelCache(response_cache, CHANNEL_CACHE_MAX_ENTRIES, CHANNEL_CACHE_TTL)
+
+# Лимиты на запись: действие -> (токенов в секунду, ёмкость ведра)
+RATE_LIMITS: Dict[Optional[str], Tuple[float, float]] = {
+    None: (0.02, 5),  # загрузка base64 одним запросом
+    'upload_init': (0.05, 10),
+    'upload_parts': (1, 50),
+    'upload_complete': (0.2, 20),
+    'upload_abort': (0.2, 20),
+}
+rate_limiter = RateLimiter(RATE_LIMITS, 'upload')
+
+VIEW_FLUSH_INTERVAL = float(os.environ.get('VIEW_FLUSH_INTERVAL', '10'))
+VIEW_FLUSH_MAX_PENDING = int(os.environ.get('VIEW_FLUSH_MAX_PENDING', '500'))
+
+_pending_views: Dict[int, int] = {}
+_pending_views_lock = threading.Lock()
+_views_flushed_at = time.monotonic()
+
+def record_view(video_id: int) -> None:
+    with _pending_views_lock:
+        _pending_views[video_id] = _pending_views.get(video_id, 0) + 1
+
+def flush_views(conn: Any = None, force: bool = False) -> int:
+    '''
+    Сбрасывает накопленные просмотры в БД одним пакетным UPDATE
+    Args: conn - соединение вне транзакции (если нет - берётся из пула)
+          force - сбросить, даже если интервал ещё не истёк
+    Returns: количество обновлённых видео
+    '''
+    global _views_flushed_at
+    with _pending_views_lock:
+        due = force or len(_pending_views) >= VIEW_FLUSH_MAX_PENDING \
+            or time.monotonic() - _views_flushed_at >= VIEW_FLUSH_INTERVAL
+        if not due or not _pending_views:
+            return 0
+        batch = sorted(_pending_views.items())
+        _pending_views.clear()
+        _views_flushed_at = time.monotonic()
+    
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = get_conn()
+        with conn.cursor() as flush_cur:
+            execute_values(
+                flush_cur,
+                """
+                UPDATE videos AS v SET views_count = v.views_count + d.views, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS d(id, views)
+                WHERE v.id = d.id
+                """,
+                batch
+            )
+        conn.commit()
+        return len(batch)
+    except psycopg2.Error as e:
+        if conn is not None and not conn.closed:
+            conn.rollback()
+        with _pending_views_lock:
+            for video_id, views in batch:
+                _pending_views[video_id] = _pending_views.get(video_id, 0) + views
+        log_event('view_flush_failed', videos=len(batch), error=str(e))
+        return 0
+    finally:
+        if own_conn and conn is not None:
+            put_conn(conn)
+
+def _flush_views_on_shutdown(*_args: Any) -> None:
+    flush_views(force=True)
+
+atexit.register(_flush_views_on_shutdown)
+
+if threading.current_thread() is threading.main_thread():
+    _previous_sigterm = signal.getsignal(signal.SIGTERM)
+    
+    def _on_sigterm(signum: int, frame: Any) -> None:
+        '''
+        Только завершает интерпретатор: сигнал может прийти, пока основной поток держит
+        _pending_views_lock или _pool_lock, а with отпустит их при раскрутке SystemExit.
+        Просмотры сбросит обработчик atexit
+        '''
+        if callable(_previous_sigterm):
+            _previous_sigterm(signum, frame)
+        raise SystemExit(128 + signum)
+    
+    signal.signal(signal.SIGTERM, _on_sigterm)
+
+FANOUT_ON_READ_THRESHOLD = int(os.environ.get('FANOUT_ON_READ_THRESHOLD', '100000'))
+
+SEARCH_QUERY_MAX_LENGTH = 200
+SEARCH_MODES = {
+    'fts': (
+        "ts_rank_cd(v.search_vector, websearch_to_tsquery('russian', %(q)s))::float8",
+        "v.search_vector @@ websearch_to_tsquery('russian', %(q)s)",
+    ),
+    'trgm': (
+        "similarity(v.title, %(q)s)::float8",
+        "v.title %% %(q)s",
+    ),
+}
+
+FEED_SORTS = {
+    'trending': 'trending_score',
+    'popular': 'popular_score',
+}
+
+def encode_score_cursor(mode: str, score: float, row_id: int) -> str:
+    raw = json.dumps([mode, score, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_score_cursor(cursor: str, modes: Any) -> Tuple[str, float, int]:
+    '''
+    Разбирает курсор выдачи, упорядоченной по оценке (режим, оценка, id)
+    Args: modes - допустимые режимы
+    Raises: ValueError - если курсор повреждён или от другого режима
+    '''
+    try:
+        mode, score, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if mode not in modes:
+            raise ValueError(mode)
+        return mode, float(score), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+S3_BUCKET = 'files'
+UPLOAD_PART_SIZE = max(int(os.environ.get('UPLOAD_PART_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+UPLOAD_MAX_PARTS = 10000
+UPLOAD_MAX_BYTES = min(int(os.environ.get('UPLOAD_MAX_BYTES', str(5 * 1024 ** 3))), UPLOAD_PART_SIZE * UPLOAD_MAX_PARTS)
+UPLOAD_URL_TTL = int(os.environ.get('UPLOAD_URL_TTL', '3600'))
+# Presigned URL частей выдаются пачками: upload_init — первая, upload_parts — следующие
+UPLOAD_URLS_PER_REQUEST = 100
+# Загрузка base64 одним запросом — только для коротких роликов
+UPLOAD_BASE64_MAX_BYTES = int(os.environ.get('UPLOAD_BASE64_MAX_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_THUMBNAIL_MAX_BYTES = 2 * 1024 * 1024
+MAX_BODY_BYTES = (UPLOAD_BASE64_MAX_BYTES + UPLOAD_THUMBNAIL_MAX_BYTES) * 4 // 3 + 64 * 1024
+
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', '2'))
+MEDIA_BATCH_SIZE = int(os.environ.get('MEDIA_BATCH_SIZE', '8'))
+MEDIA_MAX_ATTEMPTS = 3
+MEDIA_COMMAND_TIMEOUT = float(os.environ.get('MEDIA_COMMAND_TIMEOUT', '120'))
+# Видео в статусе processing дольше этого считаются брошенными упавшим воркером
+MEDIA_CLAIM_TIMEOUT = 4 * MEDIA_COMMAND_TIMEOUT
+# В среде функции нет системного ffmpeg: по умолчанию берётся бинарник из пакета imageio-ffmpeg
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN')
+FFMPEG_DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+THUMBNAIL_WIDTHS = {'small': 320, 'medium': 640, 'large': 1280}
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+_media_pool: Optional['ProcessPoolExecutor'] = None
+_inherited_connections: List[Any] = []
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+def media_pool() -> 'ProcessPoolExecutor':
+    global _media_pool
+    if _media_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _media_pool = ProcessPoolExecutor(max_workers=MEDIA_WORKERS, initializer=_init_media_worker)
+    return _media_pool
+
+def _init_media_worker() -> None:
+    '''
+    Запускается в каждом процессе пула после fork: сбрасывает состояние родителя.
+    Иначе SIGTERM от пула будил бы обработчик родителя, а atexit сбрасывал бы его
+    буфер просмотров ещё раз. Соединения пула делят сокеты с родителем: их нельзя
+    ни использовать, ни закрывать (закрытие завершит сессию родителя), поэтому
+    ссылки только переносятся в _inherited_connections
+    '''
+    global _pending_views, _pending_views_lock
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _pending_views = {}
+    _pending_views_lock = threading.Lock()
+    _inherited_connections.extend(reset_pool_after_fork())
+
+def ffmpeg_bin() -> str:
+    if FFMPEG_BIN:
+        return FFMPEG_BIN
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+def derive_media(source_url: str) -> Dict[str, Any]:
+    '''
+    Выполняется в процессе пула: длительность и кадр через ffmpeg, превью через Pillow
+    Видео читается по presigned URL потоком и целиком не скачивается
+    Returns: {'duration': секунды, 'thumbnails': {размер: JPEG}}
+    Raises: ValueError - если ffmpeg не нашёл длительность (не видео или поток без неё)
+    '''
+    import subprocess
+    from PIL import Image
+    
+    ffmpeg = ffmpeg_bin()
+    # ffprobe в imageio-ffmpeg нет; ffmpeg без выходного файла печатает заголовки входа
+    # (в том числе Duration) и завершается с кодом 1, поэтому check здесь не нужен
+    probe = subprocess.run(
+        [ffmpeg, '-hide_banner', '-i', source_url],
+        capture_output=True, timeout=MEDIA_COMMAND_TIMEOUT
+    )
+    match = FFMPEG_DURATION_PATTERN.search(probe.stderr.decode(errors='replace'))
+    if match is None:
+        raise ValueError('Duration not found')
+    hours, minutes, seconds = match.groups()
+    duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    
+    frame = subprocess.run(
+        [ffmpeg, '-v', 'error', '-ss', f'{min(duration / 10, 5):.2f}', '-i', source_url,
+         '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-'],
+        capture_output=True, check=True, timeout=MEDIA_COMMAND_TIMEOUT
+    )
+    image = Image.open(io.BytesIO(frame.stdout)).convert('RGB')
+    
+    thumbnails = {}
+    for name, width in THUMBNAIL_WIDTHS.items():
+        resized = image.copy()
+        resized.thumbnail((width, width * 4))
+        output = io.BytesIO()
+        resized.save(output, 'JPEG', quality=85)
+        thumbnails[name] = output.getvalue()
+    
+    return {'duration': duration, 'thumbnails': thumbnails}
+
+def create_video(conn: Any, cur: Any, user_id: Any, title: str, description: str, storage_key: str,
+                 thumbnail_url: Optional[str], duration: Any, category: str) -> Dict[str, Any]:
+    '''
+    Сохраняет загруженное видео и ставит рассылку уведомлений в очередь
+    Длительность от клиента предварительная: process_media заменит её измеренной
+    Returns: созданная запись видео
+    '''
+    cur.execute(
+        """
+        INSERT INTO videos (user_id, title, description, video_url, storage_key, thumbnail_url, duration, category) 
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s) 
+        RETURNING id, title, description, video_url, thumbnail_url, duration, views_count, likes_count,
+                  processing_status, created_at
+        """,
+        (user_id, title, description, cdn_url(storage_key), storage_key, thumbnail_url, duration, category)
+    )
+    video = dict(cur.fetchone())
+    
+    cur.execute(
+        """
+        INSERT INTO notification_jobs (channel_id, video_id, title, message, link, delivery, status)
+        SELECT u.id, %(video_id)s, %(title)s, %(message)s, %(link)s,
+               CASE WHEN u.subscribers_count >= %(threshold)s THEN 'on_read' ELSE 'push' END,
+               CASE WHEN u.subscribers_count >= %(threshold)s THEN 'done' ELSE 'pending' END
+        FROM users u
+        WHERE u.id = %(channel_id)s
+        """,
+        {
+            'video_id': video['id'],
+            'title': 'Новое видео от канала',
+            'message': title,
+            'link': f'/video/{video["id"]}',
+            'threshold': FANOUT_ON_READ_THRESHOLD,
+            'channel_id': user_id
         }
+    )
+    conn.commit()
+    response_cache.incr(CACHE_GENERATION_KEY)
+    return video
+
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': '',
+    'isBase64Encoded': False
+}
+
+def get_video(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        video_id = int(params['id'])
+    except ValueError:
+        return error_response(404, 'Video not found')
+    
+    cur.execute(
+        f"""
+        SELECT {VIDEO_COLUMNS}, u.subscribers_count
+        FROM videos v 
+        LEFT JOIN users u ON u.id = v.user_id
+        WHERE v.id = %s AND v.status = 'published'
+        """,
+        (video_id,)
+    )
+    video = cur.fetchone()
+    
+    if not video:
+        return error_response(404, 'Video not found')
+    
+    channel_cache.attach(cur, [video], ('channel_name', 'channel_avatar'))
+    record_view(video_id)
+    response_body = dumps({'video': video})
+    response_cache.set(params['cache_key'], response_body, RESPONSE_CACHE_TTL)
+    return respond_body(200, response_body, CACHE_MISS_HEADERS)
+
+def fetch_ranked_feed(cur: Any, sort: str, category: Optional[str], limit: int,
+                      cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''
+    Страница ленты «в тренде» или «популярное» по предрасчитанным video_scores
+    Returns: видео страницы и курсор следующей
+    Raises: ValueError - если курсор повреждён
+    '''
+    column = FEED_SORTS[sort]
+    ranked = f"SELECT s.video_id, s.{column} AS score FROM video_scores s WHERE s.is_published"
+    query_params: List[Any] = []
+    
+    if category:
+        ranked += " AND s.category = %s"
+        query_params.append(category)
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    if cursor:
+        _, score, row_id = decode_score_cursor(cursor, (sort,))
+        ranked += f" AND (s.{column}, s.video_id) < (%s, %s)"
+        query_params.extend((score, row_id))
     
+    ranked += f" ORDER BY s.{column} DESC, s.video_id DESC LIMIT %s"
+    query_params.append(limit + 1)
+    
+    cur.execute(
+        f"""
+        SELECT {VIDEO_COLUMNS}, ranked.score
+        FROM ({ranked}) ranked
+        JOIN videos v ON v.id = ranked.video_id
+        ORDER BY ranked.score DESC, ranked.video_id DESC
+        """,
+        query_params
+    )
+    videos = cur.fetchall()
+    next_cursor = None
+    if len(videos) > limit:
+        videos = videos[:limit]
+        next_cursor = encode_score_cursor(sort, videos[-1]['score'], videos[-1]['id'])
+    return channel_cache.attach(cur, videos), next_cursor
+
+def list_feed(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    user_id = params.get('user_id')
+    category = params.get('category')
+    sort = params.get('sort') or 'new'
+    limit = page_size(params)
+    
+    if sort != 'new' and (sort not in FEED_SORTS or user_id):
+        return error_response(400, 'Invalid sort')
+    
+    if sort in FEED_SORTS:
+        try:
+            videos, next_cursor = fetch_ranked_feed(cur, sort, category, limit, params.get('cursor'))
+        except ValueError:
+            return error_response(400, 'Invalid cursor')
+    else:
+        query = f"""
+            SELECT {VIDEO_COLUMNS}
+            FROM videos v 
+            WHERE v.status = 'published'
+        """
+        query_params: List[Any] = []
+        
+        if params.get('cursor'):
+            try:
+                query += " AND (v.created_at, v.id) < (%s, %s)"
+                query_params.extend(decode_cursor(params['cursor']))
+            except ValueError:
+                return error_response(400, 'Invalid cursor')
+        
+        if user_id:
+            query += " AND v.user_id = %s"
+            query_params.append(user_id)
+        
+        if category:
+            query += " AND v.category = %s"
+            query_params.append(category)
+        
+        query += " ORDER BY v.created_at DESC, v.id DESC LIMIT %s"
+        query_params.append(limit + 1)
+        
+        cur.execute(query, query_params)
+        videos = cur.fetchall()
+        next_cursor = None
+        if len(videos) > limit:
+            videos = videos[:limit]
+            next_cursor = encode_cursor(videos[-1]['created_at'], videos[-1]['id'])
+        channel_cache.attach(cur, videos)
+    
+    response_body = dumps({'videos': videos, 'next_cursor': next_cursor})
+    response_cache.set(params['cache_key'], response_body, RESPONSE_CACHE_TTL)
+    return respond_body(200, response_body, CACHE_MISS_HEADERS)
+
+def list_subscription_feed(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Новые видео всех каналов, на которые подписан пользователь, одной выборкой
+    По каждому каналу берётся не больше страницы из индекса (user_id, created_at, id),
+    полные строки читаются только для итоговой страницы
+    '''
     try:
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            video_id = params.get('id')
-            user_id = params.get('user_id')
-            category = params.get('category')
-            limit = int(params.get('limit', 20))
-            
-            if video_id:
-                cur.execute(
-                    """
-                    SELECT v.*, u.name as channel_name, u.avatar_url as channel_avatar, u.subscribers_count 
-                    FROM videos v 
-                    JOIN users u ON v.user_id = u.id 
-                    WHERE v.id = %s AND v.status = 'published'
-                    """,
-                    (video_id,)
-                )
-                video = cur.fetchone()
-                
-                if video:
-                    cur.execute("UPDATE videos SET views_count = views_count + 1 WHERE id = %s", (video_id,))
-                    conn.commit()
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'video': dict(video)}, default=str),
-                        'isBase64Encoded': False
-                    }
-                else:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Video not found'}),
-                        'isBase64Encoded': False
-                    }
-            
-            query = """
-                SELECT v.*, u.name as channel_name, u.avatar_url as channel_avatar, u.is_verified 
-                FROM videos v 
-                JOIN users u ON v.user_id = u.id 
-                WHERE v.status = 'published'
-            """
-            query_params = []
-            
-            if user_id:
-                query += " AND v.user_id = %s"
-                query_params.append(user_id)
-            
-            if category:
-                query += " AND v.category = %s"
-                query_params.append(category)
-            
-            query += " ORDER BY v.created_at DESC LIMIT %s"
-            query_params.append(limit)
-            
-            cur.execute(query, query_params)
-            videos = [dict(row) for row in cur.fetchall()]
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'videos': videos}, default=str),
-                'isBase64Encoded': False
-            }
+        user_id = int(params['user_id'])
+    except (KeyError, TypeError, ValueError):
+        return error_response(400, 'user_id required')
+    
+    limit = page_size(params)
+    query_params: Dict[str, Any] = {'user_id': user_id, 'limit': limit + 1}
+    cursor_filter = ''
+    if params.get('cursor'):
+        try:
+            query_params['created_at'], query_params['id'] = decode_cursor(params['cursor'])
+        except ValueError:
+            return error_response(400, 'Invalid cursor')
+        cursor_filter = 'AND (cv.created_at, cv.id) < (%(created_at)s, %(id)s)'
+    
+    cur.execute(
+        f"""
+        SELECT {VIDEO_COLUMNS}
+        FROM (
+            SELECT latest.id, latest.created_at
+            FROM subscriptions s
+            CROSS JOIN LATERAL (
+                SELECT cv.id, cv.created_at
+                FROM videos cv
+                WHERE cv.user_id = s.channel_id AND cv.status = 'published' {cursor_filter}
+                ORDER BY cv.created_at DESC, cv.id DESC
+                LIMIT %(limit)s
+            ) latest
+            WHERE s.subscriber_id = %(user_id)s
+            ORDER BY latest.created_at DESC, latest.id DESC
+            LIMIT %(limit)s
+        ) page
+        JOIN videos v ON v.id = page.id
+        ORDER BY v.created_at DESC, v.id DESC
+        """,
+        query_params
+    )
+    videos = cur.fetchall()
+    next_cursor = None
+    if len(videos) > limit:
+        videos = videos[:limit]
+        next_cursor = encode_cursor(videos[-1]['created_at'], videos[-1]['id'])
+    channel_cache.attach(cur, videos)
+    
+    response_body = dumps({'videos': videos, 'next_cursor': next_cursor})
+    response_cache.set(params['cache_key'], response_body, RESPONSE_CACHE_TTL)
+    return respond_body(200, response_body, CACHE_MISS_HEADERS)
+
+def search_videos(conn: Any, cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Поиск опубликованных видео по названию и описанию с ранжированием
+    Если полнотекстовый поиск ничего не нашёл, ищет по триграммам названия (опечатки)
+    '''
+    q = (params.get('q') or '').strip()
+    if not q:
+        return error_response(400, 'q required')
+    if len(q) > SEARCH_QUERY_MAX_LENGTH:
+        return error_response(400, 'Query too long')
+    
+    limit = page_size(params)
+    cursor = None
+    if params.get('cursor'):
+        try:
+            cursor = decode_score_cursor(params['cursor'], SEARCH_MODES)
+        except ValueError:
+            return error_response(400, 'Invalid cursor')
+    
+    modes = [cursor[0]] if cursor else ['fts', 'trgm']
+    for mode in modes:
+        score, match = SEARCH_MODES[mode]
+        query = f"""
+            SELECT * FROM (
+                SELECT {VIDEO_COLUMNS}, {score} AS score
+                FROM videos v
+                WHERE v.status = 'published' AND {match}
+            ) found
+        """
+        query_params: Dict[str, Any] = {'q': q, 'limit': limit + 1}
+        if cursor:
+            query += " WHERE (score, id) < (%(score)s, %(id)s)"
+            query_params.update(score=cursor[1], id=cursor[2])
+        query += " ORDER BY score DESC, id DESC LIMIT %(limit)s"
         
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            user_id = body_data.get('user_id')
-            title = body_data.get('title')
-            description = body_data.get('description', '')
-            video_base64 = body_data.get('video_base64')
-            thumbnail_base64 = body_data.get('thumbnail_base64')
-            duration = body_data.get('duration', 0)
-            category = body_data.get('category', 'Другое')
-            
-            if not user_id or not title or not video_base64:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing required fields'}),
-                    'isBase64Encoded': False
-                }
-            
-            video_data = base64.b64decode(video_base64)
-            video_filename = f'videos/{user_id}/{datetime.now().timestamp()}.mp4'
-            
-            s3.put_object(
-                Bucket='files',
-                Key=video_filename,
-                Body=video_data,
-                ContentType='video/mp4'
+        cur.execute(query, query_params)
+        videos = cur.fetchall()
+        if videos:
+            break
+    
+    next_cursor = None
+    if len(videos) > limit:
+        videos = videos[:limit]
+        next_cursor = encode_score_cursor(mode, videos[-1]['score'], videos[-1]['id'])
+    channel_cache.attach(cur, videos)
+    
+    response_body = dumps({'videos': videos, 'next_cursor': next_cursor})
+    response_cache.set(params['cache_key'], response_body, RESPONSE_CACHE_TTL)
+    return respond_body(200, response_body, CACHE_MISS_HEADERS)
+
+def upload_init(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Начинает multipart-загрузку и выдаёт presigned URL для каждой части
+    '''
+    user_id = body_data.get('user_id')
+    file_size = body_data.get('file_size')
+    content_type = body_data.get('content_type', 'video/mp4')
+    
+    if not user_id or file_size is None:
+        return error_response(400, 'Missing required fields')
+    if not isinstance(file_size, int) or isinstance(file_size, bool) or file_size <= 0:
+        return error_response(400, 'Invalid file_size')
+    if file_size > UPLOAD_MAX_BYTES:
+        return error_response(413, 'File too large')
+    
+    part_count = -(-file_size // UPLOAD_PART_SIZE)
+    video_filename = f'videos/{user_id}/{datetime.now().timestamp()}.mp4'
+    upload = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=video_filename, ContentType=content_type)
+    upload_id = upload['UploadId']
+    
+    result = {
+        'upload_id': upload_id,
+        'key': video_filename,
+        'part_size': UPLOAD_PART_SIZE,
+        'part_count': part_count,
+        **part_urls(video_filename, upload_id, 1, part_count),
+    }
+    
+    if body_data.get('with_thumbnail'):
+        thumbnail_filename = f'thumbnails/{user_id}/{datetime.now().timestamp()}.jpg'
+        result['thumbnail'] = {
+            'key': thumbnail_filename,
+            'url': s3.generate_presigned_url(
+                'put_object',
+                Params={'Bucket': S3_BUCKET, 'Key': thumbnail_filename, 'ContentType': 'image/jpeg'},
+                ExpiresIn=UPLOAD_URL_TTL
             )
-            
-            video_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{video_filename}"
-            
+        }
+    
+    return respond(200, result)
+
+def part_urls(key: str, upload_id: str, start: int, part_count: int) -> Dict[str, Any]:
+    '''
+    Presigned URL частей начиная со start, не больше UPLOAD_URLS_PER_REQUEST
+    Returns: {'parts': [...], 'next_part': номер следующей пачки или None}
+    '''
+    end = min(start + UPLOAD_URLS_PER_REQUEST - 1, part_count)
+    parts = [
+        {
+            'part_number': part_number,
+            'url': s3.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': S3_BUCKET, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+                ExpiresIn=UPLOAD_URL_TTL
+            )
+        }
+        for part_number in range(start, end + 1)
+    ]
+    return {'parts': parts, 'next_part': end + 1 if end < part_count else None}
+
+def upload_parts(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Следующая пачка presigned URL частей начатой загрузки (next_part из прошлого ответа)
+    '''
+    user_id = body_data.get('user_id')
+    video_filename = body_data.get('key') or ''
+    upload_id = body_data.get('upload_id')
+    start = body_data.get('start_part')
+    part_count = body_data.get('part_count')
+    
+    if not user_id or not upload_id or not video_filename.startswith(f'videos/{user_id}/'):
+        return error_response(400, 'Invalid upload')
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in (start, part_count)) \
+            or not 1 <= start <= part_count <= UPLOAD_MAX_PARTS:
+        return error_response(400, 'Invalid part range')
+    
+    return respond(200, part_urls(video_filename, upload_id, start, part_count))
+
+def valid_parts(parts: Any) -> bool:
+    '''
+    Список частей от клиента: [{'part_number': 1..UPLOAD_MAX_PARTS, 'etag': строка}], номера не повторяются
+    '''
+    if not isinstance(parts, list) or len(parts) > UPLOAD_MAX_PARTS:
+        return False
+    numbers = set()
+    for part in parts:
+        if not isinstance(part, dict):
+            return False
+        number, etag = part.get('part_number'), part.get('etag')
+        if not isinstance(number, int) or isinstance(number, bool) or not 1 <= number <= UPLOAD_MAX_PARTS \
+                or not isinstance(etag, str) or not etag or number in numbers:
+            return False
+        numbers.add(number)
+    return True
+
+def upload_finish(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Завершает (upload_complete) или отменяет (upload_abort) multipart-загрузку
+    '''
+    user_id = body_data.get('user_id')
+    video_filename = body_data.get('key') or ''
+    upload_id = body_data.get('upload_id')
+    
+    if not user_id or not upload_id or not video_filename.startswith(f'videos/{user_id}/'):
+        return error_response(400, 'Invalid upload')
+    
+    if body_data.get('action') == 'upload_abort':
+        s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=video_filename, UploadId=upload_id)
+        return respond(200, {'success': True})
+    
+    title = body_data.get('title')
+    parts = body_data.get('parts') or []
+    thumbnail_filename = body_data.get('thumbnail_key')
+    
+    if not title or not parts:
+        return error_response(400, 'Missing required fields')
+    if not valid_parts(parts):
+        return error_response(400, 'Invalid parts')
+    
+    try:
+        s3.complete_multipart_upload(
+            Bucket=S3_BUCKET,
+            Key=video_filename,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(
+                ({'PartNumber': part['part_number'], 'ETag': part['etag']} for part in parts),
+                key=lambda part: part['PartNumber']
+            )}
+        )
+    except s3.exceptions.ClientError as e:
+        return error_response(400, e.response.get('Error', {}).get('Message', 'Upload failed'))
+    
+    thumbnail_url = None
+    if thumbnail_filename and thumbnail_filename.startswith(f'thumbnails/{user_id}/'):
+        try:
+            s3.head_object(Bucket=S3_BUCKET, Key=thumbnail_filename)
+            thumbnail_url = cdn_url(thumbnail_filename)
+        except s3.exceptions.ClientError:
             thumbnail_url = None
-            if thumbnail_base64:
-                thumbnail_data = base64.b64decode(thumbnail_base64)
-                thumbnail_filename = f'thumbnails/{user_id}/{datetime.now().timestamp()}.jpg'
-                s3.put_object(
-                    Bucket='files',
-                    Key=thumbnail_filename,
-                    Body=thumbnail_data,
-                    ContentType='image/jpeg'
-                )
-                thumbnail_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{thumbnail_filename}"
+    
+    video = create_video(
+        conn, cur, user_id, title, body_data.get('description', ''),
+        video_filename, thumbnail_url,
+        body_data.get('duration', 0), body_data.get('category', 'Другое')
+    )
+    
+    return respond(200, {'video': video})
+
+def upload_base64(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Загрузка небольшого видео целиком в теле запроса (base64)
+    '''
+    user_id = body_data.get('user_id')
+    title = body_data.get('title')
+    video_base64 = body_data.get('video_base64')
+    thumbnail_base64 = body_data.get('thumbnail_base64')
+    
+    if not user_id or not title or not video_base64:
+        return error_response(400, 'Missing required fields')
+    if not isinstance(video_base64, str) or not isinstance(thumbnail_base64 or '', str):
+        return error_response(400, 'Invalid base64')
+    if len(video_base64) > UPLOAD_BASE64_MAX_BYTES * 4 // 3 + 4 \
+            or len(thumbnail_base64 or '') > UPLOAD_THUMBNAIL_MAX_BYTES * 4 // 3 + 4:
+        return error_response(413, 'File too large, use upload_init')
+    
+    try:
+        video_data = base64.b64decode(video_base64, validate=True)
+        thumbnail_data = base64.b64decode(thumbnail_base64, validate=True) if thumbnail_base64 else None
+    except (TypeError, ValueError):
+        return error_response(400, 'Invalid base64')
+    video_filename = f'videos/{user_id}/{datetime.now().timestamp()}.mp4'
+    
+    s3.put_object(
+        Bucket=S3_BUCKET,
+        Key=video_filename,
+        Body=video_data,
+        ContentType='video/mp4'
+    )
+    
+    thumbnail_url = None
+    if thumbnail_data:
+        thumbnail_filename = f'thumbnails/{user_id}/{datetime.now().timestamp()}.jpg'
+        s3.put_object(
+            Bucket=S3_BUCKET,
+            Key=thumbnail_filename,
+            Body=thumbnail_data,
+            ContentType='image/jpeg'
+        )
+        thumbnail_url = cdn_url(thumbnail_filename)
+    
+    video = create_video(
+        conn, cur, user_id, title, body_data.get('description', ''),
+        video_filename, thumbnail_url,
+        body_data.get('duration', 0), body_data.get('category', 'Другое')
+    )
+    
+    return respond(200, {'video': video})
+
+def process_media(conn: Any, cur: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Воркер обработки загруженных видео: забирает очередь, считает длительность и превью
+    в ограниченном пуле процессов и записывает результат
+    '''
+    from concurrent.futures import BrokenExecutor
+    
+    global _media_pool
+    try:
+        batch_size = min(max(int(body_data.get('batch_size', MEDIA_BATCH_SIZE)), 1), 100)
+    except (TypeError, ValueError):
+        return error_response(400, 'Invalid batch_size')
+    
+    cur.execute(
+        """
+        UPDATE videos SET
+            processing_status = 'processing',
+            processing_attempts = processing_attempts + 1,
+            processing_started_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM videos
+            WHERE processing_status = 'pending'
+               OR (processing_status = 'processing'
+                   AND processing_started_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, storage_key, processing_attempts
+        """,
+        (MEDIA_CLAIM_TIMEOUT, batch_size)
+    )
+    claimed = cur.fetchall()
+    conn.commit()
+    
+    summary = {'claimed': len(claimed), 'processed': 0, 'retried': 0, 'failed': 0}
+    futures = [
+        (video, media_pool().submit(derive_media, s3.generate_presigned_url(
+            'get_object', Params={'Bucket': S3_BUCKET, 'Key': video['storage_key']}, ExpiresIn=UPLOAD_URL_TTL
+        )))
+        for video in claimed
+    ]
+    
+    for video, future in futures:
+        try:
+            media = future.result(timeout=3 * MEDIA_COMMAND_TIMEOUT)
+            thumbnails = {}
+            for name, data in media['thumbnails'].items():
+                thumbnail_filename = f"thumbnails/{video['user_id']}/{video['id']}_{name}.jpg"
+                s3.put_object(Bucket=S3_BUCKET, Key=thumbnail_filename, Body=data, ContentType='image/jpeg')
+                thumbnails[name] = cdn_url(thumbnail_filename)
             
             cur.execute(
                 """
-                INSERT INTO videos (user_id, title, description, video_url, thumbnail_url, duration, category) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s) 
-                RETURNING id, title, description, video_url, thumbnail_url, duration, views_count, likes_count, created_at
+                UPDATE videos SET
+                    duration = %s,
+                    thumbnails = %s,
+                    thumbnail_url = COALESCE(thumbnail_url, %s),
+                    processing_status = 'done',
+                    processing_error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
                 """,
-                (user_id, title, description, video_url, thumbnail_url, duration, category)
+                (round(media['duration']), Json(thumbnails), thumbnails['medium'], video['id'])
             )
-            video = dict(cur.fetchone())
-            conn.commit()
-            
+            summary['processed'] += 1
+        except Exception as e:
+            if isinstance(e, BrokenExecutor):
+                _media_pool = None
+            status = 'failed' if video['processing_attempts'] >= MEDIA_MAX_ATTEMPTS else 'pending'
             cur.execute(
-                """
-                INSERT INTO notifications (user_id, type, title, message, link)
-                SELECT s.subscriber_id, 'new_video', %s, %s, %s
-                FROM subscriptions s
-                WHERE s.channel_id = %s
-                """,
-                (f'Новое видео от канала', title, f'/video/{video["id"]}', user_id)
+                "UPDATE videos SET processing_status = %s, processing_error = %s WHERE id = %s",
+                (status, f'{type(e).__name__}: {e}'[:1000], video['id'])
             )
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'video': video}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
+            summary['failed' if status == 'failed' else 'retried'] += 1
+        conn.commit()
+    
+    if summary['processed']:
+        response_cache.incr(CACHE_GENERATION_KEY)
+    return respond(200, summary)
+
+GET_ACTIONS = {
+    'search': search_videos,
+    'subscriptions': list_subscription_feed,
+}
+
+SESSION_GET_ACTIONS = {'subscriptions'}
+
+POST_ACTIONS = {
+    None: upload_base64,
+    'upload_init': upload_init,
+    'upload_parts': upload_parts,
+    'upload_complete': upload_finish,
+    'upload_abort': upload_finish,
+    'process_media': process_media,
+}
+
+WORKER_ACTIONS = {'process_media'}
+
+# Параметры GET-маршрута, от которых зависит ответ; user_id подписок берётся из сессии
+CACHE_KEY_PARAMS = {
+    get_video: ('id',),
+    list_feed: ('user_id', 'category', 'sort', 'limit', 'cursor'),
+    list_subscription_feed: ('user_id', 'limit', 'cursor'),
+    search_videos: ('q', 'limit', 'cursor'),
+}
+
+def response_cache_key(route: Any, params: Dict[str, Any]) -> str:
+    '''
+    Ключ кэша ответа из сырых параметров запроса, без разбора и проверки: ответы с ошибкой
+    не кэшируются, поэтому некорректные параметры дают только промах
+    '''
+    return '{}:{}:{}'.format(route.__name__, response_cache.get_counter(CACHE_GENERATION_KEY),
+                             json.dumps([params.get(name) or '' for name in CACHE_KEY_PARAMS[route]]))
+
+@instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Работа с видео: загрузка, получение, удаление
+    Args: event - запрос с httpMethod, body, queryStringParameters
+          context - контекст выполнения
+    Returns: HTTP ответ с данными видео
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return OPTIONS_RESPONSE
+    
+    if method == 'GET':
+        data = dict(event.get('queryStringParameters') or {})
+        route = GET_ACTIONS.get(data.get('action')) or (get_video if data.get('id') else list_feed)
+    elif method == 'POST':
+        if len(event.get('body') or '') > MAX_BODY_BYTES:
+            return error_response(413, 'Payload too large')
+        data = json.loads(event.get('body') or '{}')
+        route = POST_ACTIONS.get(data.get('action'))
+        if route is None:
+            return error_response(400, 'Invalid action')
+    else:
+        return error_response(405, 'Method not allowed')
+    
+    set_action(route.__name__)
+    
+    if method == 'POST' or data.get('action') in SESSION_GET_ACTIONS:
+        session = verify_session(event)
+        if session is None:
+            return error_response(401, 'Unauthorized')
+        if data.get('action') in WORKER_ACTIONS and session['role'] != 'admin':
+            return error_response(403, 'Access denied')
+        data['user_id'] = session['sub']
+    
+    if method == 'POST':
+        limited = rate_limiter.check(event, data.get('action'), data['user_id'])
+        if limited is not None:
+            return limited
+    else:
+        # Попадание в кэш отвечает без соединения из пула
+        data['cache_key'] = response_cache_key(route, data)
+        cached_body = response_cache.get(data['cache_key'])
+        if cached_body is not None:
+            if route is get_video:
+                record_view(int(data['id']))
+                # Соединение для сброса просмотров берётся, только когда подошёл срок
+                flush_views()
+            return respond_body(200, cached_body, CACHE_HIT_HEADERS)
+    
+    conn = get_conn()
+    cur = conn.cursor(cursor_factory=TimedCursor)
+    
+    try:
+        return route(conn, cur, data)
     
     finally:
         cur.close()
-        conn.close()
+        flush_views(conn)
+        put_conn(conn)
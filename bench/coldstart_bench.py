@@ -0,0 +1,141 @@
+'''
+Холодный старт функций: импорт index.py и первый запрос в свежем процессе
+
+Каждый замер — отдельный интерпретатор с -X importtime: время импорта модуля,
+первого вызова handler() и всего процесса, плюс самые дорогие импорты верхнего уровня.
+Без DATABASE_URL первый запрос — OPTIONS (без БД), с ним — типичный GET.
+
+Запуск:
+    python bench/coldstart_bench.py                      # текущее дерево
+    python bench/coldstart_bench.py --rev HEAD~1         # сравнить с ревизией git
+    python bench/coldstart_bench.py --runs 10 --top 8 --json
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ['videos', 'interactions', 'auth', 'admin']
+
+FIRST_EVENTS = {
+    'videos': {'httpMethod': 'GET', 'queryStringParameters': {'limit': '20'}},
+    'interactions': {'httpMethod': 'GET', 'queryStringParameters': {'video_id': '1'}},
+    'auth': {'httpMethod': 'POST', 'body': json.dumps({'action': 'login', 'email': 'cold@example.com'})},
+    'admin': {'httpMethod': 'GET', 'queryStringParameters': {'action': 'stats'}},
+}
+
+CHILD = '''
+import importlib.util, json, os, sys, time
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+sys.stderr.write('cold start\\n')
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('cold_index', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+status = module.handler(json.loads(sys.argv[2]), None)['statusCode']
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'first_call_ms': (time.perf_counter() - imported) * 1000, 'status': status}))
+'''
+
+def source_path(name: str, rev: Optional[str], workdir: str) -> str:
+    '''
+    Путь к index.py функции; для ревизии git её папка (index.py и handler_core.py,
+    если он в ней уже был) выгружается в workdir
+    '''
+    if not rev:
+        return os.path.join(ROOT, 'backend', name, 'index.py')
+    directory = os.path.join(workdir, name)
+    os.makedirs(directory, exist_ok=True)
+    for filename in ('index.py', 'handler_core.py'):
+        try:
+            source = subprocess.check_output(['git', 'show', f'{rev}:backend/{name}/{filename}'], cwd=ROOT,
+                                             stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            if filename == 'index.py':
+                raise
+            continue
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(source)
+    return os.path.join(directory, 'index.py')
+
+def top_imports(importtime_log: str, top: int) -> List[Dict[str, Any]]:
+    '''
+    Прямые импорты модуля функции по суммарному времени из вывода -X importtime
+    '''
+    entries = []
+    for line in importtime_log.split('cold start\n', 1)[-1].splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        if package.startswith(' ') and not package.startswith('  '):
+            entries.append({'module': package.strip(), 'cumulative_ms': round(int(cumulative) / 1000, 1)})
+    return sorted(entries, key=lambda entry: entry['cumulative_ms'], reverse=True)[:top]
+
+def measure(name: str, rev: Optional[str] = None, runs: int = 5, top: int = 5,
+            env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Медианы по runs свежим процессам: импорт, первый запрос и весь процесс, в мс
+    '''
+    child_env = dict(os.environ, **(env or {}))
+    child_env.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    child_env.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    child_env.setdefault('SESSION_SECRET', 'bench')
+    child_env['METRICS_FLUSH_INTERVAL'] = '0'
+    event = FIRST_EVENTS[name] if 'DATABASE_URL' in child_env else {'httpMethod': 'OPTIONS'}
+    child_env.setdefault('DATABASE_URL', 'postgresql://bench@localhost/bench')
+
+    samples: Dict[str, List[float]] = {'import_ms': [], 'first_call_ms': [], 'process_ms': []}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = source_path(name, rev, workdir)
+        for _ in range(runs):
+            started = time.perf_counter()
+            child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, path, json.dumps(event)],
+                                   capture_output=True, text=True, env=child_env, cwd=workdir)
+            samples['process_ms'].append((time.perf_counter() - started) * 1000)
+            if child.returncode != 0:
+                raise RuntimeError(f'{name}: {child.stderr.strip().splitlines()[-1]}')
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            samples['import_ms'].append(result['import_ms'])
+            samples['first_call_ms'].append(result['first_call_ms'])
+
+    return {
+        'function': name,
+        'rev': rev or 'worktree',
+        'first_event': event.get('httpMethod'),
+        'status': result['status'],
+        **{key: round(statistics.median(values), 1) for key, values in samples.items()},
+        'top_imports': top_imports(child.stderr, top),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rev', help='ревизия git для сравнения с рабочим деревом')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='сколько самых дорогих импортов показать')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args()
+
+    current = [measure(name, None, args.runs, args.top) for name in FUNCTIONS]
+    baseline = {row['function']: row for row in (measure(name, args.rev, args.runs, args.top) for name in FUNCTIONS)} \
+        if args.rev else {}
+
+    if args.json:
+        print(json.dumps({'current': current, 'baseline': list(baseline.values())}, indent=2))
+        return
+
+    print(f"{'function':<14}{'import, ms':>12}{'before':>10}{'1st call, ms':>14}{'process, ms':>13}  top imports")
+    for row in current:
+        before = baseline.get(row['function'])
+        imports = ', '.join(f"{entry['module']} {entry['cumulative_ms']}" for entry in row['top_imports'])
+        print(f"{row['function']:<14}{row['import_ms']:>12}{before['import_ms'] if before else '-':>10}"
+              f"{row['first_call_ms']:>14}{row['process_ms']:>13}  {imports}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+'''
+Проверка планов: каждый горячий запрос обработчиков использует предназначенный ему индекс
+
+Создаёт отдельную схему с миграциями и синтетическими данными (как load_bench.py), вызывает
+handler() для типичных запросов, перехватывает выполненные SQL и прогоняет их через
+EXPLAIN. Для секционированных таблиц индекс секции сводится к индексу родительской таблицы.
+Код возврата 1, если хоть один ожидаемый индекс не попал в план.
+
+Запуск (нужен PostgreSQL в DATABASE_URL):
+    python bench/explain_check.py
+    python bench/explain_check.py --videos 1000000 --json
+    python bench/explain_check.py --force-index          # SET enable_seqscan = off: проверить форму индекса на малых данных
+'''
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_bench import PASSWORD, load_function, seed, setup_schema
+
+executed: List[Tuple[Any, Any]] = []
+
+class RecordingCursor(RealDictCursor):
+    def execute(self, query: Any, vars: Any = None) -> None:
+        executed.append((query, vars))
+        return super().execute(query, vars)
+
+def get(params: Dict[str, str], token: Optional[str] = None) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': {'X-Auth-Token': token} if token else {}}
+
+def post(body: Dict[str, Any], token: str) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'body': json.dumps(body), 'headers': {'X-Auth-Token': token}}
+
+def cases(user_token: str, admin_token: str) -> List[Tuple[str, str, Dict[str, Any], Set[str]]]:
+    '''
+    (название, функция, событие, индексы, которые обязаны быть в планах запросов)
+    '''
+    return [
+        ('feed', 'videos', get({'limit': '20'}), {'idx_videos_published_created'}),
+        ('feed_category', 'videos', get({'category': 'Категория 3'}), {'idx_videos_published_category_created'}),
+        ('channel_feed', 'videos', get({'user_id': '7'}), {'idx_videos_channel_published_created'}),
+        ('trending', 'videos', get({'sort': 'trending'}), {'idx_video_scores_trending'}),
+        ('trending_category', 'videos', get({'sort': 'trending', 'category': 'Категория 3'}),
+         {'idx_video_scores_category_trending'}),
+        ('search', 'videos', get({'action': 'search', 'q': 'гитара'}), {'idx_videos_search_vector'}),
+        ('subscriptions', 'videos', get({'action': 'subscriptions'}, user_token), {'idx_videos_channel_published_created'}),
+        ('video', 'videos', get({'id': '5'}), {'videos_pkey'}),
+        ('comments', 'interactions', get({'video_id': '32'}),
+         {'idx_comments_video_top_created', 'idx_comments_parent_created'}),
+        ('replies', 'interactions', get({'action': 'replies', 'parent_comment_id': '1'}), {'idx_comments_parent_created'}),
+        ('notifications', 'interactions', get({'action': 'notifications'}, user_token), {'idx_notifications_user_created'}),
+        ('mark_read', 'interactions', post({'action': 'mark_read', 'ids': [1, 2, 3]}, user_token),
+         {'idx_notifications_user_created'}),
+        ('watch_upsert', 'interactions', post({'action': 'batch', 'events': [
+            {'type': 'watch', 'video_id': 5, 'position': 120}]}, user_token), {'idx_watch_history_user_video'}),
+        ('login', 'auth', {'httpMethod': 'POST', 'body': json.dumps({
+            'action': 'login', 'email': 'load7@example.com', 'password': PASSWORD})}, {'users_email_key'}),
+        ('pending_reports', 'admin', get({'action': 'reports'}, admin_token), {'idx_reports_pending_created'}),
+        ('stats_fresh', 'admin', get({'action': 'stats', 'fresh': '1'}, admin_token), {'idx_reports_pending_created'}),
+    ]
+
+def plan_summary(cur: Any, query: Any, params: Any) -> Dict[str, Any]:
+    '''
+    Индексы (включая арбитры ON CONFLICT), последовательные сканы и число сканируемых секций
+    '''
+    statement = cur.mogrify(query, params)
+    cur.execute(b'EXPLAIN (FORMAT JSON) ' + statement)
+    summary: Dict[str, Any] = {'indexes': set(), 'seq_scans': set(), 'relations': set()}
+
+    def walk(node: Dict[str, Any]) -> None:
+        if node.get('Index Name'):
+            summary['indexes'].add(node['Index Name'])
+        summary['indexes'].update(node.get('Conflict Arbiter Indexes', []))
+        if node.get('Relation Name'):
+            summary['relations'].add(node['Relation Name'])
+            if node['Node Type'] == 'Seq Scan':
+                summary['seq_scans'].add(node['Relation Name'])
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(cur.fetchone()['QUERY PLAN'][0]['Plan'])
+    return summary
+
+def parent_names(cur: Any, names: Set[str]) -> Set[str]:
+    '''
+    Индексы и таблицы секций -> имена на родительской таблице
+    '''
+    if not names:
+        return set()
+    cur.execute(
+        """
+        SELECT child.relname AS name, COALESCE(parent.relname, child.relname) AS parent
+        FROM pg_class child
+        LEFT JOIN pg_inherits i ON i.inhrelid = child.oid
+        LEFT JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE child.relname = ANY(%s) AND pg_table_is_visible(child.oid)
+        """,
+        (list(names),)
+    )
+    mapping = {row['name']: row['parent'] for row in cur.fetchall()}
+    return {mapping.get(name, name) for name in names}
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--videos', type=int, default=200000)
+    parser.add_argument('--likes', type=int, default=200000)
+    parser.add_argument('--comments', type=int, default=40000)
+    parser.add_argument('--subscriptions', type=int, default=20000)
+    parser.add_argument('--schema', default='bench_explain')
+    parser.add_argument('--force-index', action='store_true', help='запретить seq scan при EXPLAIN')
+    parser.add_argument('--keep', action='store_true', help='оставить схему с данными после прогона')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 1
+    scale = {key: getattr(args, key) for key in ('users', 'videos', 'likes', 'comments', 'subscriptions')}
+    base_dsn = os.environ['DATABASE_URL']
+    dsn = make_dsn(base_dsn, options=f'-c search_path={args.schema},public')
+    setup_schema(base_dsn, args.schema)
+
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('SESSION_SECRET', 'bench')
+    os.environ['RESPONSE_CACHE_TTL'] = '0'
+    os.environ['RATE_LIMIT_SCALE'] = '0'
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['METRICS_FLUSH_INTERVAL'] = '0'
+    os.environ.pop('CACHE_URL', None)
+
+    modules = {name: load_function(name) for name in ('videos', 'interactions', 'auth', 'admin')}
+    for module in modules.values():
+        module.TimedCursor = RecordingCursor
+
+    raw = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    raw.autocommit = True
+    results = []
+    try:
+        seed(dsn, scale, modules['auth'].hash_password(PASSWORD))
+        admin_token = modules['auth'].issue_token({'id': 1, 'role': 'admin'})
+        user_token = modules['auth'].issue_token({'id': 7, 'role': 'user'})
+        modules['admin'].handler(post({'action': 'recompute_scores', 'max_batches': 10000}, admin_token), None)
+
+        with raw.cursor() as cur:
+            if args.force_index:
+                cur.execute('SET enable_seqscan = off')
+            for name, function, event, expected in cases(user_token, admin_token):
+                executed.clear()
+                status = modules[function].handler(event, None)['statusCode']
+                indexes: Set[str] = set()
+                seq_scans: Set[str] = set()
+                relations: Set[str] = set()
+                for query, params in list(executed):
+                    summary = plan_summary(cur, query, params)
+                    indexes |= summary['indexes']
+                    seq_scans |= summary['seq_scans']
+                    relations |= summary['relations']
+                indexes = parent_names(cur, indexes)
+                missing = sorted(expected - indexes)
+                results.append({
+                    'case': name,
+                    'status': status,
+                    'ok': not missing and status < 500,
+                    'missing': missing,
+                    'indexes': sorted(indexes),
+                    'seq_scans': sorted(parent_names(cur, seq_scans)),
+                    'partitions_scanned': len(relations - parent_names(cur, relations)),
+                })
+    finally:
+        with raw.cursor() as cur:
+            if not args.keep:
+                cur.execute(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+        raw.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        print(f"{'case':<20}{'ok':<6}{'missing':<40}seq scans")
+        for row in results:
+            print(f"{row['case']:<20}{'yes' if row['ok'] else 'NO':<6}{', '.join(row['missing']) or '-':<40}"
+                  f"{', '.join(row['seq_scans']) or '-'}")
+    return 0 if all(row['ok'] for row in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+'''
+Микробенчмарк CPU на один вызов handler() для всех четырёх функций
+
+База данных подменяется заглушкой с готовыми строками, поэтому измеряется только
+собственная работа обработчика: разбор запроса, маршрутизация, сборка ответа и JSON.
+
+Запуск:
+    python bench/handlers_bench.py                    # текущее дерево
+    python bench/handlers_bench.py --rev baseline     # сравнить с ревизией git
+    python bench/handlers_bench.py --rev HEAD~1 --iterations 20000 --json
+'''
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ['videos', 'interactions', 'auth', 'admin']
+
+os.environ.setdefault('DATABASE_URL', 'postgresql://bench@localhost/bench')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('RESPONSE_CACHE_TTL', '0')
+os.environ.setdefault('SESSION_SECRET', 'bench')
+os.environ.setdefault('RATE_LIMIT_SCALE', '0')
+os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+os.environ.setdefault('METRICS_FLUSH_INTERVAL', '0')
+# Стоимость scrypt меряет password_bench.py; здесь — только накладные расходы обработчика
+os.environ.setdefault('PASSWORD_SCRYPT_N', '16')
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+def fake_row(index: int) -> Dict[str, Any]:
+    return {
+        'id': index + 1,
+        'user_id': 7,
+        'title': f'Видео номер {index}',
+        'description': 'Описание ролика ' * 4,
+        'video_url': f'https://cdn.example/videos/7/{index}.mp4',
+        'thumbnail_url': f'https://cdn.example/thumbnails/7/{index}.jpg',
+        'duration': 615,
+        'views_count': 1000 + index,
+        'likes_count': 50,
+        'dislikes_count': 2,
+        'category': 'Музыка',
+        'status': 'published',
+        'is_moderated': False,
+        'created_at': NOW - timedelta(minutes=index),
+        'updated_at': NOW,
+        'channel_name': 'Канал',
+        'channel_avatar': 'https://cdn.example/avatar.svg',
+        'is_verified': True,
+        'subscribers_count': 4200,
+        'email': 'user@example.com',
+        'name': 'Пользователь',
+        'avatar_url': 'https://cdn.example/avatar.svg',
+        'role': 'user',
+        'text': 'Комментарий',
+        'author_name': 'Автор',
+        'author_avatar': 'https://cdn.example/avatar.svg',
+        'parent_comment_id': None,
+        'is_like': True,
+        'total_users': 1000,
+        'total_videos': 5000,
+        'total_comments': 20000,
+        'pending_reports': 12,
+        'refreshed_at': NOW,
+        'stale_seconds': 1.5,
+        'score': 0.5,
+    }
+
+FULL_ROWS = [fake_row(i) for i in range(21)]
+
+def password_hash(password: str) -> str:
+    '''
+    Хеш пароля в формате auth (scrypt$N$r$p$соль$хеш) с параметрами из окружения
+    '''
+    def b64(raw: bytes) -> str:
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+    n, r, p = int(os.environ['PASSWORD_SCRYPT_N']), 8, 1
+    digest = hashlib.scrypt(password.encode(), salt=b'bench', n=n, r=r, p=p, dklen=32)
+    return f'scrypt${n}${r}${p}${b64(b"bench")}${b64(digest)}'
+
+USER_ROWS = [{key: FULL_ROWS[0][key] for key in ('id', 'email', 'name', 'avatar_url', 'subscribers_count', 'role', 'is_verified')}]
+USER_ROWS[0]['password_hash'] = password_hash('secret')
+COUNTER_ROWS = [{'likes_count': 51, 'dislikes_count': 2, 'is_like': True}]
+fake_rows = FULL_ROWS
+
+class FakeCursor:
+    def __init__(self, connection: 'FakeConnection'):
+        self.connection = connection
+        self.rowcount = 1
+
+    def __enter__(self) -> 'FakeCursor':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def execute(self, query: Any, params: Any = None) -> None:
+        self.query = query
+
+    def mogrify(self, template: Any, args: Any = None) -> bytes:
+        return b'(0)'
+
+    def fetchone(self) -> Dict[str, Any]:
+        return dict(fake_rows[0])
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        if 'revoked_sessions' in str(self.query):
+            return []
+        return [dict(row) for row in fake_rows]
+
+    def close(self) -> None:
+        pass
+
+class FakeConnection:
+    closed = 0
+    encoding = 'UTF8'
+
+    def cursor(self, cursor_factory: Any = None) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def get_transaction_status(self) -> int:
+        return 0
+
+psycopg2.connect = lambda *args, **kwargs: FakeConnection()
+
+def session_token(user_id: int, role: str) -> str:
+    '''
+    Токен сессии в формате auth (подпись HMAC-SHA256 секретом SESSION_SECRET)
+    '''
+    def b64(raw: bytes) -> str:
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+    claims = {'sub': user_id, 'role': role, 'iat': int(time.time()), 'exp': int(time.time()) + 3600, 'jti': 'bench'}
+    payload = b64(json.dumps(claims).encode())
+    signature = hmac.new(os.environ['SESSION_SECRET'].encode(), payload.encode(), hashlib.sha256).digest()
+    return f'{payload}.{b64(signature)}'
+
+USER_HEADERS = {'X-Auth-Token': session_token(7, 'user')}
+# X-User-Role нужен старым ревизиям (до токенов) при сравнении через --rev
+ADMIN_HEADERS = {'X-Auth-Token': session_token(1, 'admin'), 'X-User-Role': 'admin'}
+
+EVENTS: Dict[str, Dict[str, Dict[str, Any]]] = {
+    'videos': {
+        'options': {'httpMethod': 'OPTIONS'},
+        'feed': {'httpMethod': 'GET', 'queryStringParameters': {'limit': '20'}},
+        'video': {'httpMethod': 'GET', 'queryStringParameters': {'id': '1'}},
+        'trending': {'httpMethod': 'GET', 'queryStringParameters': {'sort': 'trending', 'limit': '20'}},
+        'search': {'httpMethod': 'GET', 'queryStringParameters': {'action': 'search', 'q': 'гитара'}},
+    },
+    'interactions': {
+        'comments': {'httpMethod': 'GET', 'queryStringParameters': {'video_id': '1'}},
+        'like_video': {'httpMethod': 'POST', 'body': json.dumps({'action': 'like_video', 'user_id': 7, 'video_id': 1}),
+                       'headers': USER_HEADERS},
+    },
+    'auth': {
+        'login': {'httpMethod': 'POST', 'body': json.dumps({'action': 'login', 'email': 'user@example.com', 'password': 'secret'})},
+    },
+    'admin': {
+        'stats': {'httpMethod': 'GET', 'queryStringParameters': {'action': 'stats'}, 'headers': ADMIN_HEADERS},
+        'videos': {'httpMethod': 'GET', 'queryStringParameters': {'action': 'videos'}, 'headers': ADMIN_HEADERS},
+    },
+}
+
+EVENT_ROWS = {
+    ('interactions', 'like_video'): COUNTER_ROWS,
+    ('auth', 'login'): USER_ROWS,
+}
+
+def read_source(name: str, filename: str, rev: Optional[str]) -> Optional[str]:
+    if rev:
+        try:
+            return subprocess.check_output(['git', 'show', f'{rev}:backend/{name}/{filename}'], cwd=ROOT,
+                                           stderr=subprocess.DEVNULL).decode()
+        except subprocess.CalledProcessError:
+            return None
+    try:
+        with open(os.path.join(ROOT, 'backend', name, filename), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def exec_source(module_name: str, path: str, source: str) -> types.ModuleType:
+    module = types.ModuleType(module_name)
+    module.__file__ = path
+    exec(compile(source, path, 'exec'), module.__dict__)
+    return module
+
+def load_function(name: str, rev: Optional[str]) -> types.ModuleType:
+    '''
+    Загружает index.py функции из рабочего дерева или из ревизии git; у каждой функции
+    свой экземпляр handler_core из её папки, как в отдельном процессе функции
+    '''
+    directory = os.path.join(ROOT, 'backend', name)
+    core_source = read_source(name, 'handler_core.py', rev)
+    if core_source is not None:
+        sys.modules['handler_core'] = exec_source('handler_core', os.path.join(directory, 'handler_core.py'),
+                                                  core_source)
+    try:
+        return exec_source(f'bench_{name}_{rev or "worktree"}', os.path.join(directory, 'index.py'),
+                           read_source(name, 'index.py', rev))
+    finally:
+        sys.modules.pop('handler_core', None)
+
+def measure(handler: Any, event: Dict[str, Any], iterations: int) -> float:
+    for _ in range(min(iterations, 200)):
+        handler(event, None)
+    started = time.process_time()
+    for _ in range(iterations):
+        handler(event, None)
+    return (time.process_time() - started) / iterations * 1e6
+
+def run(rev: Optional[str], iterations: int) -> List[Dict[str, Any]]:
+    global fake_rows
+    results = []
+    for name in FUNCTIONS:
+        module = load_function(name, rev)
+        for event_name, event in EVENTS[name].items():
+            fake_rows = EVENT_ROWS.get((name, event_name), FULL_ROWS)
+            results.append({
+                'rev': rev or 'worktree',
+                'function': name,
+                'event': event_name,
+                'iterations': iterations,
+                'cpu_us_per_call': round(measure(module.handler, event, iterations), 2),
+            })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rev', help='ревизия git для сравнения с рабочим деревом')
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args()
+
+    current = run(None, args.iterations)
+    baseline = {(r['function'], r['event']): r for r in run(args.rev, args.iterations)} if args.rev else {}
+
+    if args.json:
+        print(json.dumps({'current': current, 'baseline': list(baseline.values())}, indent=2))
+        return
+
+    print(f"{'function':<14}{'event':<14}{'before, us':>12}{'after, us':>12}{'speedup':>10}")
+    for row in current:
+        before = baseline.get((row['function'], row['event']))
+        before_us = before['cpu_us_per_call'] if before else None
+        speedup = f"{before_us / row['cpu_us_per_call']:.2f}x" if before_us else '-'
+        print(f"{row['function']:<14}{row['event']:<14}{before_us if before_us is not None else '-':>12}"
+              f"{row['cpu_us_per_call']:>12}{speedup:>10}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,389 @@
+'''
+Нагрузочный прогон всех четырёх функций на локальном PostgreSQL
+
+Создаёт отдельную схему, накатывает миграции из db_migrations, заливает синтетические
+данные заданного масштаба и гоняет смешанную нагрузку через настоящие handler(event, context)
+в несколько потоков. Загрузки идут в локальный S3 (moto) через S3_ENDPOINT_URL. По каждому
+действию считает p50/p95/p99, QPS и коды ответов; результат в JSON можно сохранить и
+сравнить со следующим прогоном.
+
+Запуск (нужен PostgreSQL в DATABASE_URL):
+    python bench/load_bench.py                                   # 2 000 пользователей, 20 000 видео, 8 потоков, 30 с
+    python bench/load_bench.py --videos 200000 --concurrency 16 --duration 60 --output before.json
+    python bench/load_bench.py --compare before.json             # p95 и QPS относительно прошлого прогона
+    python bench/load_bench.py --s3-endpoint http://127.0.0.1:9000   # свой S3 вместо moto
+
+После нагрузки каждая функция ещё --cold-runs раз запускается в свежем процессе
+(coldstart_bench.py): импорт index.py и первый запрос к той же схеме.
+'''
+import argparse
+import collections
+import importlib.util
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from coldstart_bench import measure as measure_cold_start
+from search_bench import ROOT, WORDS, migration_sql, timings
+
+PASSWORD = 'load-bench-password'
+SESSION_USERS = 500
+
+SEED_SQL = """
+INSERT INTO users (email, password_hash, name, avatar_url, role, is_verified)
+SELECT 'load' || g || '@example.com', %(password_hash)s, 'Канал ' || g,
+       'https://cdn.example/avatars/' || g || '.svg',
+       CASE WHEN g = 1 THEN 'admin' ELSE 'user' END, g %% 10 = 0
+FROM generate_series(1, %(users)s) g;
+
+SELECT setseed(0.42);
+
+INSERT INTO videos (user_id, title, description, video_url, thumbnail_url, duration, views_count,
+                    category, status, created_at, updated_at)
+SELECT 1 + (g * 7919) %% %(users)s,
+       initcap(w[1 + floor(random() * n)::int]) || ' ' || w[1 + floor(random() * n)::int] || ' '
+           || w[1 + floor(random() * n)::int],
+       w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int] || ' '
+           || w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int],
+       'https://cdn.example/videos/' || g || '.mp4',
+       'https://cdn.example/thumbnails/' || g || '.jpg',
+       60 + g %% 3600,
+       floor(random() * random() * 100000)::int,
+       'Категория ' || g %% 20,
+       CASE WHEN g %% 50 = 0 THEN 'hidden' ELSE 'published' END,
+       now() - make_interval(secs => g * 60),
+       now() - make_interval(secs => g * 60)
+FROM generate_series(1, %(videos)s) g,
+     (SELECT %(words)s::text[] AS w, cardinality(%(words)s::text[]) AS n) words;
+
+INSERT INTO video_likes (video_id, user_id, is_like)
+SELECT 1 + g %% %(videos)s, 1 + (g / %(videos)s) %% %(users)s, g %% 7 <> 0
+FROM generate_series(0, %(likes)s - 1) g
+ON CONFLICT DO NOTHING;
+
+UPDATE videos v
+SET likes_count = l.likes, dislikes_count = l.dislikes
+FROM (
+    SELECT video_id, COUNT(*) FILTER (WHERE is_like) AS likes, COUNT(*) FILTER (WHERE NOT is_like) AS dislikes
+    FROM video_likes GROUP BY video_id
+) l
+WHERE v.id = l.video_id;
+
+-- Группы по четыре комментария к одному видео: первый корневой, остальные — ответы на него
+INSERT INTO comments (video_id, user_id, parent_comment_id, text, created_at)
+SELECT 1 + ((g / 4) * 31) %% %(videos)s, 1 + g %% %(users)s,
+       CASE WHEN g %% 4 = 0 THEN NULL ELSE g - g %% 4 + 1 END,
+       'Комментарий ' || g, now() - make_interval(secs => %(comments)s - g)
+FROM generate_series(0, %(comments)s - 1) g;
+
+INSERT INTO subscriptions (subscriber_id, channel_id)
+SELECT 1 + g %% %(users)s, 1 + (g %% %(users)s + 1 + g / %(users)s) %% %(users)s
+FROM generate_series(0, %(subscriptions)s - 1) g
+ON CONFLICT DO NOTHING;
+
+UPDATE users u
+SET subscribers_count = s.total
+FROM (SELECT channel_id, COUNT(*) AS total FROM subscriptions GROUP BY channel_id) s
+WHERE u.id = s.channel_id;
+
+INSERT INTO reports (reporter_id, video_id, reason, status, created_at)
+SELECT 1 + g %% %(users)s, 1 + (g * 13) %% %(videos)s, 'spam',
+       CASE WHEN g %% 10 = 0 THEN 'pending' ELSE 'resolved' END, now() - make_interval(secs => g * 30)
+FROM generate_series(0, %(users)s - 1) g;
+
+INSERT INTO notifications (user_id, type, title, message, link, created_at)
+SELECT 1 + g %% %(users)s, 'comment', 'Новый комментарий', 'Комментарий ' || g,
+       '/video/' || (1 + g %% %(videos)s), now() - make_interval(secs => g)
+FROM generate_series(0, %(users)s * 5 - 1) g;
+
+ANALYZE;
+"""
+
+def load_function(name: str) -> Any:
+    '''
+    Импортирует index.py функции вместе с копией handler_core.py из её папки
+    '''
+    directory = os.path.join(ROOT, 'backend', name)
+    spec = importlib.util.spec_from_file_location(f'load_{name}', os.path.join(directory, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, directory)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+        sys.modules.pop('handler_core', None)
+    return module
+
+def setup_schema(dsn: str, schema: str) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trgm = cur.fetchone() is not None
+        if has_trgm:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public")
+        cur.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        cur.execute(f'CREATE SCHEMA {schema}')
+        cur.execute(f'SET search_path TO {schema}, public')
+        for script in migration_sql(has_trgm):
+            cur.execute(script)
+    conn.close()
+
+def seed(dsn: str, scale: Dict[str, int], password_hash: str) -> None:
+    started = time.perf_counter()
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(SEED_SQL, dict(scale, words=WORDS, password_hash=password_hash))
+    conn.close()
+    print(f"заполнено за {time.perf_counter() - started:.1f} с: " +
+          ', '.join(f'{key} {value}' for key, value in scale.items()), file=sys.stderr)
+
+def start_s3() -> Tuple[Optional[str], Any]:
+    '''
+    Поднимает moto на свободном порту
+    Returns: адрес S3 и сервер (None, None — если moto не установлен)
+    '''
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        print('moto не установлен: загрузки пропущены (или укажите --s3-endpoint)', file=sys.stderr)
+        return None, None
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    return f'http://127.0.0.1:{port}', server
+
+class Workload:
+    '''
+    Смесь запросов с весами, близкими к реальному трафику: чтение ленты и карточек
+    видео доминирует, запись — лайки, комментарии, подписки, пакеты событий
+    '''
+
+    def __init__(self, scale: Dict[str, int], tokens: List[str], admin_token: str, uploads: bool):
+        self.users = scale['users']
+        self.videos = scale['videos']
+        self.tokens = tokens
+        self.admin_token = admin_token
+        self.mix: List[Tuple[str, str, int, Callable[[random.Random], Dict[str, Any]]]] = [
+            ('feed', 'videos', 25, lambda rng: self.get({'limit': '20'})),
+            ('feed_category', 'videos', 5, lambda rng: self.get({'category': f'Категория {rng.randrange(20)}'})),
+            ('video', 'videos', 20, lambda rng: self.get({'id': str(self.video(rng))})),
+            ('trending', 'videos', 8, lambda rng: self.get({'sort': 'trending', 'limit': '20'})),
+            ('search', 'videos', 6, lambda rng: self.get({'action': 'search', 'q': rng.choice(WORDS)})),
+            ('subscriptions', 'videos', 4, lambda rng: self.get({'action': 'subscriptions'}, rng)),
+            ('comments', 'interactions', 10, lambda rng: self.get({'video_id': str(self.video(rng))})),
+            ('notifications', 'interactions', 4, lambda rng: self.get({'action': 'notifications'}, rng)),
+            ('unread_count', 'interactions', 4, lambda rng: self.get({'action': 'unread_count'}, rng)),
+            ('like_video', 'interactions', 8, lambda rng: self.post(rng, {
+                'action': 'like_video', 'video_id': self.video(rng), 'is_like': rng.random() < 0.9})),
+            ('comment', 'interactions', 3, lambda rng: self.post(rng, {
+                'action': 'comment', 'video_id': self.video(rng), 'text': 'Нагрузочный комментарий'})),
+            ('subscribe', 'interactions', 2, lambda rng: self.post(rng, {
+                'action': 'subscribe', 'channel_id': 1 + rng.randrange(self.users)})),
+            ('batch', 'interactions', 3, lambda rng: self.post(rng, {'action': 'batch', 'events': [
+                {'type': 'view', 'video_id': self.video(rng)} for _ in range(5)
+            ] + [{'type': 'watch', 'video_id': self.video(rng), 'position': rng.randrange(600)}]})),
+            ('login', 'auth', 1, lambda rng: self.post(rng, {
+                'action': 'login', 'email': f'load{1 + rng.randrange(self.users)}@example.com', 'password': PASSWORD})),
+            ('admin_stats', 'admin', 1, lambda rng: self.get({'action': 'stats'}, token=self.admin_token)),
+        ]
+        if uploads:
+            self.mix.append(('upload_init', 'videos', 1, lambda rng: self.post(rng, {
+                'action': 'upload_init', 'file_size': 50 * 1024 * 1024, 'content_type': 'video/mp4'})))
+        self.weights = [weight for _, _, weight, _ in self.mix]
+
+    def video(self, rng: random.Random) -> int:
+        # Популярные видео запрашивают чаще: перекос к свежим id
+        return 1 + min(int(rng.expovariate(1 / (self.videos / 20))), self.videos - 1)
+
+    def headers(self, rng: Optional[random.Random], token: Optional[str] = None) -> Dict[str, Any]:
+        if token is None and rng is not None:
+            token = rng.choice(self.tokens)
+        return {'X-Auth-Token': token} if token else {}
+
+    def get(self, params: Dict[str, str], rng: Optional[random.Random] = None, token: Optional[str] = None) -> Dict[str, Any]:
+        return {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': self.headers(rng, token),
+                'requestContext': {'identity': {'sourceIp': '127.0.0.1'}}}
+
+    def post(self, rng: random.Random, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {'httpMethod': 'POST', 'body': json.dumps(body), 'headers': self.headers(rng),
+                'requestContext': {'identity': {'sourceIp': f'10.0.{rng.randrange(256)}.{rng.randrange(256)}'}}}
+
+    def pick(self, rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+        name, function, _, make_event = rng.choices(self.mix, self.weights)[0]
+        return name, function, make_event(rng)
+
+def run_load(handlers: Dict[str, Any], workload: Workload, concurrency: int, duration: float,
+             warmup: float, seed: int) -> Tuple[Dict[str, List[float]], Dict[str, collections.Counter], float]:
+    samples: Dict[str, List[float]] = collections.defaultdict(list)
+    statuses: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        local_samples: Dict[str, List[float]] = collections.defaultdict(list)
+        local_statuses: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        while True:
+            name, function, event = workload.pick(rng)
+            started = time.perf_counter()
+            if started >= deadline:
+                break
+            try:
+                status = handlers[function](event, None)['statusCode']
+            except Exception:
+                status = 'exception'
+            if started >= measure_from:
+                local_samples[name].append((time.perf_counter() - started) * 1000)
+                local_statuses[name][str(status)] += 1
+        with lock:
+            for name, values in local_samples.items():
+                samples[name].extend(values)
+                statuses[name].update(local_statuses[name])
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(seed * 1000, seed * 1000 + concurrency)))
+    return samples, statuses, duration
+
+def summarize(samples: Dict[str, List[float]], statuses: Dict[str, collections.Counter], duration: float) -> Dict[str, Any]:
+    actions = {}
+    for name in sorted(samples):
+        actions[name] = {
+            'requests': len(samples[name]),
+            'qps': round(len(samples[name]) / duration, 1),
+            **timings(samples[name]),
+            'statuses': dict(statuses[name]),
+        }
+    everything = [value for values in samples.values() for value in values]
+    total = {'requests': len(everything), 'qps': round(len(everything) / duration, 1), **timings(everything)}
+    return {'total': total, 'actions': actions}
+
+def print_table(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    print(f"{'action':<16}{'requests':>10}{'qps':>9}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}"
+          f"{'p95 vs base':>13}{'qps vs base':>13}  statuses")
+    rows = list(result['actions'].items()) + [('TOTAL', result['total'])]
+    for name, row in rows:
+        before = (baseline or {}).get('actions', {}).get(name) if name != 'TOTAL' else (baseline or {}).get('total')
+        p95_ratio = f"{row['p95_ms'] / before['p95_ms']:.2f}x" if before and before['p95_ms'] else '-'
+        qps_ratio = f"{row['qps'] / before['qps']:.2f}x" if before and before['qps'] else '-'
+        codes = ', '.join(f'{code}:{count}' for code, count in sorted(row.get('statuses', {}).items()))
+        print(f"{name:<16}{row['requests']:>10}{row['qps']:>9}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+              f"{row['p99_ms']:>10}{p95_ratio:>13}{qps_ratio:>13}  {codes}")
+
+def print_cold_start(rows: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    before = {row['function']: row for row in (baseline or {}).get('cold_start', [])}
+    print(f"\n{'cold start':<16}{'import, ms':>12}{'1st call, ms':>14}{'import vs base':>16}  top imports")
+    for row in rows:
+        previous = before.get(row['function'])
+        ratio = f"{row['import_ms'] / previous['import_ms']:.2f}x" if previous and previous['import_ms'] else '-'
+        imports = ', '.join(f"{entry['module']} {entry['cumulative_ms']}" for entry in row['top_imports'])
+        print(f"{row['function']:<16}{row['import_ms']:>12}{row['first_call_ms']:>14}{ratio:>16}  {imports}")
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--videos', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=100000)
+    parser.add_argument('--comments', type=int, default=40000)
+    parser.add_argument('--subscriptions', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='секунд измерения')
+    parser.add_argument('--warmup', type=float, default=3, help='секунд прогрева, не попадают в результат')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--schema', default='bench_load')
+    parser.add_argument('--cold-runs', type=int, default=3, help='замеров холодного старта на функцию, 0 — пропустить')
+    parser.add_argument('--s3-endpoint', help='адрес S3-совместимого хранилища вместо moto')
+    parser.add_argument('--keep', action='store_true', help='оставить схему с данными после прогона')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    parser.add_argument('--output', help='сохранить результаты в JSON-файл')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 1
+    scale = {key: getattr(args, key) for key in ('users', 'videos', 'likes', 'comments', 'subscriptions')}
+    base_dsn = os.environ['DATABASE_URL']
+    dsn = make_dsn(base_dsn, options=f'-c search_path={args.schema},public')
+    setup_schema(base_dsn, args.schema)
+
+    s3_endpoint, s3_server = (args.s3_endpoint, None) if args.s3_endpoint else start_s3()
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('SESSION_SECRET', 'bench')
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+    os.environ['RATE_LIMIT_SCALE'] = '0'
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['METRICS_FLUSH_INTERVAL'] = '0'
+    os.environ.pop('CACHE_URL', None)
+    if s3_endpoint:
+        os.environ['S3_ENDPOINT_URL'] = s3_endpoint
+
+    modules = {name: load_function(name) for name in ('videos', 'interactions', 'auth', 'admin')}
+    if s3_endpoint:
+        modules['videos'].s3.create_bucket(Bucket=modules['videos'].S3_BUCKET)
+
+    auth = modules['auth']
+    results: Dict[str, Any] = {}
+    try:
+        seed(dsn, scale, auth.hash_password(PASSWORD))
+        admin_token = auth.issue_token({'id': 1, 'role': 'admin'})
+        modules['admin'].handler({'httpMethod': 'POST', 'headers': {'X-Auth-Token': admin_token},
+                                  'body': json.dumps({'action': 'recompute_scores', 'max_batches': 10000})}, None)
+        tokens = [auth.issue_token({'id': user_id, 'role': 'user'})
+                  for user_id in range(2, min(args.users, SESSION_USERS) + 1)]
+
+        workload = Workload(scale, tokens, admin_token, uploads=s3_endpoint is not None)
+        handlers = {name: module.handler for name, module in modules.items()}
+        samples, statuses, duration = run_load(handlers, workload, args.concurrency, args.duration, args.warmup, args.seed)
+        results = {
+            'config': {**scale, 'concurrency': args.concurrency, 'duration': args.duration, 'seed': args.seed},
+            **summarize(samples, statuses, duration),
+            'cold_start': [measure_cold_start(name, runs=args.cold_runs) for name in modules] if args.cold_runs else [],
+        }
+    finally:
+        if s3_server is not None:
+            s3_server.stop()
+        if not args.keep:
+            conn = psycopg2.connect(base_dsn)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+            conn.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return None
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if results['cold_start']:
+        print_cold_start(results['cold_start'], baseline)
+    return None
+
+if __name__ == '__main__':
+    sys.exit(main())
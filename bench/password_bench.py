@@ -0,0 +1,78 @@
+'''
+Бенчмарк входа (action=login) при разной стоимости scrypt
+
+База подменяется заглушкой из handlers_bench, поэтому время вызова handler() —
+это почти целиком проверка пароля. Для каждого N печатает p50/p99 входа, память
+на один хеш и сколько ядер займёт заданный поток входов (--qps), чтобы подобрать
+PASSWORD_SCRYPT_N под нагрузку.
+
+Запуск:
+    python bench/password_bench.py                            # N = 2^12 … 2^16
+    python bench/password_bench.py --cost 14 --cost 15 --iterations 200 --qps 30
+    python bench/password_bench.py --json
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import handlers_bench
+
+PASSWORD = 'correct horse battery staple'
+LOGIN_EVENT = {'httpMethod': 'POST', 'body': json.dumps({'action': 'login', 'email': 'user@example.com', 'password': PASSWORD})}
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run_cost(module: Any, log2_n: int, iterations: int, qps: float) -> Dict[str, Any]:
+    module.PASSWORD_SCRYPT_N = 2 ** log2_n
+    row = dict(handlers_bench.USER_ROWS[0], password_hash=module.hash_password(PASSWORD))
+    handlers_bench.fake_rows = [row]
+
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = module.handler(LOGIN_EVENT, None)
+        samples.append((time.perf_counter() - started) * 1000)
+    if response['statusCode'] != 200:
+        raise RuntimeError(f'login failed: {response["body"]}')
+
+    p50 = statistics.median(samples)
+    return {
+        'n': module.PASSWORD_SCRYPT_N,
+        'r': module.PASSWORD_SCRYPT_R,
+        'p': module.PASSWORD_SCRYPT_P,
+        'memory_mb': round(128 * module.PASSWORD_SCRYPT_N * module.PASSWORD_SCRYPT_R / 2 ** 20, 1),
+        'p50_ms': round(p50, 2),
+        'p99_ms': round(percentile(samples, 99), 2),
+        'cores_at_qps': round(qps * p50 / 1000, 2),
+    }
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cost', type=int, action='append', help='log2(N), можно несколько раз')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--qps', type=float, default=20, help='ожидаемый поток входов в секунду')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args()
+
+    module = handlers_bench.load_function('auth', None)
+    results = [run_cost(module, log2_n, args.iterations, args.qps) for log2_n in args.cost or range(12, 17)]
+
+    if args.json:
+        print(json.dumps({'iterations': args.iterations, 'qps': args.qps, 'costs': results}, indent=2))
+        return None
+
+    print(f"{'N':>8}{'memory, MB':>12}{'p50, ms':>10}{'p99, ms':>10}{f'cores @ {args.qps:g} qps':>20}")
+    for row in results:
+        print(f"{row['n']:>8}{row['memory_mb']:>12}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['cores_at_qps']:>20}")
+    return None
+
+if __name__ == '__main__':
+    sys.exit(main())
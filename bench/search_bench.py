@@ -0,0 +1,240 @@
+'''
+Бенчмарк поиска видео (action=search) на синтетическом корпусе
+
+Создаёт отдельную схему, накатывает в неё миграции из db_migrations, заливает
+N синтетических видео и меряет задержку handler() для типичных запросов. Для
+сравнения меряет тот же поиск через ILIKE без индекса и печатает, какие индексы
+использует план каждого запроса.
+
+Запуск (нужен PostgreSQL в DATABASE_URL):
+    python bench/search_bench.py                      # 1 000 000 видео
+    python bench/search_bench.py --rows 200000 --iterations 100 --json
+    python bench/search_bench.py --keep               # не удалять схему после прогона
+'''
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from psycopg2.extras import RealDictCursor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = [
+    'гитара', 'урок', 'обзор', 'музыка', 'игра', 'прохождение', 'рецепт', 'торт', 'футбол', 'матч',
+    'новости', 'путешествие', 'горы', 'море', 'кошка', 'собака', 'ремонт', 'квартира', 'машина', 'двигатель',
+    'программирование', 'python', 'javascript', 'react', 'база', 'данных', 'интервью', 'подкаст', 'концерт', 'клип',
+    'тренировка', 'бег', 'йога', 'утро', 'вечер', 'стрим', 'лучшие', 'моменты', 'смешные', 'животные',
+    'история', 'наука', 'космос', 'ракета', 'фильм', 'трейлер', 'сериал', 'аниме', 'рисование', 'фотография',
+]
+
+CASES = [
+    ('common_word', 'гитара'),
+    ('two_words', 'урок гитары'),
+    ('phrase', '"обзор машины"'),
+    ('rare_word', 'редкость'),
+    ('typo', 'гитпра'),
+]
+
+SEED_SQL = """
+INSERT INTO users (email, password_hash, name, is_verified)
+SELECT 'bench' || g || '@example.com', 'x', 'Канал ' || g, g %% 10 = 0
+FROM generate_series(1, 1000) g;
+
+SELECT setseed(0.42);
+
+INSERT INTO videos (user_id, title, description, video_url, duration, category, status, created_at)
+SELECT (SELECT min(id) FROM users) + (g %% 1000),
+       initcap(w[1 + floor(random() * n)::int]) || ' ' || w[1 + floor(random() * n)::int] || ' '
+           || w[1 + floor(random() * n)::int] || CASE WHEN g %% 10000 = 1 THEN ' редкость' ELSE '' END,
+       w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int] || ' '
+           || w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int],
+       'https://cdn.example/' || g || '.mp4',
+       60 + g %% 3600,
+       'Категория ' || g %% 20,
+       CASE WHEN g %% 50 = 0 THEN 'hidden' ELSE 'published' END,
+       now() - make_interval(secs => g)
+FROM generate_series(1, %(rows)s) g,
+     (SELECT %(words)s::text[] AS w, cardinality(%(words)s::text[]) AS n) words;
+
+ANALYZE users;
+ANALYZE videos;
+"""
+
+ILIKE_SQL = """
+SELECT v.id, v.title
+FROM videos v
+WHERE v.status = 'published' AND (v.title ILIKE %(pattern)s OR v.description ILIKE %(pattern)s)
+ORDER BY v.created_at DESC
+LIMIT 20
+"""
+
+executed: List[Any] = []
+
+class RecordingCursor(RealDictCursor):
+    def execute(self, query: Any, vars: Any = None) -> None:
+        executed.append((query, vars))
+        return super().execute(query, vars)
+
+def migration_sql(has_trgm: bool) -> List[str]:
+    scripts = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'db_migrations', 'V*.sql'))):
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        if not has_trgm:
+            lines = [line for line in lines if 'pg_trgm' not in line and 'gin_trgm_ops' not in line]
+        scripts.append('\n'.join(lines))
+    return scripts
+
+def setup_schema(dsn: str, schema: str, rows: int) -> bool:
+    '''
+    Создаёт схему с миграциями и синтетическими данными
+    Returns: доступен ли pg_trgm
+    '''
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trgm = cur.fetchone() is not None
+        if has_trgm:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public")
+        else:
+            print('pg_trgm недоступен: триграммный поиск пропущен', file=sys.stderr)
+
+        cur.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        cur.execute(f'CREATE SCHEMA {schema}')
+        cur.execute(f'SET search_path TO {schema}, public')
+        for script in migration_sql(has_trgm):
+            cur.execute(script)
+
+        started = time.perf_counter()
+        cur.execute(SEED_SQL, {'rows': rows, 'words': WORDS})
+        print(f'заполнено {rows} видео за {time.perf_counter() - started:.1f} с', file=sys.stderr)
+    conn.close()
+    return has_trgm
+
+def load_videos_function() -> Any:
+    directory = os.path.join(ROOT, 'backend', 'videos')
+    spec = importlib.util.spec_from_file_location('bench_videos_search', os.path.join(directory, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, directory)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+        sys.modules.pop('handler_core', None)
+    module.TimedCursor = RecordingCursor
+    return module
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def timings(samples: List[float]) -> Dict[str, float]:
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+    }
+
+def plan_indexes(cur: Any, query: Any, params: Any) -> List[str]:
+    cur.execute(b'EXPLAIN (FORMAT JSON) ' + cur.mogrify(query, params))
+    found: List[str] = []
+
+    def walk(node: Dict[str, Any]) -> None:
+        if node.get('Index Name') and node['Index Name'] not in found:
+            found.append(node['Index Name'])
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(cur.fetchone()[0][0]['Plan'])
+    return found
+
+def run_case(module: Any, raw: Any, query: str, iterations: int, baseline_iterations: int) -> Dict[str, Any]:
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'action': 'search', 'q': query, 'limit': '20'}}
+    samples = []
+    for _ in range(iterations):
+        executed.clear()
+        started = time.perf_counter()
+        response = module.handler(event, None)
+        samples.append((time.perf_counter() - started) * 1000)
+    body = json.loads(response['body'])
+
+    with raw.cursor() as cur:
+        indexes = plan_indexes(cur, *executed[-1])
+        baseline = []
+        pattern = '%' + query.strip('"').split()[0] + '%'
+        for _ in range(baseline_iterations):
+            started = time.perf_counter()
+            cur.execute(ILIKE_SQL, {'pattern': pattern})
+            cur.fetchall()
+            baseline.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'query': query,
+        'results': len(body['videos']),
+        'has_next_page': body['next_cursor'] is not None,
+        'queries': len(executed),
+        'indexes': indexes,
+        'search': timings(samples),
+        'ilike_scan': timings(baseline),
+    }
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--baseline-iterations', type=int, default=5)
+    parser.add_argument('--schema', default='bench_search')
+    parser.add_argument('--keep', action='store_true', help='оставить схему с данными после прогона')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        print('DATABASE_URL is required', file=sys.stderr)
+        return 1
+    dsn = make_dsn(os.environ['DATABASE_URL'], options=f'-c search_path={args.schema},public')
+    has_trgm = setup_schema(os.environ['DATABASE_URL'], args.schema, args.rows)
+
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ['RESPONSE_CACHE_TTL'] = '0'
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['METRICS_FLUSH_INTERVAL'] = '0'
+    os.environ.pop('CACHE_URL', None)
+    module = load_videos_function()
+
+    raw = psycopg2.connect(dsn)
+    raw.autocommit = True
+    results = {}
+    try:
+        for name, query in CASES:
+            if name == 'typo' and not has_trgm:
+                continue
+            results[name] = run_case(module, raw, query, args.iterations, args.baseline_iterations)
+    finally:
+        if not args.keep:
+            with raw.cursor() as cur:
+                cur.execute(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+        raw.close()
+
+    if args.json:
+        print(json.dumps({'rows': args.rows, 'iterations': args.iterations, 'cases': results}, indent=2, ensure_ascii=False))
+        return None
+
+    print(f"{'case':<14}{'hits':>6}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}{'ilike p50':>12}  indexes")
+    for name, row in results.items():
+        print(f"{name:<14}{row['results']:>6}{row['search']['p50_ms']:>10}{row['search']['p95_ms']:>10}"
+              f"{row['search']['p99_ms']:>10}{row['ilike_scan']['p50_ms']:>12}  {', '.join(row['indexes']) or '-'}")
+    return None
+
+if __name__ == '__main__':
+    sys.exit(main())
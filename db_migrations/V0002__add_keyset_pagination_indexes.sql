@@ -0,0 +1,4 @@
+-- Индексы для keyset-пагинации ленты, страниц каналов и комментариев
+CREATE INDEX IF NOT EXISTS idx_videos_published_created ON videos(created_at DESC, id DESC) WHERE status = 'published';
+CREATE INDEX IF NOT EXISTS idx_videos_channel_published_created ON videos(user_id, created_at DESC, id DESC) WHERE status = 'published';
+CREATE INDEX IF NOT EXISTS idx_comments_video_top_created ON comments(video_id, created_at DESC, id DESC) WHERE parent_comment_id IS NULL;
@@ -0,0 +1,24 @@
+-- Очередь рассылки уведомлений о новых видео (outbox)
+CREATE TABLE IF NOT EXISTS notification_jobs (
+    id SERIAL PRIMARY KEY,
+    channel_id INTEGER NOT NULL REFERENCES users(id),
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    title VARCHAR(255) NOT NULL,
+    message TEXT,
+    link TEXT,
+    delivery VARCHAR(20) DEFAULT 'push',
+    status VARCHAR(20) DEFAULT 'pending',
+    last_subscriber_id INTEGER DEFAULT 0,
+    delivered_count INTEGER DEFAULT 0,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- delivery = 'push' - уведомления пишутся воркером пачками по подписчикам,
+-- delivery = 'on_read' - для крупных каналов строки не размножаются, входящие собираются при чтении
+CREATE INDEX IF NOT EXISTS idx_notification_jobs_pending ON notification_jobs(run_after, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_notification_jobs_on_read ON notification_jobs(channel_id, created_at DESC) WHERE delivery = 'on_read';
+CREATE INDEX IF NOT EXISTS idx_subscriptions_channel_subscriber ON subscriptions(channel_id, subscriber_id);
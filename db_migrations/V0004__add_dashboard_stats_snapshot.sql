@@ -0,0 +1,9 @@
+-- Снимок счётчиков админ-панели (одна строка, обновляется при устаревании)
+CREATE TABLE IF NOT EXISTS dashboard_stats (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    total_users INTEGER NOT NULL DEFAULT 0,
+    total_videos INTEGER NOT NULL DEFAULT 0,
+    total_comments INTEGER NOT NULL DEFAULT 0,
+    pending_reports INTEGER NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,2 @@
+-- Индекс для выборки ответов на комментарий в порядке публикации
+CREATE INDEX IF NOT EXISTS idx_comments_parent_created ON comments(parent_comment_id, created_at, id) WHERE parent_comment_id IS NOT NULL;
@@ -0,0 +1,13 @@
+-- Полнотекстовый поиск по названию и описанию видео
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+) STORED;
+
+-- GIN-индексы только по опубликованным видео: поиск не показывает остальные
+CREATE INDEX IF NOT EXISTS idx_videos_search_vector ON videos USING GIN(search_vector) WHERE status = 'published';
+
+-- Триграммный индекс по названию для запросов с опечатками
+CREATE INDEX IF NOT EXISTS idx_videos_title_trgm ON videos USING GIN(title gin_trgm_ops) WHERE status = 'published';
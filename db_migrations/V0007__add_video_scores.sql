@@ -0,0 +1,29 @@
+-- Предрасчитанные оценки для лент «в тренде» и «популярное»
+CREATE TABLE IF NOT EXISTS video_scores (
+    video_id INTEGER PRIMARY KEY REFERENCES videos(id),
+    category VARCHAR(100),
+    is_published BOOLEAN NOT NULL DEFAULT TRUE,
+    trending_score DOUBLE PRECISION NOT NULL DEFAULT 0,
+    popular_score DOUBLE PRECISION NOT NULL DEFAULT 0,
+    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индексы покрывают выборку ленты целиком (index-only scan), в том числе по категории
+CREATE INDEX IF NOT EXISTS idx_video_scores_trending ON video_scores(trending_score DESC, video_id DESC) WHERE is_published;
+CREATE INDEX IF NOT EXISTS idx_video_scores_popular ON video_scores(popular_score DESC, video_id DESC) WHERE is_published;
+CREATE INDEX IF NOT EXISTS idx_video_scores_category_trending ON video_scores(category, trending_score DESC, video_id DESC) WHERE is_published;
+CREATE INDEX IF NOT EXISTS idx_video_scores_category_popular ON video_scores(category, popular_score DESC, video_id DESC) WHERE is_published;
+
+-- Контрольные точки фоновых задач
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+    name VARCHAR(100) PRIMARY KEY,
+    last_updated_at TIMESTAMP NOT NULL DEFAULT '1970-01-01',
+    last_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Пересчёт идёт по видео, изменённым после прошлого запуска
+CREATE INDEX IF NOT EXISTS idx_videos_updated ON videos(updated_at, id);
+
+-- Индекс по views_count не использовался ни одним запросом, но обновлялся при каждом сбросе просмотров
+DROP INDEX IF EXISTS idx_videos_views;
@@ -0,0 +1,8 @@
+-- В истории просмотров храним одну запись на пару (пользователь, видео) с последней позицией
+DELETE FROM watch_history w
+USING watch_history newer
+WHERE w.user_id = newer.user_id
+  AND w.video_id = newer.video_id
+  AND (w.updated_at, w.id) < (newer.updated_at, newer.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_watch_history_user_video ON watch_history(user_id, video_id);
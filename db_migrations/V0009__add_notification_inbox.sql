@@ -0,0 +1,18 @@
+-- Счётчик непрочитанных уведомлений на пользователя, обновляется в тех же транзакциях, что и notifications
+-- read_through - отметка прочтения рассылок крупных каналов (delivery = 'on_read'), которые не размножаются по подписчикам
+CREATE TABLE IF NOT EXISTS notification_counters (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    read_through TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO notification_counters (user_id, unread_count)
+SELECT user_id, COUNT(*) FROM notifications WHERE NOT is_read GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET unread_count = EXCLUDED.unread_count;
+
+-- Постраничный вывод входящих и отметка прочтения до курсора
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications(user_id, created_at DESC, id DESC);
+
+-- Очистка старых прочитанных уведомлений пачками
+CREATE INDEX IF NOT EXISTS idx_notifications_read_created ON notifications(created_at, id) WHERE is_read;
@@ -0,0 +1,12 @@
+-- Обработка загруженных видео вне запроса: длительность и превью считает воркер process_media
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS storage_key TEXT;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS thumbnails JSONB;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS processing_attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS processing_started_at TIMESTAMP;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS processing_error TEXT;
+
+-- Уже загруженные видео считаем обработанными, новые попадают в очередь
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS processing_status VARCHAR(20) NOT NULL DEFAULT 'done';
+ALTER TABLE videos ALTER COLUMN processing_status SET DEFAULT 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_videos_processing_queue ON videos(id) WHERE processing_status IN ('pending', 'processing');
@@ -0,0 +1,13 @@
+-- Отзыв подписанных сессионных токенов: по id токена (выход) или всех токенов пользователя,
+-- выданных раньше issued_before (unix-время, например после смены роли)
+CREATE TABLE IF NOT EXISTS revoked_sessions (
+    id SERIAL PRIMARY KEY,
+    jti VARCHAR(64),
+    user_id INTEGER REFERENCES users(id),
+    issued_before BIGINT,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Обработчики держат в памяти только действующие записи
+CREATE INDEX IF NOT EXISTS idx_revoked_sessions_expires ON revoked_sessions(expires_at);
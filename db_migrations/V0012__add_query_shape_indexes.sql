@@ -0,0 +1,6 @@
+-- Очередь жалоб в админке: WHERE status = 'pending' ORDER BY created_at DESC LIMIT 50,
+-- тот же индекс отвечает на COUNT(*) для pending_reports в статистике
+CREATE INDEX IF NOT EXISTS idx_reports_pending_created ON reports(created_at DESC, id DESC) WHERE status = 'pending';
+
+-- Лента по категории: WHERE status = 'published' AND category = %s ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_videos_published_category_created ON videos(category, created_at DESC, id DESC) WHERE status = 'published';
@@ -0,0 +1,64 @@
+-- Уведомления только дописываются и чистятся по возрасту: помесячные секции по created_at.
+-- Первичный ключ секционированной таблицы обязан включать ключ секционирования
+ALTER TABLE notifications RENAME TO notifications_unpartitioned;
+ALTER TABLE notifications_unpartitioned RENAME CONSTRAINT notifications_pkey TO notifications_unpartitioned_pkey;
+ALTER TABLE notifications_unpartitioned RENAME CONSTRAINT notifications_user_id_fkey TO notifications_unpartitioned_user_id_fkey;
+DROP INDEX IF EXISTS idx_notifications_user;
+DROP INDEX IF EXISTS idx_notifications_user_created;
+DROP INDEX IF EXISTS idx_notifications_read_created;
+
+CREATE TABLE notifications (
+    id INTEGER NOT NULL DEFAULT nextval('notifications_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    type VARCHAR(50) NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    message TEXT,
+    link TEXT,
+    is_read BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE notifications_id_seq OWNED BY notifications.id;
+
+-- Строки вне созданных секций (если обслуживание не успело создать следующий месяц)
+CREATE TABLE IF NOT EXISTS notifications_default PARTITION OF notifications DEFAULT;
+
+-- Создаёт секции с месяца from_month по текущий месяц + months_ahead; вызывается из compact_notifications
+CREATE OR REPLACE FUNCTION create_notification_partitions(months_ahead INTEGER, from_month DATE DEFAULT CURRENT_DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'notifications_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF notifications FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_notification_partitions(3, COALESCE((SELECT MIN(created_at) FROM notifications_unpartitioned)::date, CURRENT_DATE));
+
+INSERT INTO notifications (id, user_id, type, title, message, link, is_read, created_at)
+SELECT id, user_id, type, title, message, link, is_read, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM notifications_unpartitioned;
+
+DROP TABLE notifications_unpartitioned;
+
+-- Постраничный вывод входящих и отметка прочтения до курсора (в каждой секции)
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications(user_id, created_at DESC, id DESC);
+
+-- Очистка старых прочитанных уведомлений пачками; (user_id, is_read) больше не нужен —
+-- непрочитанные считает notification_counters
+CREATE INDEX IF NOT EXISTS idx_notifications_read_created ON notifications(created_at, id) WHERE is_read;
@@ -0,0 +1,43 @@
+-- История просмотров секционируется по хешу user_id, а не по времени: upsert идёт
+-- по ON CONFLICT (user_id, video_id), а уникальный индекс секционированной таблицы обязан
+-- содержать ключ секционирования. С секциями по created_at пара (пользователь, видео)
+-- могла бы повториться в разных месяцах и upsert перестал бы находить старую запись.
+-- Все запросы к истории идут по одному пользователю и попадают в одну секцию
+ALTER TABLE watch_history RENAME TO watch_history_unpartitioned;
+ALTER TABLE watch_history_unpartitioned RENAME CONSTRAINT watch_history_pkey TO watch_history_unpartitioned_pkey;
+ALTER TABLE watch_history_unpartitioned RENAME CONSTRAINT watch_history_user_id_fkey TO watch_history_unpartitioned_user_id_fkey;
+ALTER TABLE watch_history_unpartitioned RENAME CONSTRAINT watch_history_video_id_fkey TO watch_history_unpartitioned_video_id_fkey;
+DROP INDEX IF EXISTS idx_watch_history_user;
+DROP INDEX IF EXISTS idx_watch_history_user_video;
+
+CREATE TABLE watch_history (
+    id INTEGER NOT NULL DEFAULT nextval('watch_history_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    watch_position INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, id)
+) PARTITION BY HASH (user_id);
+
+ALTER SEQUENCE watch_history_id_seq OWNED BY watch_history.id;
+
+DO $$
+BEGIN
+    FOR remainder IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF watch_history FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            'watch_history_p' || lpad(remainder::text, 2, '0'), remainder
+        );
+    END LOOP;
+END;
+$$;
+
+INSERT INTO watch_history (id, user_id, video_id, watch_position, created_at, updated_at)
+SELECT id, user_id, video_id, watch_position, created_at, updated_at
+FROM watch_history_unpartitioned;
+
+DROP TABLE watch_history_unpartitioned;
+
+-- Ключ upsert из interactions: одна запись на пару (пользователь, видео)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_watch_history_user_video ON watch_history(user_id, video_id);
@@ -0,0 +1,10 @@
+-- Ветка комментариев одноуровневая: ответы на ответы, сохранённые раньше,
+-- переносятся к корневому комментарию, иначе их не видно в list_comments
+WITH RECURSIVE chain AS (
+    SELECT id, id AS root_id FROM comments WHERE parent_comment_id IS NULL
+    UNION ALL
+    SELECT c.id, chain.root_id FROM comments c JOIN chain ON c.parent_comment_id = chain.id
+)
+UPDATE comments c SET parent_comment_id = chain.root_id
+FROM chain
+WHERE c.id = chain.id AND c.parent_comment_id IS NOT NULL AND c.parent_comment_id <> chain.root_id;
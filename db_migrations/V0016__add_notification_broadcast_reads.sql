@@ -0,0 +1,8 @@
+-- Прочтение отдельных рассылок крупных каналов (delivery = 'on_read'): строк в notifications у них нет,
+-- а notification_counters.read_through отмечает только всё до момента времени
+CREATE TABLE IF NOT EXISTS notification_broadcast_reads (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    job_id INTEGER NOT NULL REFERENCES notification_jobs(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, job_id)
+);
@@ -0,0 +1,704 @@
+'''
+Общее ядро функций backend: пул соединений, метрики, JSON-ответы, сессии,
+ограничение частоты запросов, кэш ответов и карточек каналов
+
+Функция разворачивается только из своей папки, поэтому backend/<функция>/handler_core.py —
+побайтовые копии этого файла. Правится только shared/handler_core.py, затем
+python shared/sync.py; python shared/sync.py --check проверяет, что копии совпадают
+'''
+import atexit
+import base64
+import bisect
+import functools
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import threading
+import time
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional, Set, Tuple, FrozenSet
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '1800'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+_pool_idle: List[Dict[str, Any]] = []
+_pool_in_use: Dict[int, Dict[str, Any]] = {}
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+
+DB_POOL_STATS: Dict[str, float] = {
+    'created': 0,
+    'reused': 0,
+    'recycled': 0,
+    'acquire_count': 0,
+    'acquire_ms_total': 0.0,
+    'acquire_ms_max': 0.0,
+    'last_acquire_ms': 0.0,
+    'release_ms_total': 0.0,
+    'release_ms_max': 0.0,
+    'last_release_ms': 0.0,
+}
+
+def _record_pool_timing(kind: str, started: float) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    DB_POOL_STATS[f'{kind}_ms_total'] += elapsed_ms
+    DB_POOL_STATS[f'last_{kind}_ms'] = elapsed_ms
+    if elapsed_ms > DB_POOL_STATS[f'{kind}_ms_max']:
+        DB_POOL_STATS[f'{kind}_ms_max'] = elapsed_ms
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _pooled_conn_is_healthy(entry: Dict[str, Any]) -> bool:
+    conn = entry['conn']
+    now = time.monotonic()
+    if conn.closed or now - entry['created_at'] > DB_POOL_MAX_AGE:
+        return False
+    if now - entry['released_at'] < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as ping:
+            ping.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def get_conn() -> Any:
+    '''
+    Выдаёт соединение из пула процесса, переживающего тёплые вызовы
+    Returns: проверенное соединение psycopg2, вернуть через put_conn
+    '''
+    started = time.perf_counter()
+    if not _pool_slots.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT):
+        raise psycopg2.OperationalError('Database pool exhausted')
+    try:
+        entry = None
+        while entry is None:
+            with _pool_lock:
+                candidate = _pool_idle.pop() if _pool_idle else None
+            if candidate is None:
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                entry = {'conn': conn, 'created_at': time.monotonic(), 'released_at': time.monotonic()}
+                DB_POOL_STATS['created'] += 1
+            elif _pooled_conn_is_healthy(candidate):
+                entry = candidate
+                DB_POOL_STATS['reused'] += 1
+            else:
+                _close_quietly(candidate['conn'])
+                DB_POOL_STATS['recycled'] += 1
+    except Exception:
+        _pool_slots.release()
+        raise
+    
+    with _pool_lock:
+        _pool_in_use[id(entry['conn'])] = entry
+    DB_POOL_STATS['acquire_count'] += 1
+    _record_pool_timing('acquire', started)
+    track('pool', started)
+    return entry['conn']
+
+def put_conn(conn: Any) -> None:
+    '''
+    Возвращает соединение в пул, откатывая незавершённую транзакцию
+    Args: conn - соединение, полученное через get_conn
+    '''
+    started = time.perf_counter()
+    with _pool_lock:
+        entry = _pool_in_use.pop(id(conn), None)
+    try:
+        reusable = entry is not None and not conn.closed
+        if reusable and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+        if reusable:
+            entry['released_at'] = time.monotonic()
+            with _pool_lock:
+                _pool_idle.append(entry)
+        else:
+            _close_quietly(conn)
+            DB_POOL_STATS['recycled'] += 1
+    finally:
+        if entry is not None:
+            _pool_slots.release()
+        _record_pool_timing('release', started)
+
+def reset_pool_after_fork() -> List[Dict[str, Any]]:
+    '''
+    Начинает пул заново в процессе, порождённом fork
+    Returns: записи пула родителя — их соединения нельзя ни использовать, ни закрывать
+    '''
+    global _pool_idle, _pool_in_use, _pool_lock, _pool_slots
+    inherited = _pool_idle + list(_pool_in_use.values())
+    _pool_idle, _pool_in_use = [], {}
+    _pool_lock = threading.Lock()
+    _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+    return inherited
+
+# Бюджет накладных расходов инструментирования — до 10 мкс CPU на вызов при настройках
+# по умолчанию (обёртка ~4 мкс плюс ~1 мкс на каждый запрос к БД и JSON), см. bench/handlers_bench.py
+# Доля запросов, по которым пишется строка лога с разбивкой времени; гистограммы считаются всегда
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '0.01'))
+# Раз в сколько секунд гистограммы задержек сбрасываются в лог; 0 — не сбрасывать
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '60'))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Имя функции в логах — папка, в которой лежит копия ядра
+METRICS_FUNCTION = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+_request = threading.local()
+_histograms: Dict[str, Dict[str, Any]] = {}
+_histograms_lock = threading.Lock()
+_metrics_flushed_at = time.monotonic()
+
+def log_event(event: str, **fields: Any) -> None:
+    print(json.dumps({'event': event, 'function': METRICS_FUNCTION, **fields}, ensure_ascii=False, default=str))
+
+def track(kind: str, started: float) -> float:
+    '''
+    Добавляет время операции (db, pool, json, s3 и т.п.) к метрикам текущего запроса
+    Returns: длительность в мс
+    '''
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    metrics = getattr(_request, 'metrics', None)
+    if metrics is not None:
+        metrics[f'{kind}_ms'] = metrics.get(f'{kind}_ms', 0.0) + elapsed_ms
+        metrics[f'{kind}_calls'] = metrics.get(f'{kind}_calls', 0) + 1
+    return elapsed_ms
+
+def set_action(name: str) -> None:
+    metrics = getattr(_request, 'metrics', None)
+    if metrics is not None:
+        metrics['action'] = name
+
+def params_fingerprint(params: Any) -> Dict[str, Any]:
+    '''
+    Типы параметров и короткий хеш значений: повторы одного запроса видны,
+    а сами значения (email, текст, токены) в лог не попадают
+    '''
+    if isinstance(params, dict):
+        shape: Any = {key: type(value).__name__ for key, value in params.items()}
+    elif isinstance(params, (list, tuple)):
+        shape = [type(value).__name__ for value in params]
+    else:
+        shape = type(params).__name__
+    return {'shape': shape, 'hash': hashlib.sha256(repr(params).encode()).hexdigest()[:12]}
+
+class TimedCursor(RealDictCursor):
+    '''
+    RealDictCursor, который учитывает время каждого запроса и пишет медленные в лог
+    '''
+    
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed_ms = track('db', started)
+            if elapsed_ms >= SLOW_QUERY_MS:
+                text = query.decode() if isinstance(query, bytes) else str(query)
+                log_event('slow_query', action=(getattr(_request, 'metrics', None) or {}).get('action'),
+                          ms=round(elapsed_ms, 1), query=' '.join(text.split())[:1000], params=params_fingerprint(vars))
+
+def flush_metrics() -> None:
+    '''
+    Пишет накопленные гистограммы задержек по действиям в лог и обнуляет их
+    '''
+    global _histograms, _metrics_flushed_at
+    with _histograms_lock:
+        histograms, _histograms = _histograms, {}
+        _metrics_flushed_at = time.monotonic()
+    if histograms:
+        log_event('latency_histogram', buckets_ms=LATENCY_BUCKETS_MS, actions=histograms)
+
+def _record_request(metrics: Dict[str, Any], status: int, started: float) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    action = f"{metrics['method']} {metrics['action']}"
+    with _histograms_lock:
+        histogram = _histograms.get(action)
+        if histogram is None:
+            histogram = _histograms[action] = {'counts': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'requests': 0,
+                                               'queries': 0, 'errors': 0, 'total_ms': 0.0}
+        histogram['counts'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        histogram['requests'] += 1
+        histogram['queries'] += metrics.get('db_calls', 0)
+        histogram['errors'] += status >= 500
+        histogram['total_ms'] = round(histogram['total_ms'] + elapsed_ms, 3)
+    
+    if METRICS_SAMPLE_RATE > 0 and random.random() < METRICS_SAMPLE_RATE:
+        log_event('request', status=status, ms=round(elapsed_ms, 3),
+                  **{key: round(value, 3) if isinstance(value, float) else value for key, value in metrics.items()})
+    if 0 < METRICS_FLUSH_INTERVAL <= time.monotonic() - _metrics_flushed_at:
+        flush_metrics()
+
+def instrumented(func: Any) -> Any:
+    '''
+    Оборачивает handler(): собирает время запросов к БД, пула, JSON (и всего, что учтено через track) и общую задержку по действию
+    '''
+    @functools.wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        metrics = _request.metrics = {'method': event.get('httpMethod', 'GET'), 'action': '-'}
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = func(event, context)
+            status = response['statusCode']
+            return response
+        finally:
+            _request.metrics = None
+            _record_request(metrics, status, started)
+    return wrapper
+
+if METRICS_FLUSH_INTERVAL > 0:
+    atexit.register(flush_metrics)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+if orjson is not None:
+    def encode_json(payload: Any) -> str:
+        return orjson.dumps(payload, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+else:
+    def encode_json(payload: Any) -> str:
+        return json.dumps(payload, default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+def dumps(payload: Any) -> str:
+    started = time.perf_counter()
+    try:
+        return encode_json(payload)
+    finally:
+        track('json', started)
+
+def respond(status_code: int, payload: Any, headers: Dict[str, str] = JSON_HEADERS) -> Dict[str, Any]:
+    return {'statusCode': status_code, 'headers': headers, 'body': dumps(payload), 'isBase64Encoded': False}
+
+def respond_body(status_code: int, body: str, headers: Dict[str, str] = JSON_HEADERS) -> Dict[str, Any]:
+    return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+
+def error_response(status_code: int, message: str) -> Dict[str, Any]:
+    return respond(status_code, {'error': message})
+
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '')
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(7 * 24 * 3600)))
+# Отзыв токена начинает действовать не позже чем через REVOCATION_CACHE_TTL секунд
+REVOCATION_CACHE_TTL = float(os.environ.get('REVOCATION_CACHE_TTL', '30'))
+
+_revocations: Tuple[FrozenSet[str], Dict[int, int]] = (frozenset(), {})
+_revocations_loaded_at = float('-inf')
+_revocations_lock = threading.Lock()
+
+def b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def sign_payload(payload: str) -> bytes:
+    return hmac.new(SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+
+def revocations() -> Tuple[FrozenSet[str], Dict[int, int]]:
+    '''
+    Отозванные сессии: id токенов и «токены пользователя, выданные раньше момента»
+    Перечитываются из БД не чаще раза в REVOCATION_CACHE_TTL секунд
+    '''
+    global _revocations, _revocations_loaded_at
+    if time.monotonic() - _revocations_loaded_at < REVOCATION_CACHE_TTL:
+        return _revocations
+    
+    with _revocations_lock:
+        if time.monotonic() - _revocations_loaded_at >= REVOCATION_CACHE_TTL:
+            conn = get_conn()
+            try:
+                with conn.cursor() as revocation_cur:
+                    revocation_cur.execute(
+                        "SELECT jti, user_id, issued_before FROM revoked_sessions WHERE expires_at > CURRENT_TIMESTAMP"
+                    )
+                    token_ids, users = set(), {}
+                    for jti, user_id, issued_before in revocation_cur.fetchall():
+                        if jti:
+                            token_ids.add(jti)
+                        if user_id and issued_before:
+                            users[user_id] = max(users.get(user_id, 0), issued_before)
+                conn.commit()
+            finally:
+                put_conn(conn)
+            _revocations = (frozenset(token_ids), users)
+            _revocations_loaded_at = time.monotonic()
+    return _revocations
+
+def verify_session(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    Проверяет подписанный токен из заголовка X-Auth-Token в памяти, без запроса к БД на каждый вызов
+    Returns: данные сессии (sub, role, iat, exp, jti) или None, если токена нет или он недействителен
+    '''
+    headers = event.get('headers') or {}
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if not token or not SESSION_SECRET:
+        return None
+    
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(sign_payload(payload), b64decode(signature)):
+            return None
+        claims = json.loads(b64decode(payload))
+        if claims['exp'] < time.time():
+            return None
+    except (KeyError, TypeError, ValueError):
+        return None
+    
+    token_ids, users = revocations()
+    if claims['jti'] in token_ids or claims['iat'] < users.get(claims['sub'], 0):
+        return None
+    return claims
+
+# Redis (общие кэш и вёдра лимитов) отвечает за доли миллисекунды; дольше — значит недоступен
+CACHE_SOCKET_TIMEOUT = 0.2
+# После ошибки Redis столько секунд не опрашивается, запросы идут мимо него
+CACHE_RETRY_INTERVAL = float(os.environ.get('CACHE_RETRY_INTERVAL', '5'))
+
+# Множитель для всех лимитов; 0 отключает ограничение
+RATE_LIMIT_SCALE = float(os.environ.get('RATE_LIMIT_SCALE', '1'))
+# За одним адресом (NAT, мобильные операторы) бывает много пользователей
+RATE_LIMIT_IP_FACTOR = 5
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+
+class LocalRateLimitBackend:
+    '''
+    Token bucket в памяти процесса: (токены, время) на ключ, давно неактивные ключи
+    вытесняются по LRU; он же подменяет общее хранилище в тестах
+    '''
+    
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key: str, rate: float, burst: float) -> float:
+        '''
+        Забирает токен из ведра
+        Returns: 0, если запрос разрешён, иначе сколько секунд ждать следующего токена
+        '''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+RATE_LIMIT_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = clock[1] + clock[2] / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = math.min(burst, (tonumber(bucket[1]) or burst) + (now - (tonumber(bucket[2]) or now)) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+class RedisRateLimitBackend:
+    '''
+    Общие вёдра для всех экземпляров функции; проверка и списание атомарны (Lua),
+    время берётся с сервера Redis. При недоступности хранилища запросы пропускаются,
+    и CACHE_RETRY_INTERVAL секунд после ошибки оно не опрашивается
+    '''
+    
+    def __init__(self, url: str):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=CACHE_SOCKET_TIMEOUT,
+                                            socket_connect_timeout=CACHE_SOCKET_TIMEOUT)
+        self._script = self._client.register_script(RATE_LIMIT_SCRIPT)
+        self._errors = (redis.RedisError, OSError)
+        self._down_until = 0.0
+    
+    def take(self, key: str, rate: float, burst: float) -> float:
+        if time.monotonic() < self._down_until:
+            return 0.0
+        try:
+            return float(self._script(keys=[key], args=[rate, burst]))
+        except self._errors as e:
+            self._down_until = time.monotonic() + CACHE_RETRY_INTERVAL
+            log_event('rate_limit_unavailable', error=str(e))
+            return 0.0
+
+def make_rate_limit_backend() -> Any:
+    url = os.environ.get('RATE_LIMIT_URL') or os.environ.get('CACHE_URL')
+    if url:
+        try:
+            return RedisRateLimitBackend(url)
+        except ImportError as e:
+            # Без пакета redis вёдра у каждого экземпляра свои — лимит фактически умножается
+            log_event('rate_limit_backend_fallback', backend='local', error=str(e))
+    return LocalRateLimitBackend(RATE_LIMIT_MAX_KEYS)
+
+def client_ip(event: Dict[str, Any]) -> Optional[str]:
+    return ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+
+class RateLimiter:
+    '''
+    Лимиты функции на запись поверх вёдер backend: по пользователю и по адресу
+    Args: limits - действие -> (токенов в секунду, ёмкость ведра); default_name - имя
+          действия в ключах вёдер, когда action не передан
+    '''
+    
+    def __init__(self, limits: Dict[Optional[str], Tuple[float, float]], default_name: str, backend: Any = None):
+        self.limits = limits
+        self.default_name = default_name
+        self.backend = backend if backend is not None else make_rate_limit_backend()
+    
+    def check(self, event: Dict[str, Any], action: Optional[str], user_id: Any) -> Optional[Dict[str, Any]]:
+        '''
+        Проверяет вёдра пользователя и адреса для действия
+        Returns: ответ 429 с Retry-After или None, если запрос разрешён
+        '''
+        limit = self.limits.get(action)
+        if limit is None or RATE_LIMIT_SCALE <= 0:
+            return None
+        
+        rate, burst = limit[0] * RATE_LIMIT_SCALE, limit[1] * RATE_LIMIT_SCALE
+        name = action or self.default_name
+        wait = self.backend.take(f'rl:{name}:user:{user_id}', rate, burst)
+        ip = client_ip(event)
+        if not wait and ip:
+            wait = self.backend.take(f'rl:{name}:ip:{ip}', rate * RATE_LIMIT_IP_FACTOR, burst * RATE_LIMIT_IP_FACTOR)
+        if not wait:
+            return None
+        
+        retry_after = max(1, math.ceil(wait))
+        return respond(429, {'error': 'Too many requests', 'retry_after': retry_after},
+                       {**JSON_HEADERS, 'Retry-After': str(retry_after), 'Access-Control-Expose-Headers': 'Retry-After'})
+
+MAX_PAGE_SIZE = 50
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    '''
+    Разбирает непрозрачный курсор пагинации (created_at, id)
+    Raises: ValueError - если курсор повреждён
+    '''
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def page_size(params: Dict[str, Any], default: int = 20) -> int:
+    try:
+        return min(max(int(params.get('limit', default)), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return default
+
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '30'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+CACHE_GENERATION_KEY = 'videos:generation'
+
+class LocalCacheBackend:
+    '''
+    LRU-кэш с TTL в памяти процесса, когда CACHE_URL не задан
+    '''
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+    
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+class RedisCacheBackend:
+    '''
+    Общий кэш для всех экземпляров функции (Redis-совместимое хранилище)
+    Недоступный Redis не роняет запросы: чтение даёт промах, запись пропускается
+    '''
+    
+    def __init__(self, url: str):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=CACHE_SOCKET_TIMEOUT,
+                                            socket_connect_timeout=CACHE_SOCKET_TIMEOUT)
+        self._errors = (redis.RedisError, OSError)
+        self._down_until = 0.0
+    
+    def _call(self, operation: str, fallback: Any, *args: Any, **kwargs: Any) -> Any:
+        if time.monotonic() < self._down_until:
+            return fallback
+        try:
+            return getattr(self._client, operation)(*args, **kwargs)
+        except self._errors as e:
+            self._down_until = time.monotonic() + CACHE_RETRY_INTERVAL
+            log_event('cache_unavailable', operation=operation, error=str(e))
+            return fallback
+    
+    def get(self, key: str) -> Optional[str]:
+        value = self._call('get', None, key)
+        return value.decode() if value is not None else None
+    
+    def set(self, key: str, value: str, ttl: int) -> None:
+        # RESPONSE_CACHE_TTL=0 отключает кэш; Redis отвергает ex=0 как ошибку
+        if ttl > 0:
+            self._call('set', None, key, value, ex=ttl)
+    
+    def get_counter(self, key: str) -> int:
+        return int(self._call('get', None, key) or 0)
+    
+    def incr(self, key: str) -> int:
+        return int(self._call('incr', 0, key))
+
+def make_cache_backend() -> Any:
+    '''
+    RedisCacheBackend, если задан CACHE_URL, иначе LocalCacheBackend
+    '''
+    cache_url = os.environ.get('CACHE_URL')
+    if cache_url:
+        try:
+            return RedisCacheBackend(cache_url)
+        except ImportError as e:
+            # Без пакета redis сбросы поколений из других функций сюда не доходят
+            log_event('cache_backend_fallback', backend='local', error=str(e))
+    return LocalCacheBackend(RESPONSE_CACHE_MAX_ENTRIES)
+
+# Без CACHE_URL сброс из admin сюда не доходит и карточка может отставать на CHANNEL_CACHE_TTL, не больше минуты
+CHANNEL_CACHE_MAX_TTL = 60
+CHANNEL_CACHE_TTL = min(int(os.environ.get('CHANNEL_CACHE_TTL', '30')), CHANNEL_CACHE_MAX_TTL)
+CHANNEL_CACHE_MAX_ENTRIES = int(os.environ.get('CHANNEL_CACHE_MAX_ENTRIES', '4096'))
+# Счётчик в общем кэше: verify_user (admin) увеличивает его, карточки сбрасываются
+CHANNEL_GENERATION_KEY = 'channels:generation'
+# Поле карточки в ответе -> колонка users. Только редко меняющиеся поля: subscribers_count
+# растёт с каждой подпиской и читается вместе со строкой видео
+CHANNEL_FIELDS = {
+    'channel_name': 'name',
+    'channel_avatar': 'avatar_url',
+    'is_verified': 'is_verified',
+}
+
+class ChannelCache:
+    '''
+    Карточки каналов в памяти процесса: LRU с TTL по user_id
+    Лента из 20 видео — обычно несколько каналов, поэтому вместо JOIN users на каждую
+    строку недостающие карточки дочитываются одним запросом по первичному ключу
+    Счётчик CHANNEL_GENERATION_KEY опрашивается не чаще раза в ttl, а не на каждый запрос
+    Args: backend - кэш ответов, в котором лежит счётчик CHANNEL_GENERATION_KEY
+    '''
+    
+    def __init__(self, backend: Any, max_entries: int, ttl: int):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[int, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._generation = 0
+        self._generation_checked_at = float('-inf')
+        self._lock = threading.Lock()
+    
+    def get_many(self, cur: Any, ids: Set[int]) -> Dict[int, Dict[str, Any]]:
+        now = time.monotonic()
+        check_generation = self.ttl > 0 and now - self._generation_checked_at >= self.ttl
+        generation = self.backend.get_counter(CHANNEL_GENERATION_KEY) if check_generation else self._generation
+        cards: Dict[int, Dict[str, Any]] = {}
+        with self._lock:
+            if check_generation:
+                self._generation_checked_at = now
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+            for channel_id in ids:
+                entry = self._entries.get(channel_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(channel_id)
+                    cards[channel_id] = entry[1]
+        
+        missing = [channel_id for channel_id in ids if channel_id not in cards]
+        if not missing:
+            return cards
+        
+        cur.execute(
+            "SELECT id, name, avatar_url, is_verified FROM users WHERE id = ANY(%s)",
+            (missing,)
+        )
+        with self._lock:
+            for row in cur.fetchall():
+                card = {field: row[column] for field, column in CHANNEL_FIELDS.items()}
+                cards[row['id']] = card
+                if self.ttl > 0 and generation == self._generation:
+                    self._entries[row['id']] = (now + self.ttl, card)
+                    self._entries.move_to_end(row['id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cards
+
+    
+    def attach(self, cur: Any, videos: List[Dict[str, Any]],
+               fields: Tuple[str, ...] = ('channel_name', 'channel_avatar', 'is_verified')) -> List[Dict[str, Any]]:
+        '''
+        Дописывает к строкам videos поля карточки канала
+        '''
+        cards = self.get_many(cur, {video['user_id'] for video in videos})
+        projected = {channel_id: {field: card[field] for field in fields} for channel_id, card in cards.items()}
+        empty = dict.fromkeys(fields)
+        for video in videos:
+            video.update(projected.get(video['user_id'], empty))
+        return videos
+
+# Явный список колонок: служебный search_vector в ответы не попадает
+VIDEO_COLUMNS = """
+    v.id, v.user_id, v.title, v.description, v.video_url, v.thumbnail_url, v.duration,
+    v.views_count, v.likes_count, v.dislikes_count, v.category, v.status, v.is_moderated,
+    v.thumbnails, v.processing_status, v.created_at, v.updated_at
+"""
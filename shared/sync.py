@@ -0,0 +1,57 @@
+'''
+Раскладывает shared/handler_core.py по папкам функций backend
+
+Каждая облачная функция разворачивается только из своей папки и не видит соседних,
+поэтому ядро копируется в backend/<функция>/handler_core.py. Копии не правятся руками.
+
+Запуск:
+    python shared/sync.py            # обновить копии
+    python shared/sync.py --check    # код выхода 1, если какая-то копия отличается
+'''
+import argparse
+import os
+import sys
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'shared', 'handler_core.py')
+FUNCTIONS = ['videos', 'interactions', 'auth', 'admin']
+
+def copy_path(name: str) -> str:
+    return os.path.join(ROOT, 'backend', name, 'handler_core.py')
+
+def stale_copies(source: bytes) -> List[str]:
+    '''
+    Returns: функции, чья копия отсутствует или отличается от исходника
+    '''
+    stale = []
+    for name in FUNCTIONS:
+        try:
+            with open(copy_path(name), 'rb') as f:
+                if f.read() == source:
+                    continue
+        except FileNotFoundError:
+            pass
+        stale.append(name)
+    return stale
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='только проверить, что копии совпадают с исходником')
+    args = parser.parse_args()
+
+    with open(SOURCE, 'rb') as f:
+        source = f.read()
+    stale = stale_copies(source)
+    if args.check:
+        for name in stale:
+            print(f'backend/{name}/handler_core.py отличается от shared/handler_core.py', file=sys.stderr)
+        sys.exit(1 if stale else 0)
+
+    for name in stale:
+        with open(copy_path(name), 'wb') as f:
+            f.write(source)
+        print(f'обновлён backend/{name}/handler_core.py')
+
+if __name__ == '__main__':
+    main()
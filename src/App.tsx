@@ -27,7 +27,7 @@ function App() {
       });
       const data = await response.json();
       if (data.user) {
-        setCurrentUser(data.user);
+        setCurrentUser({ ...data.user, token: data.token });
         setIsAuthModalOpen(false);
       }
     } catch (error) {
@@ -44,7 +44,7 @@ function App() {
       });
       const data = await response.json();
       if (data.user) {
-        setCurrentUser(data.user);
+        setCurrentUser({ ...data.user, token: data.token });
         setIsAuthModalOpen(false);
       }
     } catch (error) {
@@ -52,7 +52,18 @@ function App() {
     }
   };
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    if (currentUser?.token) {
+      try {
+        await fetch('https://functions.poehali.dev/ca9a3cbe-8dd1-4252-b6a2-25f17acd1183', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json', 'X-Auth-Token': currentUser.token },
+          body: JSON.stringify({ action: 'logout' }),
+        });
+      } catch (error) {
+        console.error('Logout failed:', error);
+      }
+    }
     setCurrentUser(null);
   };
 
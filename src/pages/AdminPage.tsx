@@ -43,7 +43,7 @@ export default function AdminPage({ currentUser }: AdminPageProps) {
   const fetchStats = async () => {
     const response = await fetch('https://functions.poehali.dev/cdb0387a-0e1c-4752-8b13-b3b1f98b1cb4?action=stats', {
       headers: {
-        'X-User-Role': currentUser.role,
+        'X-Auth-Token': currentUser.token,
       },
     });
     const data = await response.json();
@@ -53,7 +53,7 @@ export default function AdminPage({ currentUser }: AdminPageProps) {
   const fetchReports = async () => {
     const response = await fetch('https://functions.poehali.dev/cdb0387a-0e1c-4752-8b13-b3b1f98b1cb4?action=reports', {
       headers: {
-        'X-User-Role': currentUser.role,
+        'X-Auth-Token': currentUser.token,
       },
     });
     const data = await response.json();
@@ -63,7 +63,7 @@ export default function AdminPage({ currentUser }: AdminPageProps) {
   const fetchUsers = async () => {
     const response = await fetch('https://functions.poehali.dev/cdb0387a-0e1c-4752-8b13-b3b1f98b1cb4?action=users', {
       headers: {
-        'X-User-Role': currentUser.role,
+        'X-Auth-Token': currentUser.token,
       },
     });
     const data = await response.json();
@@ -73,7 +73,7 @@ export default function AdminPage({ currentUser }: AdminPageProps) {
   const fetchVideos = async () => {
     const response = await fetch('https://functions.poehali.dev/cdb0387a-0e1c-4752-8b13-b3b1f98b1cb4?action=videos', {
       headers: {
-        'X-User-Role': currentUser.role,
+        'X-Auth-Token': currentUser.token,
       },
     });
     const data = await response.json();
@@ -85,13 +85,12 @@ export default function AdminPage({ currentUser }: AdminPageProps) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'X-User-Role': currentUser.role,
+        'X-Auth-Token': currentUser.token,
       },
       body: JSON.stringify({
         action: 'resolve_report',
         report_id: reportId,
         status,
-        reviewer_id: currentUser.id,
       }),
     });
     fetchReports();
@@ -102,7 +101,7 @@ export default function AdminPage({ currentUser }: AdminPageProps) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'X-User-Role': currentUser.role,
+        'X-Auth-Token': currentUser.token,
       },
       body: JSON.stringify({
         action: 'update_video_status',
@@ -118,7 +117,7 @@ export default function AdminPage({ currentUser }: AdminPageProps) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'X-User-Role': currentUser.role,
+        'X-Auth-Token': currentUser.token,
       },
       body: JSON.stringify({
         action: 'verify_user',
@@ -0,0 +1,26 @@
+import importlib.util
+import os
+import sys
+from typing import Any
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Тесты ядра импортируют исходник; копии в backend/ сверяет test_handler_core_sync.py
+sys.path.insert(0, os.path.join(ROOT, 'shared'))
+
+def load_function(name: str) -> Any:
+    '''
+    Импортирует index.py функции вместе с копией handler_core.py из её папки
+    '''
+    directory = os.path.join(ROOT, 'backend', name)
+    shared_core = sys.modules.pop('handler_core', None)
+    spec = importlib.util.spec_from_file_location(f'test_{name}_index', os.path.join(directory, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, directory)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+        sys.modules.pop('handler_core', None)
+        if shared_core is not None:
+            sys.modules['handler_core'] = shared_core
+    return module
@@ -0,0 +1,29 @@
+import pytest
+
+from conftest import load_function
+
+class UnreachableCursor:
+    def execute(self, query, params=None):
+        raise AssertionError('запрос к БД до проверки полей')
+
+@pytest.fixture
+def auth(monkeypatch):
+    monkeypatch.setenv('SESSION_SECRET', 'test-secret')
+    return load_function('auth')
+
+@pytest.mark.parametrize('body', [
+    {'email': 'a@example.com', 'password': 123, 'name': 'A'},
+    {'email': ['a@example.com'], 'password': 'secret', 'name': 'A'},
+    {'email': 'a@example.com', 'password': 'secret', 'name': {'first': 'A'}},
+])
+def test_register_rejects_non_string_fields(auth, body):
+    response = auth.register(None, UnreachableCursor(), body)
+    assert response['statusCode'] == 400
+
+@pytest.mark.parametrize('body', [
+    {'email': 'a@example.com', 'password': 123},
+    {'email': 7, 'password': 'secret'},
+])
+def test_login_rejects_non_string_fields(auth, body):
+    response = auth.login(None, UnreachableCursor(), body)
+    assert response['statusCode'] == 400
@@ -0,0 +1,10 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_function_copies_match_shared_core():
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'shared', 'sync.py'), '--check'],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,55 @@
+import pytest
+
+import handler_core
+from handler_core import LocalRateLimitBackend, RateLimiter, RedisRateLimitBackend
+
+EVENT = {'requestContext': {'identity': {'sourceIp': '10.0.0.1'}}}
+
+@pytest.fixture(autouse=True)
+def rate_limits_on(monkeypatch):
+    monkeypatch.setattr(handler_core, 'RATE_LIMIT_SCALE', 1.0)
+
+def test_exhausted_bucket_returns_429_with_retry_after():
+    limiter = RateLimiter({'comment': (0.2, 3)}, 'test', LocalRateLimitBackend(100))
+    for _ in range(3):
+        assert limiter.check(EVENT, 'comment', 1) is None
+    
+    response = limiter.check(EVENT, 'comment', 1)
+    assert response['statusCode'] == 429
+    assert response['headers']['Retry-After'] == '5'
+    assert '"retry_after":5' in response['body']
+    # Ведро другого пользователя не тронуто
+    assert limiter.check(EVENT, 'comment', 2) is None
+
+def test_ip_bucket_limits_many_users_behind_one_address():
+    limiter = RateLimiter({'comment': (0.2, 1)}, 'test', LocalRateLimitBackend(100))
+    allowed = [limiter.check(EVENT, 'comment', user_id) is None for user_id in range(10)]
+    assert allowed == [True] * handler_core.RATE_LIMIT_IP_FACTOR + [False] * (10 - handler_core.RATE_LIMIT_IP_FACTOR)
+
+def test_actions_without_limit_and_zero_scale_pass(monkeypatch):
+    limiter = RateLimiter({'comment': (0.2, 1)}, 'test', LocalRateLimitBackend(100))
+    assert all(limiter.check(EVENT, 'like_video', 1) is None for _ in range(10))
+    monkeypatch.setattr(handler_core, 'RATE_LIMIT_SCALE', 0.0)
+    assert all(limiter.check(EVENT, 'comment', 1) is None for _ in range(10))
+
+def test_local_backend_evicts_least_recently_used_keys():
+    backend = LocalRateLimitBackend(max_keys=2)
+    assert backend.take('a', 1, 1) == 0
+    assert backend.take('a', 1, 1) > 0
+    backend.take('b', 1, 1)
+    backend.take('c', 1, 1)
+    assert list(backend._buckets) == ['b', 'c']
+    # Вытесненный ключ начинает с полного ведра
+    assert backend.take('a', 1, 1) == 0
+    assert list(backend._buckets) == ['c', 'a']
+
+def test_redis_backend_fails_open_and_backs_off(monkeypatch):
+    pytest.importorskip('redis')
+    monkeypatch.setattr(handler_core, 'CACHE_RETRY_INTERVAL', 60.0)
+    backend = RedisRateLimitBackend('redis://127.0.0.1:1/0')
+    assert backend.take('k', 1, 1) == 0.0
+    
+    calls = []
+    monkeypatch.setattr(backend, '_script', lambda **kwargs: calls.append(kwargs))
+    assert backend.take('k', 1, 1) == 0.0
+    assert calls == []
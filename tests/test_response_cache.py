@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from handler_core import CHANNEL_GENERATION_KEY, ChannelCache, LocalCacheBackend
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+class FakeUsersCursor:
+    '''
+    Отвечает на запрос карточек каналов строками users и запоминает запрошенные id
+    '''
+    
+    def __init__(self):
+        self.queries = []
+        self.verified = False
+        self._rows = []
+    
+    def execute(self, query, params):
+        self.queries.append(sorted(params[0]))
+        self._rows = [{'id': user_id, 'name': f'channel {user_id}', 'avatar_url': None,
+                       'is_verified': self.verified} for user_id in params[0]]
+    
+    def fetchall(self):
+        return self._rows
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(time, 'monotonic', fake)
+    return fake
+
+def test_local_cache_evicts_least_recently_used(clock):
+    cache = LocalCacheBackend(max_entries=2)
+    cache.set('a', '1', 30)
+    cache.set('b', '2', 30)
+    assert cache.get('a') == '1'
+    cache.set('c', '3', 30)
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+
+def test_local_cache_expires_entries_after_ttl(clock):
+    cache = LocalCacheBackend(max_entries=10)
+    cache.set('feed', 'body', 30)
+    clock.now += 30
+    assert cache.get('feed') == 'body'
+    clock.now += 0.001
+    assert cache.get('feed') is None
+    assert len(cache._entries) == 0
+
+def test_local_cache_generation_counters():
+    cache = LocalCacheBackend(max_entries=10)
+    assert cache.get_counter('videos:generation') == 0
+    assert cache.incr('videos:generation') == 1
+    assert cache.incr('videos:generation') == 2
+    assert cache.get_counter('videos:generation') == 2
+    assert cache.get_counter('channels:generation') == 0
+
+class CountingBackend(LocalCacheBackend):
+    def __init__(self):
+        super().__init__(max_entries=10)
+        self.counter_reads = 0
+    
+    def get_counter(self, key):
+        self.counter_reads += 1
+        return super().get_counter(key)
+
+def test_channel_cache_polls_generation_once_per_ttl(clock):
+    backend = CountingBackend()
+    channels = ChannelCache(backend, max_entries=10, ttl=30)
+    cur = FakeUsersCursor()
+    for _ in range(5):
+        channels.get_many(cur, {1, 2})
+        clock.now += 5
+    assert backend.counter_reads == 1
+    clock.now += 5
+    channels.get_many(cur, {1, 2})
+    assert backend.counter_reads == 2
+
+def test_channel_cache_drops_cards_after_generation_bump(clock):
+    backend = LocalCacheBackend(max_entries=10)
+    channels = ChannelCache(backend, max_entries=10, ttl=30)
+    cur = FakeUsersCursor()
+    channels.get_many(cur, {1})
+    clock.now += 20
+    assert channels.get_many(cur, {2})[2]['is_verified'] is False
+    
+    cur.verified = True
+    backend.incr(CHANNEL_GENERATION_KEY)
+    clock.now += 5
+    channels.get_many(cur, {2})
+    assert cur.queries == [[1], [2]]
+    # Следующая проверка поколения сбрасывает и карточку, чей TTL ещё не истёк
+    clock.now += 5
+    assert channels.get_many(cur, {2})[2]['is_verified'] is True
+    assert cur.queries == [[1], [2], [2]]
+
+def test_channel_cache_expires_and_evicts_cards(clock):
+    channels = ChannelCache(LocalCacheBackend(max_entries=10), max_entries=2, ttl=30)
+    cur = FakeUsersCursor()
+    channels.get_many(cur, {1, 2, 3})
+    assert len(channels._entries) == 2
+    
+    clock.now += 31
+    channels.get_many(cur, {1})
+    assert cur.queries[-1] == [1]
@@ -0,0 +1,73 @@
+import pytest
+
+from conftest import load_function
+
+class FakeCursor:
+    def __init__(self):
+        self.queries = []
+    
+    def execute(self, query, params=None):
+        self.queries.append(query)
+    
+    def fetchone(self):
+        return {'id': 1, 'title': 'clip'}
+
+class FakeConnection:
+    def commit(self):
+        pass
+
+@pytest.fixture
+def videos(monkeypatch):
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('S3_ENDPOINT_URL', 'https://s3.amazonaws.com')
+    with moto.mock_aws():
+        module = load_function('videos')
+        module.s3.create_bucket(Bucket=module.S3_BUCKET)
+        yield module
+
+def start_upload(videos, body=b'video bytes'):
+    key = 'videos/7/clip.mp4'
+    upload_id = videos.s3.create_multipart_upload(Bucket=videos.S3_BUCKET, Key=key)['UploadId']
+    etag = videos.s3.upload_part(Bucket=videos.S3_BUCKET, Key=key, UploadId=upload_id, PartNumber=1,
+                                 Body=body)['ETag']
+    return {'action': 'upload_complete', 'user_id': 7, 'key': key, 'upload_id': upload_id, 'title': 'clip'}, etag
+
+def test_complete_upload_creates_video(videos):
+    body, etag = start_upload(videos)
+    cur = FakeCursor()
+    response = videos.upload_finish(FakeConnection(), cur, {**body, 'parts': [{'part_number': 1, 'etag': etag}]})
+    assert response['statusCode'] == 200
+    assert videos.s3.get_object(Bucket=videos.S3_BUCKET, Key=body['key'])['Body'].read() == b'video bytes'
+    assert 'INSERT INTO videos' in cur.queries[0]
+
+@pytest.mark.parametrize('parts', [
+    'abc',
+    {'part_number': 1, 'etag': 'x'},
+    [1],
+    [{'part_number': '1', 'etag': 'x'}],
+    [{'part_number': True, 'etag': 'x'}],
+    [{'part_number': 0, 'etag': 'x'}],
+    [{'part_number': 10001, 'etag': 'x'}],
+    [{'part_number': 1}],
+    [{'part_number': 1, 'etag': 5}],
+    [{'part_number': 1, 'etag': 'x'}, {'part_number': 1, 'etag': 'x'}],
+])
+def test_malformed_parts_are_rejected_before_s3(videos, parts):
+    body, _ = start_upload(videos)
+    cur = FakeCursor()
+    response = videos.upload_finish(FakeConnection(), cur, {**body, 'parts': parts})
+    assert response['statusCode'] == 400
+    assert 'Invalid parts' in response['body']
+    assert cur.queries == []
+    uploads = videos.s3.list_multipart_uploads(Bucket=videos.S3_BUCKET).get('Uploads', [])
+    assert [upload['UploadId'] for upload in uploads] == [body['upload_id']]
+
+def test_wrong_etag_is_reported_as_bad_request(videos):
+    body, _ = start_upload(videos)
+    cur = FakeCursor()
+    response = videos.upload_finish(FakeConnection(), cur, {**body, 'parts': [{'part_number': 1, 'etag': '"0"'}]})
+    assert response['statusCode'] == 400
+    assert cur.queries == []